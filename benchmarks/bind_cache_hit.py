@@ -0,0 +1,85 @@
+"""Bind latency for cache hits: one LdapProxy per BIND vs a shared one.
+
+Run from the repository root:
+
+    python -m benchmarks.bind_cache_hit --binds 20 --entries 2000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from bridge.cache import PersistentConcurrentCache
+from bridge.proxy import LdapProxy
+
+USERNAME = "bench@eduvaud.ch"
+PASSWORD = "password"
+
+
+class StubAuthenticator:
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def do_web_auth(self, username, password):
+        return True
+
+
+def fill_cache(entries):
+    cache = PersistentConcurrentCache("bridge")
+    cache.clear()
+    for i in range(entries):
+        cache[os.urandom(32).hex()] = os.urandom(60)
+    proxy = LdapProxy(StubAuthenticator(), cache)
+    proxy.do_auth(USERNAME, PASSWORD)
+    proxy.flush()
+
+
+def per_bind(binds):
+    timings = []
+    for _ in range(binds):
+        start = time.perf_counter()
+        proxy = LdapProxy(StubAuthenticator())
+        proxy.do_auth(USERNAME, PASSWORD)
+        del proxy
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def shared(binds):
+    proxy = LdapProxy(StubAuthenticator())
+    proxy.start()
+    timings = []
+    for _ in range(binds):
+        start = time.perf_counter()
+        proxy.do_auth(USERNAME, PASSWORD)
+        timings.append(time.perf_counter() - start)
+    proxy.shutdown()
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:>10}: mean={statistics.mean(timings) * 1000:8.2f}ms "
+          f"p50={statistics.median(timings) * 1000:8.2f}ms p95={p95 * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--binds", type=int, default=20)
+    parser.add_argument("--entries", type=int, default=2000, help="cache entries on disk")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        fill_cache(args.entries)
+        report("per-bind", per_bind(args.binds))
+        report("shared", shared(args.binds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""End-to-end bind throughput and latency through the real server request handler.
+
+The server (server.RequestHandler and LdapProxy, threaded or asyncio front end) runs in its own process
+on a loopback port, with the portal replaced by a stub of configurable latency and success rate. Its
+cache is warmed with ``--users`` accounts first: each bind then targets one of them (a cache hit) with
+probability ``--hit-ratio``, or a never seen account (a miss, answered by the stub). ``--concurrency``
+client threads bind for ``--duration`` seconds, reconnecting every ``--binds-per-connection`` binds
+(0 keeps one connection each).
+
+Results (throughput, p50/p95/p99 latency, result codes and the server metrics) are printed as JSON, or
+written to ``--output``, so that runs before and after a change can be compared. The server reads no
+``.env`` file: it runs on the defaults, overridden by ``--set``, with admission control disabled unless set.
+
+Run from the repository root:
+
+    python -m benchmarks.bind_throughput --concurrency 32 --hit-ratio 0.9 --latency 0.5 --output before.json
+    python -m benchmarks.bind_throughput --set cache_bcrypt_rounds=4 server_mode=asyncio --output after.json
+"""
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import socket
+import socketserver
+import statistics
+import tempfile
+import threading
+import time
+
+from ldapserver import asn1, ldap
+
+PASSWORD = "password"
+DEFAULT_SETTINGS = {"admission_user_rate": "0", "admission_backoff_after": "0", "cache_flush_interval": "0"}
+
+
+class StubAuthenticator:
+    """Portal answering after ``latency`` seconds, granting ``success_rate`` of the logins"""
+
+    def __init__(self, latency, success_rate):
+        self.latency = latency
+        self.success_rate = success_rate
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def do_web_auth(self, username, password):
+        time.sleep(self.latency)
+        return random.random() < self.success_rate
+
+
+def warm_username(index):
+    return f"bench-{index}@eduvaud.ch"
+
+
+def serve(settings, users, latency, success_rate, ready, stop, results):
+    # the server modules read .env through the config singleton, import them in the server process only
+    import asyncio
+    import server
+    from bridge.config import ConfigStore
+    from bridge.metrics import metrics
+    from bridge.proxy import LdapProxy
+    from ldapserver.aio import AsyncLDAPServer
+
+    store = ConfigStore(None, settings)
+    # warmed without the portal latency
+    authenticator = StubAuthenticator(0, 1)
+    proxy = LdapProxy(authenticator, config=store)
+    proxy.cache.clear()
+    for index in range(users):
+        proxy.do_auth(warm_username(index), PASSWORD)
+    authenticator.latency, authenticator.success_rate = latency, success_rate
+    proxy.start()
+    metrics.reset()
+    server.RequestHandler.proxy = proxy
+
+    if store.current.server_mode == "asyncio":
+        front = AsyncLDAPServer(server.RequestHandler, port=0, workers=store.current.server_workers)
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(front.start())
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+    else:
+        front = socketserver.ThreadingTCPServer(("127.0.0.1", 0), server.RequestHandler)
+        front.daemon_threads = True
+        threading.Thread(target=front.serve_forever, daemon=True).start()
+    ready.put(front.server_address)
+    stop.wait()
+    results.put(metrics.snapshot())
+    proxy.shutdown()
+
+
+def read_response(connection, buf):
+    while True:
+        try:
+            message, buf = ldap.ShallowLDAPMessage.from_ber(buf)
+        except asn1.IncompleteBERError:
+            chunk = connection.recv(65536)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            buf += chunk
+            continue
+        return message.decode()[0].protocolOp.resultCode, buf
+
+
+def client(address, deadline, users, hit_ratio, binds_per_connection, cold, timings, codes):
+    """Binds until ``deadline``, recording into its own ``timings`` list and ``codes`` counter"""
+    rng = random.Random()
+    message_ids = itertools.count(1)
+    while time.perf_counter() < deadline:
+        buf = b""
+        with socket.create_connection(address) as connection:
+            for _ in (range(binds_per_connection) if binds_per_connection else itertools.count()):
+                if time.perf_counter() >= deadline:
+                    break
+                if users and rng.random() < hit_ratio:
+                    username = warm_username(rng.randrange(users))
+                else:
+                    username = f"cold-{next(cold)}@eduvaud.ch"
+                request = ldap.LDAPMessage(next(message_ids), ldap.BindRequest(
+                    name=username, authentication=ldap.SimpleAuthentication(PASSWORD.encode())))
+                start = time.perf_counter()
+                connection.sendall(bytes(request))
+                code, buf = read_response(connection, buf)
+                timings.append(time.perf_counter() - start)
+                codes[code.name] += 1
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000 if timings else 0.0
+
+
+def run(args, settings):
+    context = multiprocessing.get_context("spawn")
+    ready, results, stop = context.Queue(), context.Queue(), context.Event()
+    server_process = context.Process(target=serve, args=(settings, args.users, args.latency, args.success_rate,
+                                                         ready, stop, results))
+    server_process.start()
+    address = ready.get()
+
+    # per client results, merged once they are done
+    client_timings = [[] for _ in range(args.concurrency)]
+    client_codes = [collections.Counter() for _ in range(args.concurrency)]
+    cold = itertools.count()
+    deadline = time.perf_counter() + args.duration
+    clients = [threading.Thread(target=client, args=(address, deadline, args.users, args.hit_ratio,
+                                                     args.binds_per_connection, cold, client_timings[index],
+                                                     client_codes[index]))
+               for index in range(args.concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    stop.set()
+    server_metrics = results.get()
+    server_process.join()
+
+    timings = sorted(itertools.chain.from_iterable(client_timings))
+    codes = sum(client_codes, collections.Counter())
+    return {
+        "parameters": dict(vars(args), settings=settings),
+        "binds": len(timings),
+        "throughput": len(timings) / args.duration,
+        "latency_ms": {"mean": statistics.mean(timings) * 1000 if timings else 0.0,
+                       "p50": percentile(timings, 0.5), "p95": percentile(timings, 0.95),
+                       "p99": percentile(timings, 0.99), "max": percentile(timings, 1)},
+        "results": dict(codes),
+        "server_metrics": server_metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--duration", type=float, default=10, help="in seconds")
+    parser.add_argument("--users", type=int, default=100, help="distinct cached accounts")
+    parser.add_argument("--hit-ratio", type=float, default=0.9, help="binds on cached accounts")
+    parser.add_argument("--binds-per-connection", type=int, default=0, help="0 reuses one connection")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub portal login, in seconds")
+    parser.add_argument("--success-rate", type=float, default=1.0, help="stub portal logins granted")
+    parser.add_argument("--set", nargs="*", default=[], metavar="SETTING=VALUE", help="server settings")
+    parser.add_argument("--output", help="JSON results file (default: printed)")
+    args = parser.parse_args()
+    settings = dict(DEFAULT_SETTINGS, **dict(setting.split("=", 1) for setting in args.set))
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # cache files
+        result = run(args, settings)
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+        latency = result["latency_ms"]
+        print(f"{result['throughput']:,.0f} binds/s, p50={latency['p50']:.2f}ms p95={latency['p95']:.2f}ms "
+              f"p99={latency['p99']:.2f}ms, {result['results']} -> {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Multi-threaded cache contention: one global lock (1 shard) vs lock-striped shards.
+
+Each thread plays concurrent binds against the cache: mostly get_if_valid hits on its share of the
+users, plus a fraction of writes (cache misses turned into entries).
+
+Run from the repository root:
+
+    python -m benchmarks.cache_contention --threads 1 8 64 --shards 1 16 64
+"""
+import argparse
+import os
+import threading
+import time
+
+from bridge.cache import PersistentConcurrentCache
+
+
+def drive(cache, users, threads, operations, write_ratio):
+    keys = [os.urandom(32).hex() for _ in range(users)]
+    for key in keys:
+        cache[key] = b"verifier"
+    barrier = threading.Barrier(threads + 1)
+    write_every = int(1 / write_ratio) if write_ratio > 0 else 0
+
+    def worker(index):
+        mine = keys[index::threads] or keys
+        barrier.wait()
+        for i in range(operations):
+            key = mine[i % len(mine)]
+            if write_every and i % write_every == 0:
+                cache[key] = b"verifier"
+            else:
+                cache.get_if_valid(key)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * operations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--operations", type=int, default=20000, help="per thread")
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{'threads':>7} " + " ".join(f"{f'{shards} shards':>14}" for shards in args.shards) + "  (ops/s)")
+    for threads in args.threads:
+        results = []
+        for shards in args.shards:
+            cache = PersistentConcurrentCache(persist=False, maxsize=args.users * 2, shards=shards)
+            results.append(drive(cache, args.users, threads, args.operations, args.write_ratio))
+        print(f"{threads:>7} " + " ".join(f"{result:>14,.0f}" for result in results))
+
+
+if __name__ == '__main__':
+    main()
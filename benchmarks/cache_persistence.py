@@ -0,0 +1,79 @@
+"""Per-write cost and restart time: full cache pickle vs snapshot + append-only journal.
+
+Run from the repository root:
+
+    python -m benchmarks.cache_persistence --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+import cachetools
+
+from bridge.cache import PersistentConcurrentCache
+
+
+def entry():
+    return os.urandom(32).hex(), os.urandom(60)
+
+
+def full_pickle(size, writes):
+    cache = cachetools.TTLCache(maxsize=size, ttl=3600)
+    for _ in range(size):
+        key, value = entry()
+        cache[key] = value
+    start = time.perf_counter()
+    for _ in range(writes):
+        key, value = entry()
+        cache[key] = value
+        with open("cache-legacy.pickle", "wb") as fs:
+            pickle.dump(cache, fs)
+    per_write = (time.perf_counter() - start) / writes
+
+    start = time.perf_counter()
+    with open("cache-legacy.pickle", "rb") as fs:
+        pickle.load(fs)
+    return per_write, time.perf_counter() - start
+
+
+def journal(size, writes, compact_threshold):
+    cache = PersistentConcurrentCache("journal", maxsize=size, compact_threshold=compact_threshold)
+    for _ in range(size):
+        key, value = entry()
+        cache[key] = value
+    cache.flush()
+    start = time.perf_counter()
+    for _ in range(writes):
+        key, value = entry()
+        cache[key] = value
+    per_write = (time.perf_counter() - start) / writes
+
+    start = time.perf_counter()
+    restarted = PersistentConcurrentCache("journal", maxsize=size, compact_threshold=compact_threshold)
+    restart = time.perf_counter() - start
+    assert len(restarted) == size
+    return per_write, restart
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--writes", type=int, default=20, help="timed writes (full pickle: one dump each)")
+    parser.add_argument("--journal-writes", type=int, default=5000, help="timed journal appends")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        print(f"{'entries':>9} | {'pickle write':>13} {'pickle restart':>15} | {'journal write':>14} "
+              f"{'journal restart':>16}")
+        for size in args.sizes:
+            pickle_write, pickle_restart = full_pickle(size, args.writes)
+            journal_write, journal_restart = journal(size, args.journal_writes, args.journal_writes + 1)
+            print(f"{size:>9} | {pickle_write * 1000:>11.3f}ms {pickle_restart * 1000:>13.1f}ms | "
+                  f"{journal_write * 1000:>12.3f}ms {journal_restart * 1000:>14.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
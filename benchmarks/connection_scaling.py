@@ -0,0 +1,142 @@
+"""Connection scaling: threaded (one thread per connection) vs asyncio LDAP server front end.
+
+Opens many idle connections, like pooled application connections, then measures a steady stream of
+binds and searches from a few busy clients. Each server mode runs in its own process, which holds both
+ends of every connection (two file descriptors each, the soft limit is raised to the hard one).
+
+Run from the repository root:
+
+    python -m benchmarks.connection_scaling --idle 10000 --clients 16 --duration 10
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import resource
+import socket
+import socketserver
+import statistics
+import threading
+import time
+
+from ldapserver import LDAPRequestHandler, asn1, ldap
+from ldapserver.aio import AsyncLDAPServer
+
+
+class StubHandler(LDAPRequestHandler):
+    bind_seconds = 0.002  # a cache hit
+
+    def do_bind_simple_authenticated(self, dn, password):
+        time.sleep(self.bind_seconds)
+        return dn
+
+
+class ThreadedServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_threaded():
+    server = ThreadedServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address
+
+
+def start_asyncio(workers):
+    server = AsyncLDAPServer(StubHandler, port=0, workers=workers)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return server.server_address
+
+
+def rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def read_until(connection, buf, op_type):
+    while True:
+        try:
+            message, buf = ldap.ShallowLDAPMessage.from_ber(buf)
+        except asn1.IncompleteBERError:
+            chunk = connection.recv(65536)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            buf += chunk
+            continue
+        if message.protocolOpType is op_type:
+            return buf
+
+
+def busy_client(address, deadline, timings):
+    bind = bytes(ldap.LDAPMessage(1, ldap.BindRequest(name="cn=bench", authentication=ldap.SimpleAuthentication(b"x"))))
+    search = bytes(ldap.LDAPMessage(2, ldap.SearchRequest(scope=ldap.SearchScope.baseObject)))
+    buf = b""
+    with socket.create_connection(address) as connection:
+        while time.perf_counter() < deadline:
+            for request, response_type in ((bind, ldap.BindResponse), (search, ldap.SearchResultDone)):
+                start = time.perf_counter()
+                connection.sendall(request)
+                buf = read_until(connection, buf, response_type)
+                timings.append(time.perf_counter() - start)
+
+
+def run(mode, idle, clients, duration, workers):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    address = start_threaded() if mode == "threaded" else start_asyncio(workers)
+    baseline_threads, baseline_rss = threading.active_count(), rss_mb()
+
+    idle_connections = [socket.create_connection(address) for _ in range(idle)]
+    time.sleep(1)  # lets the server accept them all
+    server_threads = threading.active_count() - baseline_threads
+    idle_rss = rss_mb() - baseline_rss
+
+    timings = []
+    deadline = time.perf_counter() + duration
+    busy = [threading.Thread(target=busy_client, args=(address, deadline, timings)) for _ in range(clients)]
+    for thread in busy:
+        thread.start()
+    for thread in busy:
+        thread.join()
+    for connection in idle_connections:
+        connection.close()
+
+    timings.sort()
+    return {"mode": mode, "threads": server_threads, "rss": idle_rss, "ops": len(timings) / duration,
+            "p50": statistics.median(timings) * 1000 if timings else 0.0,
+            "p99": timings[int(len(timings) * 0.99)] * 1000 if timings else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=("threaded", "asyncio"), default=["threaded", "asyncio"])
+    parser.add_argument("--idle", type=int, default=1000, help="idle connections")
+    parser.add_argument("--clients", type=int, default=16, help="busy connections")
+    parser.add_argument("--duration", type=float, default=5, help="in seconds")
+    parser.add_argument("--workers", type=int, default=AsyncLDAPServer.DEFAULT_WORKERS, help="asyncio executor")
+    args = parser.parse_args()
+
+    print(f"{args.idle} idle connections, {args.clients} busy clients (bind + search) for {args.duration}s")
+    print(f"{'mode':>9} {'threads':>8} {'idle rss':>10} {'ops/s':>10} {'p50':>9} {'p99':>9}")
+    context = multiprocessing.get_context("spawn")
+    for mode in args.modes:
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+            result = executor.submit(run, mode, args.idle, args.clients, args.duration, args.workers).result()
+        print(f"{result['mode']:>9} {result['threads']:>8} {result['rss']:>8.1f}MB {result['ops']:>10,.0f} "
+              f"{result['p50']:>7.2f}ms {result['p99']:>7.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""LDAP load generator: many pipelined connections replaying a weighted mix of binds, searches and compares.
+
+Requests are encoded with the ldapserver codec before the run: only the message ID is framed per request,
+so encoding stays out of the measured latencies and no ldaptor/Twisted client is needed. Each of the
+``connections`` connections keeps up to ``pipeline`` operations in flight (the ldapserver front ends
+answer the messages of a connection in order), optionally after an initial bind. A paged search sends its
+next page request once a page is done, every page is one timed round trip. Latencies are recorded as
+histograms per operation type, along with result codes, and printed as JSON or written to ``--output``.
+
+The workload file is JSON, ``{n}`` in DNs, passwords and values is replaced by a random integer below
+``users`` (see benchmarks/ldap_load.json). An operation using ``{n}`` is encoded once per user before the
+run, which takes about 30 ms per thousand users:
+
+    {"connections": 50, "pipeline": 4, "duration": 10, "users": 100,
+     "bind_first": {"dn": "app@eduvaud.ch", "password": "secret"},
+     "operations": [
+        {"type": "bind", "weight": 8, "dn": "user-{n}@eduvaud.ch", "password": "password-{n}"},
+        {"type": "search", "weight": 1, "base": "dc=example,dc=org", "scope": "wholeSubtree",
+         "filter": "(cn=user-{n})", "attributes": ["cn"], "page_size": 100},
+        {"type": "compare", "weight": 1, "dn": "cn=user-{n},dc=example,dc=org", "attribute": "cn",
+         "value": "user-{n}"}]}
+
+Run from the repository root, against a running server:
+
+    python -m benchmarks.ldap_load benchmarks/ldap_load.json --port 3890 --connections 200 --output load.json
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import time
+
+from bridge.metrics import Histogram
+from ldapserver import asn1, ldap
+
+MESSAGE_TAG = (0, True, 16)
+
+
+def encode_message(message_id: int, op_ber: bytes, controls_ber: bytes = b"") -> bytes:
+    return asn1.encode_ber(asn1.BERObject(MESSAGE_TAG, asn1.Integer.to_ber(message_id) + op_ber + controls_ber))
+
+
+def paged_controls(size: int, cookie: bytes = b"") -> bytes:
+    value = ldap.PagedResultsValue.to_ber(ldap.PagedResultsValue(size, cookie))
+    return ldap.Controls.to_ber([ldap.Control(ldap.PAGED_RESULTS_OID, False, value)])
+
+
+def parse_filter(text: str) -> ldap.Filter:
+    """``(attribute=value)`` and ``(attribute=*)``, the objectClass presence filter when empty"""
+    if not text:
+        return ldap.FilterPresent("objectClass")
+    attribute, value = text.strip("()").split("=", 1)
+    if value == "*":
+        return ldap.FilterPresent(attribute)
+    return ldap.FilterEqual(attribute, value.encode())
+
+
+class Operation:
+    """An operation of the workload, with its requests encoded ahead for every value of ``{n}`` below ``users``"""
+
+    def __init__(self, spec: dict, users: int):
+        self.type = spec["type"]
+        self.weight = spec.get("weight", 1)
+        self.page_size = spec.get("page_size", 0)
+        self.controls = paged_controls(self.page_size) if self.page_size else b""
+        variants = max(1, users) if "{n}" in json.dumps(spec) else 1
+        self.requests = [self._encode(spec, n) for n in range(variants)]
+
+    @staticmethod
+    def _format(value: str, n: int) -> str:
+        return value.replace("{n}", str(n))
+
+    def _encode(self, spec: dict, n: int) -> bytes:
+        request = self._request(spec, n)
+        return type(request).to_ber(request)
+
+    def _request(self, spec: dict, n: int):
+        if self.type == "bind":
+            return ldap.BindRequest(name=self._format(spec["dn"], n), authentication=ldap.SimpleAuthentication(
+                self._format(spec["password"], n).encode()))
+        if self.type == "search":
+            return ldap.SearchRequest(baseObject=self._format(spec.get("base", ""), n),
+                                      scope=ldap.SearchScope[spec.get("scope", "wholeSubtree")],
+                                      filter=parse_filter(self._format(spec.get("filter", ""), n)),
+                                      attributes=spec.get("attributes", []))
+        if self.type == "compare":
+            return ldap.CompareRequest(entry=self._format(spec["dn"], n), ava=ldap.AttributeValueAssertion(
+                spec["attribute"], self._format(spec["value"], n).encode()))
+        raise ValueError(f"Unknown operation type {self.type}")
+
+
+class Results:
+    def __init__(self):
+        self.histograms = collections.defaultdict(Histogram)
+        self.samples = collections.defaultdict(list)
+        self.codes = collections.defaultdict(collections.Counter)
+        self.entries = 0
+        self.errors = collections.Counter()
+
+    def record(self, op_type: str, seconds: float, code: ldap.LDAPResultCode):
+        self.histograms[op_type].observe(seconds)
+        self.samples[op_type].append(seconds)
+        self.codes[op_type][code.name] += 1
+
+    def report(self, duration: float) -> dict:
+        operations = {}
+        for op_type, histogram in sorted(self.histograms.items()):
+            operations[op_type] = dict(histogram_snapshot(histogram, self.samples[op_type]),
+                                       throughput=histogram.count / duration, results=dict(self.codes[op_type]))
+        return {"operations": operations, "entries": self.entries, "errors": dict(self.errors)}
+
+
+def histogram_snapshot(histogram: Histogram, samples: list) -> dict:
+    """[upper bound, count] buckets, with exact percentiles (in seconds) from the samples"""
+    samples = sorted(samples)
+
+    def percentile(rank):
+        return samples[min(len(samples) - 1, int(len(samples) * rank))] if samples else 0.0
+
+    return {"count": histogram.count, "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+            "max": histogram.max, "p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99),
+            "buckets": [list(bucket) for bucket in zip(histogram.buckets + ("inf",), histogram.counts)]}
+
+
+class Connection:
+    def __init__(self, workload: dict, operations: list, results: Results, deadline: float):
+        self._workload = workload
+        self._operations = operations
+        self._weights = list(itertools.accumulate(op.weight for op in operations))
+        self._results = results
+        self._deadline = deadline
+        self._message_ids = itertools.count(1)
+        self._pending = {}  # message ID: (operation, start, done future)
+        self._slots = asyncio.Semaphore(workload["pipeline"])
+        self._writer = None
+
+    async def run(self, host: str, port: int):
+        reader, self._writer = await asyncio.open_connection(host, port)
+        receiving = asyncio.ensure_future(self._receive(reader))
+        try:
+            bind_first = self._workload.get("bind_first")
+            if bind_first:
+                first = Operation(dict(bind_first, type="bind"), 1)
+                await self._send(first, first.requests[0], b"")
+            while time.perf_counter() < self._deadline:
+                await self._slots.acquire()
+                operation = random.choices(self._operations, cum_weights=self._weights)[0]
+                asyncio.ensure_future(self._run_operation(operation))
+            for _ in range(self._workload["pipeline"]):
+                await self._slots.acquire()
+        finally:
+            receiving.cancel()
+            self._writer.close()
+
+    async def _run_operation(self, operation: Operation):
+        try:
+            request = random.choice(operation.requests)
+            cookie = await self._send(operation, request, operation.controls)
+            while cookie and time.perf_counter() < self._deadline:
+                cookie = await self._send(operation, request, paged_controls(operation.page_size, cookie))
+        except (ConnectionError, asyncio.CancelledError) as error:
+            self._results.errors[type(error).__name__] += 1
+        finally:
+            self._slots.release()
+
+    async def _send(self, operation: Operation, request: bytes, controls: bytes):
+        message_id = next(self._message_ids)
+        message = encode_message(message_id, request, controls)
+        done = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = (operation, time.perf_counter(), done)
+        self._writer.write(message)
+        await self._writer.drain()
+        return await done
+
+    async def _receive(self, reader):
+        buf = b""
+        try:
+            while True:
+                try:
+                    shallow, buf = ldap.ShallowLDAPMessage.from_ber(buf)
+                except asn1.IncompleteBERError:
+                    chunk = await reader.read(65536)
+                    if not chunk:
+                        return
+                    buf += chunk
+                    continue
+                if shallow.protocolOpType is ldap.SearchResultEntry:
+                    self._results.entries += 1
+                    continue
+                if shallow.messageID not in self._pending:
+                    continue
+                operation, start, done = self._pending.pop(shallow.messageID)
+                elapsed = time.perf_counter() - start
+                # decoded after the latency is taken
+                message = shallow.decode()[0]
+                self._results.record(operation.type, elapsed, message.protocolOp.resultCode)
+                done.set_result(next_page_cookie(message) if operation.page_size else None)
+        finally:
+            for _, _, done in self._pending.values():
+                if not done.done():
+                    done.set_exception(ConnectionError("server closed the connection"))
+            self._pending.clear()
+
+
+def next_page_cookie(message: ldap.LDAPMessage) -> bytes:
+    for control in message.controls or []:
+        if control.controlType == ldap.PAGED_RESULTS_OID and control.controlValue:
+            return ldap.PagedResultsValue.from_ber(control.controlValue)[0].cookie
+    return b""
+
+
+async def load(workload: dict, host: str, port: int) -> dict:
+    operations = [Operation(spec, workload.get("users", 1)) for spec in workload["operations"]]
+    results = Results()
+    started = time.perf_counter()
+    deadline = started + workload["duration"]
+    connections = [Connection(workload, operations, results, deadline) for _ in range(workload["connections"])]
+    outcomes = await asyncio.gather(*(connection.run(host, port) for connection in connections),
+                                    return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            results.errors[type(outcome).__name__] += 1
+    return dict(results.report(time.perf_counter() - started), workload=workload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("workload", help="JSON workload file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3890)
+    parser.add_argument("--connections", type=int, help="overrides the workload")
+    parser.add_argument("--pipeline", type=int, help="operations in flight per connection, overrides the workload")
+    parser.add_argument("--duration", type=float, help="in seconds, overrides the workload")
+    parser.add_argument("--output", help="JSON results file (default: printed)")
+    args = parser.parse_args()
+
+    with open(args.workload) as file:
+        workload = dict({"connections": 10, "pipeline": 1, "duration": 10, "users": 1}, **json.load(file))
+    for name in ("connections", "pipeline", "duration"):
+        if getattr(args, name) is not None:
+            workload[name] = getattr(args, name)
+
+    result = asyncio.run(load(workload, args.host, args.port))
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+        for op_type, stats in result["operations"].items():
+            print(f"{op_type:>8}: {stats['throughput']:,.0f}/s p50={stats['p50'] * 1000:.1f}ms "
+                  f"p95={stats['p95'] * 1000:.1f}ms p99={stats['p99'] * 1000:.1f}ms {stats['results']}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
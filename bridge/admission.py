@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from typing import Union
+
+from cachetools import LRUCache
+
+from bridge.metrics import metrics
+from ldapserver import exceptions
+
+
+class RateLimiter:
+    """Token buckets per key (client IP, username): ``rate`` binds per minute, up to ``burst`` at once.
+
+    Only the ``maxsize`` most recently seen keys are tracked, a forgotten key starts again with a full bucket."""
+
+    DEFAULT_MAX_KEYS = 10000
+
+    def __init__(self, name: str, rate: float, burst: int, maxsize: int = DEFAULT_MAX_KEYS, timer=time.monotonic):
+        self._name = name
+        self._rate = rate / 60
+        self._burst = max(1, burst)
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._buckets = LRUCache(maxsize)  # key: (tokens, updated)
+
+    def allow(self, key) -> bool:
+        with self._lock:
+            now = self._timer()
+            tokens, updated = self._buckets.get(key, (self._burst, now))
+            tokens = min(self._burst, tokens + (now - updated) * self._rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        if not allowed:
+            metrics.increment(f"admission.{self._name}.rejected")
+        return allowed
+
+
+class FailureBackoff:
+    """Spaces out the attempts of a key after ``after`` consecutive failures: the next attempt waits
+    ``base`` seconds, doubled with every further failure up to ``maximum``. A success forgets the key."""
+
+    def __init__(self, after: int, base: float, maximum: float, maxsize: int = RateLimiter.DEFAULT_MAX_KEYS,
+                 timer=time.monotonic):
+        self._after = after
+        self._base = base
+        self._maximum = maximum
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._failures = LRUCache(maxsize)  # key: (consecutive failures, next attempt allowed at)
+
+    def allow(self, key) -> bool:
+        with self._lock:
+            entry = self._failures.get(key)
+            allowed = entry is None or self._timer() >= entry[1]
+        if not allowed:
+            metrics.increment("admission.backoff.rejected")
+        return allowed
+
+    def failed(self, key):
+        with self._lock:
+            failures = self._failures.get(key, (0, 0))[0] + 1
+            delay = 0 if failures < self._after else min(self._maximum, self._base * 2 ** (failures - self._after))
+            self._failures[key] = (failures, self._timer() + delay)
+            metrics.gauge("admission.backoff.keys", len(self._failures))
+
+    def succeeded(self, key):
+        with self._lock:
+            if self._failures.pop(key, None) is not None:
+                metrics.gauge("admission.backoff.keys", len(self._failures))
+
+
+class AdmissionControl:
+    """Throttles binds: per client IP rate limit before any hashing or portal work (:meth:`admit`), per
+    username backoff after wrong passwords rejected by the portal and rate limit on portal logins only
+    (:meth:`admit_login`), so that cache hits are never throttled. Throttled binds get
+    :class:`exceptions.LDAPBusy`.
+
+    A rate of 0 (or ``backoff_after`` 0) disables the corresponding check."""
+
+    DEFAULT_USER_RATE = 30  # per minute
+    DEFAULT_USER_BURST = 10
+    DEFAULT_BACKOFF_AFTER = 3  # consecutive wrong passwords
+    DEFAULT_BACKOFF_BASE = 1  # in seconds
+    DEFAULT_BACKOFF_MAX = 300  # in seconds
+
+    def __init__(self, ip_rate: float = 0, ip_burst: int = 0, user_rate: float = DEFAULT_USER_RATE,
+                 user_burst: int = DEFAULT_USER_BURST, backoff_after: int = DEFAULT_BACKOFF_AFTER,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_max: float = DEFAULT_BACKOFF_MAX,
+                 maxsize: int = RateLimiter.DEFAULT_MAX_KEYS, timer=time.monotonic):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._by_ip = None  # type: Union[None, RateLimiter]
+        if ip_rate > 0:
+            self._by_ip = RateLimiter("ip", ip_rate, ip_burst, maxsize, timer)
+        self._by_user = None  # type: Union[None, RateLimiter]
+        if user_rate > 0:
+            self._by_user = RateLimiter("user", user_rate, user_burst, maxsize, timer)
+        self._backoff = None  # type: Union[None, FailureBackoff]
+        if backoff_after > 0:
+            self._backoff = FailureBackoff(backoff_after, backoff_base, backoff_max, maxsize, timer)
+
+    def admit(self, client_ip: Union[None, str]):
+        if client_ip is not None and self._by_ip is not None and not self._by_ip.allow(client_ip):
+            self._logger.warning(f"Too many binds from {client_ip}")
+            raise exceptions.LDAPBusy("Too many binds from this address")
+
+    def admit_login(self, username: str):
+        username = username.lower()
+        if self._backoff is not None and not self._backoff.allow(username):
+            self._logger.warning(f"Backing off {username} after wrong passwords")
+            raise exceptions.LDAPBusy("Too many failed binds, retry later")
+        if self._by_user is not None and not self._by_user.allow(username):
+            self._logger.warning(f"Too many binds for {username}")
+            raise exceptions.LDAPBusy("Too many binds for this user")
+
+    def failed(self, username: str):
+        if self._backoff is not None:
+            self._backoff.failed(username.lower())
+
+    def succeeded(self, username: str):
+        if self._backoff is not None:
+            self._backoff.succeeded(username.lower())
@@ -0,0 +1,35 @@
+import abc
+
+from bridge.config import ConfigStore, config as default_config
+
+
+class Authenticator(abc.ABC):
+    """Checks credentials against the upstream portal, see :class:`bridge.web.WebAuthenticator`
+    (Selenium driven browser) and :class:`bridge.httpauth.HttpFormAuthenticator` (plain HTTP forms)."""
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    @abc.abstractmethod
+    def do_web_auth(self, username, password) -> bool:
+        pass
+
+    @staticmethod
+    def is_landed(login_url: str, landed_url: str, landed_url_pattern: str) -> bool:
+        # if login success => go to microsoft portal o365, otherwise stays on eduvaud sts
+        landed_url = landed_url.lower()
+        return landed_url != login_url and landed_url_pattern in landed_url
+
+
+def create_authenticator(config: ConfigStore = default_config) -> Authenticator:
+    engine = config.current.auth_engine
+    if engine == "http":
+        from bridge.httpauth import HttpFormAuthenticator
+        return HttpFormAuthenticator(config=config)
+    if engine != "selenium":
+        raise ValueError(f"Unknown auth_engine {engine}")
+    from bridge.web import WebAuthenticator
+    return WebAuthenticator(config=config)
@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+
+from bridge.metrics import metrics
+from ldapserver import exceptions
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+
+class CircuitBreaker:
+    """Stops calling a failing upstream.
+
+    Calls raising an exception (other than :class:`exceptions.LDAPError`, which are local refusals) or
+    lasting more than ``slow_call`` seconds count as failures. After ``failure_threshold`` consecutive
+    failures the breaker opens: calls fail fast with :class:`exceptions.LDAPUnavailable` for
+    ``open_seconds``. It then lets a single trial call through (half open), which closes it again on
+    success or reopens it on failure. The state is published as the ``breaker.<name>.state`` gauge
+    (0 closed, 1 half open, 2 open)."""
+
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_SLOW_CALL = 30  # in seconds
+    DEFAULT_OPEN_SECONDS = 30
+
+    def __init__(self, name: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 slow_call: float = DEFAULT_SLOW_CALL, open_seconds: float = DEFAULT_OPEN_SECONDS,
+                 timer=time.monotonic):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._slow_call = slow_call
+        self._open_seconds = open_seconds
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        """Current state, open turning half open once ``open_seconds`` have elapsed"""
+        with self._lock:
+            if self._state == OPEN and self._timer() - self._opened_at >= self._open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def publish(self):
+        """Applies the open to half open transition due on time (not on a call) and publishes the gauge"""
+        with self._lock:
+            self._half_open_if_due()
+            metrics.gauge(f"breaker.{self._name}.state", STATES.index(self._state))
+
+    def call(self, fn, *args):
+        trial = self._acquire()
+        started = self._timer()
+        try:
+            result = fn(*args)
+        except exceptions.LDAPError:
+            self._release(trial, None)
+            raise
+        except Exception:
+            self._release(trial, False)
+            raise
+        self._release(trial, self._timer() - started <= self._slow_call)
+        return result
+
+    def _acquire(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return False
+            self._half_open_if_due()
+            if self._state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+        metrics.increment(f"breaker.{self._name}.rejected")
+        raise exceptions.LDAPUnavailable(f"{self._name} is unavailable")
+
+    def _release(self, trial: bool, success):
+        """``success`` is None when the call neither succeeded nor failed upstream"""
+        with self._lock:
+            if trial:
+                self._trial_running = False
+            if success is None:
+                return
+            if success:
+                self._failures = 0
+                if trial:
+                    self._set_state(CLOSED)
+                return
+            metrics.increment(f"breaker.{self._name}.failures")
+            self._failures += 1
+            if trial or self._state == CLOSED and self._failures >= self._failure_threshold:
+                self._opened_at = self._timer()
+                self._set_state(OPEN)
+
+    def _half_open_if_due(self):
+        if self._state == OPEN and self._timer() - self._opened_at >= self._open_seconds:
+            self._set_state(HALF_OPEN)
+
+    def _set_state(self, state: str):
+        if state != self._state:
+            self._logger.warning(f"{self._name} circuit {state}")
+            if state == OPEN:
+                metrics.increment(f"breaker.{self._name}.trips")
+        self._state = state
+        metrics.gauge(f"breaker.{self._name}.state", STATES.index(state))
@@ -0,0 +1,165 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Union
+
+from bridge.metrics import metrics
+
+
+class _Browser:
+    def __init__(self, host):
+        self.host = host  # driver owning the Chrome process
+        self.debugger_address = host.capabilities["goog:chromeOptions"]["debuggerAddress"]
+        self.contexts = 0
+        self.broken = False
+
+
+class _Lane:
+    def __init__(self, browser: _Browser):
+        self.browser = browser
+        self.context_id = None  # type: Union[None, str]
+
+
+class BrowserFleet:
+    """Chrome processes shared by the pooled drivers, each login in its own incognito browser context.
+
+    A browser is started by ``launch`` (a driver owning the Chrome process) when every running one already
+    holds ``contexts`` contexts. A pooled driver (a lane) is ``attach``-ed to the debugger address of the
+    least loaded browser and drives one tab of a fresh browser context: cookies and storage never leak
+    between contexts, and replacing the context after a login (:meth:`recycle`, the pool reset) takes a
+    few CDP commands instead of a Chrome start. ``setup`` is called on a lane once switched to a new tab.
+
+    A browser failing to attach a lane gets no new lanes, and is quit once its last lane is closed."""
+
+    def __init__(self, launch: Callable, attach: Callable, contexts: int, setup: Callable = None):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._launch = launch
+        self._attach = attach
+        self._contexts = max(1, contexts)
+        self._setup = setup
+        self._lock = threading.Lock()
+        self._launching = threading.Lock()
+        self._browsers = []  # type: List[_Browser]
+        self._lanes = {}  # type: Dict[object, _Lane]
+
+    def open(self):
+        """Driver attached to a browser, on a tab of a new browser context"""
+        browser = self._reserve()
+        try:
+            driver = self._attach(browser.debugger_address)
+        except Exception:
+            self._logger.warning(f"Cannot attach to browser {browser.debugger_address}, retiring it")
+            self._release(browser, broken=True)
+            raise
+        lane = _Lane(browser)
+        try:
+            lane.context_id = self._new_context(driver)
+        except Exception:
+            self._logger.warning(f"Cannot open a browser context on {browser.debugger_address}, retiring it")
+            self._quit(driver)
+            self._release(browser, broken=True)
+            raise
+        with self._lock:
+            self._lanes[driver] = lane
+        return driver
+
+    def recycle(self, driver):
+        """Moves the driver to a new browser context, the previous one (and its tab) is disposed"""
+        lane = self._lanes[driver]
+        previous, lane.context_id = lane.context_id, self._new_context(driver)
+        driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": previous})
+
+    def close(self, driver, healthy: bool = True):
+        """Disposes the browser context of the driver and detaches it, the browser keeps running. A driver
+        retired after an error gets its browser checked: a browser no longer answering gets no new lanes."""
+        with self._lock:
+            lane = self._lanes.pop(driver, None)
+        if lane is None:
+            self._quit(driver)
+            return
+        try:
+            driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": lane.context_id})
+        except Exception as error:
+            self._logger.debug(f"Cannot dispose browser context, error:{error}")
+        # drivers attached by debugger address leave the browser running
+        self._quit(driver)
+        self._release(lane.browser, broken=not healthy and not self._responds(lane.browser))
+
+    def _responds(self, browser: _Browser) -> bool:
+        try:
+            browser.host.execute_cdp_cmd("Browser.getVersion", {})
+            return True
+        except Exception as error:
+            self._logger.warning(f"Browser {browser.debugger_address} does not respond, retiring it, error:{error}")
+            return False
+
+    def _new_context(self, driver) -> str:
+        # created first: the commands go through the current tab, the one of the previous context
+        context_id = driver.execute_cdp_cmd("Target.createBrowserContext",
+                                            {"disposeOnDetach": False})["browserContextId"]
+        target_id = driver.execute_cdp_cmd("Target.createTarget",
+                                           {"url": "about:blank", "browserContextId": context_id})["targetId"]
+        # chromedriver window handles are the CDP target IDs
+        driver.switch_to.window(target_id)
+        if self._setup is not None:
+            self._setup(driver)
+        return context_id
+
+    def _reserve(self) -> _Browser:
+        with self._lock:
+            browser = self._least_loaded()
+            if browser is not None:
+                browser.contexts += 1
+                return browser
+        # one browser starts at a time, the lanes waiting for it share it if it has room
+        with self._launching:
+            with self._lock:
+                browser = self._least_loaded()
+                if browser is not None:
+                    browser.contexts += 1
+                    return browser
+            browser = _Browser(self._launch())
+            self._logger.debug(f"Browser started at {browser.debugger_address}")
+            with self._lock:
+                browser.contexts += 1
+                self._browsers.append(browser)
+                self._publish()
+            return browser
+
+    def _least_loaded(self) -> Union[None, _Browser]:
+        available = [browser for browser in self._browsers
+                     if not browser.broken and browser.contexts < self._contexts]
+        return min(available, key=lambda browser: browser.contexts) if available else None
+
+    def _release(self, browser: _Browser, broken: bool = False):
+        with self._lock:
+            browser.contexts -= 1
+            browser.broken = browser.broken or broken
+            retire = browser.broken and browser.contexts == 0 and browser in self._browsers
+            if retire:
+                self._browsers.remove(browser)
+            self._publish()
+        if retire:
+            self._quit(browser.host)
+
+    def _publish(self):
+        metrics.gauge("fleet.browsers", len(self._browsers))
+        metrics.gauge("fleet.contexts", sum(browser.contexts for browser in self._browsers))
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception as error:
+            self._logger.debug(f"Cannot quit driver, error:{error}")
+
+    def shutdown(self):
+        with self._lock:
+            browsers = list(self._browsers)
+            self._browsers.clear()
+            self._lanes.clear()
+            self._publish()
+        for browser in browsers:
+            self._quit(browser.host)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._browsers)
@@ -1,78 +1,356 @@
+import contextlib
 import logging
 import os
 import pickle
+import random
+import sys
 import threading
-from typing import Union
+import time
+from typing import Callable, Union
 
 import cachetools
 
+from bridge import journal
+from bridge.journal import CacheJournal
+from bridge.metrics import metrics
+
+SNAPSHOT_VERSION = 2
+# key string, dict slots, LRU link and expiry heap item of an entry, on top of its value (estimated)
+ENTRY_OVERHEAD = 400
+
+
+def expiry_time(ttl: float, jitter: float = 0, now: float = None) -> float:
+    """Wall-clock expiry of an entry written ``now``, ``ttl`` shortened by up to ``jitter`` (0-1) of it at
+    random so that entries written together do not all expire together"""
+    if now is None:
+        now = time.time()
+    return now + ttl * (1 - random.uniform(0, jitter))
+
+
+def _entry_size(entry):
+    return ENTRY_OVERHEAD + sys.getsizeof(entry[0])
+
+
+class _Segment(cachetools.TLRUCache):
+    """TLRU cache (LRU eviction of entries with their own expiry, kept ``grace`` seconds past it) counting
+    what leaves it"""
+
+    def __init__(self, maxsize, getsizeof=None, grace: float = 0):
+        super().__init__(maxsize=maxsize, ttu=lambda key, entry, now: entry[1] + grace, timer=time.time,
+                         getsizeof=getsizeof)
+        self.evictions = 0
+        self.expirations = 0
+
+    def expire(self, time=None):
+        before = cachetools.Cache.__len__(self)
+        super().expire(time)
+        self.expirations += before - cachetools.Cache.__len__(self)
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+
+class _Shard:
+    def __init__(self, maxsize: int, getsizeof=None, grace: float = 0):
+        self.lock = threading.RLock()
+        self.entries = _Segment(maxsize, getsizeof, grace)
+        self.hits = 0
+        self.misses = 0
+
 
 class PersistentConcurrentCache:
+    """Thread safe TTL cache, persisted as a snapshot (``cache-<name>.pickle``) plus an append-only
+    journal of the writes made since (``cache-<name>.journal``).
+
+    Keys hash to ``shards`` independently locked segments, so concurrent binds on different users do
+    not wait on one global lock. Capacity is ``maxsize`` entries, or an estimated ``max_bytes`` when
+    given, split evenly between shards (so it is approximate); beyond it the least recently used
+    entries are evicted. Expired entries are reclaimed lazily or by :meth:`expire` (see
+    :class:`CacheSweeper`).
+    Entries carry their wall-clock expiry, shortened at random by up to ``ttl_jitter`` (0-1) of the ttl,
+    so they keep it across restarts. Expired entries stay available to :meth:`get_stale` for ``grace``
+    seconds (they still count in the capacity meanwhile). The journal is compacted
+    into a new snapshot on :meth:`flush` or once it holds ``compact_threshold`` records."""
+
     DEFAULT_CACHE_TTL = 12  # in hours
+    DEFAULT_MAX_SIZE = 2345
+    DEFAULT_COMPACT_THRESHOLD = 10000  # journal records
+    DEFAULT_SHARDS = 16
 
-    def __init__(self, name: str = None, persist: bool = True, ttl: int = 60 * 60 * DEFAULT_CACHE_TTL):
+    def __init__(self, name: str = None, persist: bool = True, ttl: int = 60 * 60 * DEFAULT_CACHE_TTL,
+                 maxsize: int = DEFAULT_MAX_SIZE, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD,
+                 fsync: bool = False, shards: int = DEFAULT_SHARDS, max_bytes: int = 0,
+                 ttl_jitter: float = 0, grace: int = 0):
         self._logger = logging.getLogger(self.__class__.__qualname__)
         self._persist = persist
         self._ttl = ttl
+        self._ttl_jitter = ttl_jitter
+        self._grace = grace
+        self._maxsize = maxsize
+        self._compact_threshold = compact_threshold
         if name is None and persist is True:
             self._logger.warning("No name given for persistent logger, generating a random one")
             name = os.urandom(10).hex()
         self.name = name
         self.filename = f'cache-{name}.pickle'
-        self._cache = None  # type: Union[None, cachetools.TTLCache]
-        self._lock = threading.RLock()
+        self._max_bytes = max_bytes
+        capacity = max_bytes if max_bytes > 0 else maxsize
+        shards = max(1, min(shards, capacity))
+        self._shards = [_Shard(-(-capacity // shards), _entry_size if max_bytes > 0 else None, grace)
+                        for _ in range(shards)]
+        self._journal = CacheJournal(f'cache-{name}.journal', fsync) if persist else None
+        self._journal_lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
 
         self._init_cache()
 
     def __del__(self):
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+
+    def flush(self):
         if self._persist:
             self.save_to_disk()
 
     def save_to_disk(self):
+        """Compacts the journal into a new snapshot, written atomically (temp file + rename)"""
+        with self._compaction_lock:
+            self._compact()
+
+    def _compact(self):
         try:
-            with open(self.filename, "wb") as fs:
-                pickle.dump(self._cache, fs)
+            with self._all_shards():
+                now = time.time()
+                entries = [(key, value, expires) for shard in self._shards
+                           for key, (value, expires) in shard.entries.items() if expires + self._grace > now]
+                with self._journal_lock:
+                    self._journal.rotate()
+            journal.write_atomically(self.filename, {"version": SNAPSHOT_VERSION, "entries": entries})
+            self._journal.discard_rotated()
             self._logger.debug(f"cache dumped to {self.filename}")
         except (pickle.PickleError, OSError) as error:
             self._logger.warning(f"Cannot persist cache to {self.filename}, error:{error}")
 
-    def _init_cache(self):
-        if self._persist and os.path.isfile(self.filename):
+    def _compact_if_needed(self):
+        if self._journal is not None and self._journal.records >= self._compact_threshold \
+                and self._compaction_lock.acquire(blocking=False):
             try:
-                with open(self.filename, "rb") as fs:
-                    self._cache = pickle.load(fs)
-                self._logger.debug(f"Cache loaded from {self.filename} with {self._cache.currsize} entries")
-            except OSError:
-                pass
+                self._compact()
+            finally:
+                self._compaction_lock.release()
+
+    @contextlib.contextmanager
+    def _all_shards(self):
+        with contextlib.ExitStack() as stack:
+            for shard in self._shards:
+                stack.enter_context(shard.lock)
+            yield
+
+    def _shard(self, key) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _init_cache(self):
+        self._logger.debug(f"Initializing cache")
+        if self._persist:
+            self._load_snapshot()
+            self._replay_journal()
+            self._journal.open()
+        self._logger.debug(f"->DONE")
+
+    def _load_snapshot(self):
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            snapshot = journal.read_snapshot(self.filename)
+        except (pickle.PickleError, OSError, EOFError) as error:
+            self._logger.warning(f"Cannot load cache from {self.filename}, error:{error}")
+            return
+        now = time.time()
+        if isinstance(snapshot, cachetools.Cache):
+            # previous format, the whole TTLCache pickled: original expiry times are lost
+            entries = [(key, cachetools.Cache.__getitem__(snapshot, key),
+                        expiry_time(self._ttl, self._ttl_jitter, now)) for key in list(snapshot)]
         else:
-            self._logger.debug(f"Initializing cache")
-            self._cache = cachetools.TTLCache(maxsize=2345, ttl=self._ttl)
-            self._logger.debug(f"->DONE")
+            entries = snapshot["entries"]
+        for key, value, expires in entries:
+            if expires + self._grace > now:
+                self._shard(key).entries[key] = (value, expires)
+        self._logger.debug(f"Cache loaded from {self.filename} with {len(self)} entries")
+
+    def _replay_journal(self):
+        now = time.time()
+        for op, key, value, expires in self._journal.replay():
+            if op == journal.PUT:
+                if expires + self._grace > now:
+                    self._shard(key).entries[key] = (value, expires)
+                else:
+                    self._shard(key).entries.pop(key, None)
+            elif op == journal.DELETE:
+                self._shard(key).entries.pop(key, None)
+            elif op == journal.CLEAR:
+                for shard in self._shards:
+                    shard.entries.clear()
+        self._logger.debug(f"Journal replayed, {len(self)} entries")
+
+    def _log(self, op, key=None, value=None, expires=None):
+        if self._journal is None:
+            return
+        with self._journal_lock:
+            self._journal.append(op, key, value, expires)
+
+    def get_if_valid(self, key, default=None):
+        """Value of a non expired entry, ``default`` otherwise, in a single locked lookup"""
+        entry = self.get_with_expiry(key)
+        return default if entry is None else entry[0]
+
+    def get_with_expiry(self, key):
+        """``(value, expires)`` of a non expired entry, None otherwise"""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                shard.misses += 1
+                return None
+            shard.hits += 1
+        return entry
+
+    def peek(self, key, default=None):
+        """:meth:`get_if_valid` leaving the hit and miss counts, and the LRU order, untouched"""
+        shard = self._shard(key)
+        with shard.lock:
+            if key not in shard.entries:
+                return default
+            value, expires = cachetools.Cache.__getitem__(shard.entries, key)
+        return value if expires > time.time() else default
+
+    def get_stale(self, key):
+        """``(value, expires)`` of an entry, even expired less than ``grace`` seconds ago, None otherwise"""
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.entries.get(key)
 
     def exists(self, key):
-        with self._lock:
-            return self._cache.get(key) is not None
+        return self.get_if_valid(key) is not None
+
+    def get(self, key, default=None):
+        return self.get_if_valid(key, default)
+
+    def pop(self, key, default=None):
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.pop(key, None)
+            if entry is None:
+                return default
+            self._log(journal.DELETE, key)
+        self._compact_if_needed()
+        return entry[0] if entry[1] > time.time() else default
+
+    def keys(self):
+        keys = []
+        for shard in self._shards:
+            with shard.lock:
+                keys.extend(shard.entries.keys())
+        return keys
 
     def put_if_absent(self, key, value):
-        with self._lock:
+        shard = self._shard(key)
+        with shard.lock:
             if not self.exists(key):
                 self[key] = value
                 return value
             return None
 
     def __setitem__(self, key, value):
-        with self._lock:
-            self._cache[key] = value
-            pass
+        shard = self._shard(key)
+        with shard.lock:
+            expires = expiry_time(self._ttl, self._ttl_jitter)
+            shard.entries[key] = (value, expires)
+            self._log(journal.PUT, key, value, expires)
+        self._compact_if_needed()
 
     def __getitem__(self, item):
-        with self._lock:
-            return self._cache[item]
+        entry = self.get_with_expiry(item)
+        if entry is None:
+            raise KeyError(item)
+        return entry[0]
 
     def __len__(self):
-        with self._lock:
-            return self._cache.currsize
+        size = 0
+        for shard in self._shards:
+            with shard.lock:
+                size += len(shard.entries)
+        return size
+
+    def expire(self) -> int:
+        """Reclaims every expired entry now, returns how many were removed"""
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                before = len(shard.entries)
+                shard.entries.expire()
+                removed += before - len(shard.entries)
+        return removed
+
+    def stats(self) -> dict:
+        stats = {"entries": 0, "hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        for shard in self._shards:
+            with shard.lock:
+                stats["entries"] += len(shard.entries)
+                stats["hits"] += shard.hits
+                stats["misses"] += shard.misses
+                stats["evictions"] += shard.entries.evictions
+                stats["expirations"] += shard.entries.expirations
+                if self._max_bytes > 0:
+                    stats["bytes"] = stats.get("bytes", 0) + shard.entries.currsize
+        return stats
 
     def clear(self):
-        with self._lock:
-            return self._cache.clear()
+        with self._all_shards():
+            for shard in self._shards:
+                shard.entries.clear()
+            self._log(journal.CLEAR)
+        self._compact_if_needed()
+
+
+class CacheSweeper:
+    """Reclaims expired entries of the given caches every ``interval`` seconds and publishes their
+    :meth:`stats` as ``cache.<name>.<stat>`` gauges, then calls ``after_sweep`` if given"""
+
+    DEFAULT_INTERVAL = 60  # in seconds
+
+    def __init__(self, caches: list, interval: int = DEFAULT_INTERVAL, after_sweep: Callable = None):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._caches = caches
+        self._interval = interval
+        self._after_sweep = after_sweep
+        self._stopping = threading.Event()
+        self._thread = None  # type: Union[None, threading.Thread]
+
+    def start(self):
+        if self._interval > 0 and self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._sweep_periodically, name="cache-sweeper", daemon=True)
+            self._thread.start()
+
+    def sweep(self):
+        for cache in self._caches:
+            removed = cache.expire()
+            if removed:
+                self._logger.debug(f"{removed} expired entries reclaimed from {cache.name}")
+            for stat, value in cache.stats().items():
+                metrics.gauge(f"cache.{cache.name}.{stat}", value)
+        if self._after_sweep is not None:
+            self._after_sweep()
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sweep_periodically(self):
+        while not self._stopping.wait(self._interval):
+            self.sweep()
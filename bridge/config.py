@@ -0,0 +1,283 @@
+import logging
+import os
+import threading
+from typing import Callable, List, Mapping, Union
+
+from dotenv import dotenv_values
+
+from bridge.admission import AdmissionControl, RateLimiter
+from bridge.breaker import CircuitBreaker
+from bridge.cache import CacheSweeper, PersistentConcurrentCache
+from bridge.credentials import CredentialHasher, LEGACY_SALT
+from bridge.executor import BoundedExecutor
+from bridge.pool import DriverPool
+from bridge.refresh import BackgroundRefresher
+
+AUTH_ENGINES = ("selenium", "http")
+CACHE_BACKENDS = ("memory", "sqlite")
+SERVER_MODES = ("threaded", "asyncio")
+PAGE_LOAD_STRATEGIES = ("eager", "normal", "none")
+BLOCKABLE_RESOURCES = ("images", "fonts", "media", "stylesheets")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Config:
+    """Settings of the bridge, parsed and validated once from a ``.env`` style mapping (see ``.env.example``).
+
+    Instances are never modified: a reload builds a new one, see :class:`ConfigStore`."""
+
+    DEFAULT_PORT = 3890
+    DEFAULT_SERVER_WORKERS = 64
+    DEFAULT_FLUSH_INTERVAL = 5  # in minutes
+    DEFAULT_NEGATIVE_CACHE_TTL = 60  # in seconds
+    DEFAULT_NEGATIVE_CACHE_SIZE = 1000
+    DEFAULT_TTL_JITTER = 10  # in percent of cache_ttl
+    DEFAULT_EARLY_EXPIRY = 10  # in percent of cache_ttl
+    DEFAULT_HTTP_POOL_SIZE = 10
+    DEFAULT_SLOW_LANE_WORKERS = 16
+    DEFAULT_SLOW_LANE_MAX_WAIT = 30000  # in ms
+    DEFAULT_SLOW_LANE_MAX_QUEUE = 200  # about what 16 workers clear within the max wait, at 2 s per login
+    DEFAULT_XTTL = 10  # in seconds
+
+    def __init__(self, values: Mapping[str, str] = None):
+        self._values = os.environ if values is None else values
+
+        # server
+        self.log = self._str("log", "INFO")
+        self.listen = self._str("listen", "127.0.0.1")
+        self.port = self._int("port", Config.DEFAULT_PORT)
+        self.server_mode = self._choice("server_mode", SERVER_MODES)
+        self.server_workers = self._int("server_workers", Config.DEFAULT_SERVER_WORKERS)
+        # 0 = one per cpu
+        self.server_processes = self._int("server_processes", 1)
+        self.metrics_interval = self._int("metrics_interval", 0)
+        self.config_watch_interval = self._int("config_watch_interval", 0)
+
+        # hashing
+        self.salt = self._hex("salt", LEGACY_SALT)
+        self.cache_key = self._hex("cache_key", self.salt.hex())
+        self.cache_bcrypt_rounds = self._int("cache_bcrypt_rounds", CredentialHasher.DEFAULT_ROUNDS)
+        self.hash_workers = self._int("hash_workers", os.cpu_count())
+        self.hash_max_wait = self._int("hash_max_wait", BoundedExecutor.DEFAULT_MAX_WAIT) / 1000
+        self.hash_max_queue = self._int("hash_max_queue", 0)
+
+        # cache, durations in seconds
+        # pre-fork workers can only share the sqlite cache
+        self.cache_backend = self._choice("cache_backend", CACHE_BACKENDS,
+                                          "sqlite" if self.server_processes != 1 else "memory")
+        if self.server_processes != 1 and self.cache_backend != "sqlite":
+            raise ConfigError("server_processes other than 1 needs cache_backend=sqlite")
+        self.cache_ttl = self._int("cache_ttl", PersistentConcurrentCache.DEFAULT_CACHE_TTL) * 60 * 60
+        self.cache_ttl_jitter = self._int("cache_ttl_jitter", Config.DEFAULT_TTL_JITTER) / 100
+        self.cache_refresh_ahead = self._bool("cache_refresh_ahead", False)
+        # without refresh ahead, an early expired hit waits for a portal login: off unless set
+        self.cache_early_expiry = self._int("cache_early_expiry", Config.DEFAULT_EARLY_EXPIRY
+                                            if self.cache_refresh_ahead else 0) / 100
+        self.cache_refresh_rate = self._int("cache_refresh_rate", BackgroundRefresher.DEFAULT_RATE)
+        self.cache_refresh_queue = self._int("cache_refresh_queue", BackgroundRefresher.DEFAULT_MAX_QUEUE)
+        self.cache_stale_grace = self._int("cache_stale_grace", 0) * 60
+        self.cache_max_size = self._int("cache_max_size", 0 if self.cache_backend == "sqlite"
+                                        else PersistentConcurrentCache.DEFAULT_MAX_SIZE)
+        self.cache_max_bytes = self._int("cache_max_bytes", 0)
+        self.cache_sweep_interval = self._int("cache_sweep_interval", CacheSweeper.DEFAULT_INTERVAL)
+        self.cache_flush_interval = self._int("cache_flush_interval", Config.DEFAULT_FLUSH_INTERVAL) * 60
+        self.cache_compact_threshold = self._int("cache_compact_threshold",
+                                                 PersistentConcurrentCache.DEFAULT_COMPACT_THRESHOLD)
+        self.cache_fsync = self._bool("cache_fsync", False)
+        self.cache_shards = self._int("cache_shards", PersistentConcurrentCache.DEFAULT_SHARDS)
+        self.negative_cache_ttl = self._int("negative_cache_ttl", Config.DEFAULT_NEGATIVE_CACHE_TTL)
+        self.negative_cache_size = self._int("negative_cache_size", Config.DEFAULT_NEGATIVE_CACHE_SIZE)
+        if self.cache_backend == "memory" and self.cache_max_size < 1 and self.cache_max_bytes <= 0:
+            raise ConfigError("cache_max_size must be 1 or more with the memory backend (or set cache_max_bytes)")
+        if self.negative_cache_size < 1:
+            raise ConfigError("negative_cache_size must be 1 or more")
+
+        # admission control, rates per minute, backoff durations in seconds
+        self.admission_ip_rate = self._int("admission_ip_rate", 0)
+        self.admission_ip_burst = self._int("admission_ip_burst", 0)
+        self.admission_user_rate = self._int("admission_user_rate", AdmissionControl.DEFAULT_USER_RATE)
+        self.admission_user_burst = self._int("admission_user_burst", AdmissionControl.DEFAULT_USER_BURST)
+        self.admission_backoff_after = self._int("admission_backoff_after", AdmissionControl.DEFAULT_BACKOFF_AFTER)
+        self.admission_backoff_base = self._int("admission_backoff_base", AdmissionControl.DEFAULT_BACKOFF_BASE)
+        self.admission_backoff_max = self._int("admission_backoff_max", AdmissionControl.DEFAULT_BACKOFF_MAX)
+        self.admission_max_keys = self._int("admission_max_keys", RateLimiter.DEFAULT_MAX_KEYS)
+
+        # auth engine
+        self.auth_engine = self._choice("auth_engine", AUTH_ENGINES)
+        self.http_pool_size = self._int("http_pool_size", Config.DEFAULT_HTTP_POOL_SIZE)
+        # binds missing the cache, max wait in ms
+        self.slow_lane_workers = self._int("slow_lane_workers", Config.DEFAULT_SLOW_LANE_WORKERS)
+        self.slow_lane_max_wait = self._int("slow_lane_max_wait", Config.DEFAULT_SLOW_LANE_MAX_WAIT) / 1000
+        self.slow_lane_max_queue = self._int("slow_lane_max_queue", Config.DEFAULT_SLOW_LANE_MAX_QUEUE)
+        self.breaker_failures = self._int("breaker_failures", CircuitBreaker.DEFAULT_FAILURE_THRESHOLD)
+        self.breaker_slow_call = self._int("breaker_slow_call", CircuitBreaker.DEFAULT_SLOW_CALL)
+        self.breaker_open = self._int("breaker_open", CircuitBreaker.DEFAULT_OPEN_SECONDS)
+
+        # web elements
+        self.ua = self._str("ua", None)
+        self.xttl = self._int("xttl", Config.DEFAULT_XTTL)
+        self.portal_url = self._str("portal_url", None)
+        self.xusername = self._str("xusername", None)
+        self.xsubmit1 = self._str("xsubmit1", None)
+        self.xpassword = self._str("xpassword", None)
+        self.xsubmit2 = self._str("xsubmit2", None)
+        self.xlanded = self._str("xlanded", None)
+        self.xfailed = self._str("xfailed", None)
+        self.landed_url_pattern = self._str("landed_url_pattern", None)
+
+        # chrome webdriver
+        self.detach = self._bool("detach", False)
+        self.headless = self._bool("headless", True)
+        # eager: pages count as loaded once parsed, without waiting for images and stylesheets
+        self.page_load_strategy = self._choice("page_load_strategy", PAGE_LOAD_STRATEGIES)
+        self.block_resources = self._list("block_resources", "images,fonts,media")
+        unknown = set(self.block_resources) - set(BLOCKABLE_RESOURCES)
+        if unknown:
+            raise ConfigError(f"block_resources must be among {', '.join(BLOCKABLE_RESOURCES)}, "
+                              f"got {', '.join(sorted(unknown))}")
+        self.block_urls = self._list("block_urls", "")
+        self.web_transfer_stats = self._bool("web_transfer_stats", False)
+        self.pool_size = self._int("pool_size", DriverPool.DEFAULT_SIZE)
+        self.pool_warmup = self._int("pool_warmup", DriverPool.DEFAULT_WARMUP)
+        self.pool_max_uses = self._int("pool_max_uses", DriverPool.DEFAULT_MAX_USES)
+        self.pool_max_heap_mb = self._int("pool_max_heap_mb", 0)
+        self.pool_prime = self._bool("pool_prime", True)
+        self.pool_prime_max_age = self._int("pool_prime_max_age", DriverPool.DEFAULT_PRIME_MAX_AGE)
+        self.pool_contexts_per_browser = self._int("pool_contexts_per_browser", 0)
+        if self.pool_contexts_per_browser < 0:
+            raise ConfigError("pool_contexts_per_browser must be 0 (one browser per driver) or more")
+
+        del self._values
+
+    def _str(self, name: str, default: Union[None, str]) -> Union[None, str]:
+        return self._values.get(name, default)
+
+    def _int(self, name: str, default: int) -> int:
+        value = self._values.get(name)
+        if value is None or value == "":
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ConfigError(f"{name} must be an integer, got {value}")
+
+    def _bool(self, name: str, default: bool) -> bool:
+        value = self._values.get(name)
+        if value is None or value == "":
+            return default
+        if value.lower() not in ("true", "false"):
+            raise ConfigError(f"{name} must be true or false, got {value}")
+        return value.lower() == "true"
+
+    def _hex(self, name: str, default: str) -> bytes:
+        value = self._values.get(name) or default
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            raise ConfigError(f"{name} must be hexadecimal")
+
+    def _list(self, name: str, default: str) -> List[str]:
+        """Comma separated values"""
+        value = self._values.get(name, default)
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+    def _choice(self, name: str, choices: tuple, default: str = None) -> str:
+        value = self._values.get(name, default or choices[0]).lower()
+        if value not in choices:
+            raise ConfigError(f"{name} must be one of {', '.join(choices)}, got {value}")
+        return value
+
+
+# the .env next to server.py (the project root), whatever the working directory
+ENV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env")
+
+
+class ConfigStore:
+    """Holds the current :class:`Config`, read from ``path`` (a ``.env`` file, None for none) under the
+    ``environ`` variables, which take precedence as with :func:`dotenv.load_dotenv`.
+
+    :meth:`reload` (on SIGHUP, or when :meth:`watch` sees the file change) swaps in a new Config at once:
+    readers holding the previous one finish with it, and an invalid file keeps the previous one.
+    Settings read per login (portal, web elements, early expiry) apply immediately, the others (sizes,
+    pools, salt...) on next start."""
+
+    def __init__(self, path: Union[None, str] = ENV_PATH, environ: Mapping[str, str] = os.environ):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._path = path
+        self._environ = environ
+        self._lock = threading.Lock()
+        self._current = None  # type: Union[None, Config]
+        self._mtime = None
+        self._listeners = []  # type: List[Callable[[Config], None]]
+        self._stopping = threading.Event()
+        self._thread = None  # type: Union[None, threading.Thread]
+
+    @property
+    def current(self) -> Config:
+        config = self._current
+        if config is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = self._load()
+                config = self._current
+        return config
+
+    def _load(self) -> Config:
+        self._mtime = self._file_mtime()
+        values = {}
+        if self._path is not None and os.path.isfile(self._path):
+            values.update((name, value) for name, value in dotenv_values(self._path).items() if value is not None)
+        values.update(self._environ)
+        return Config(values)
+
+    def _file_mtime(self):
+        try:
+            return None if self._path is None else os.stat(self._path).st_mtime
+        except OSError:
+            return None
+
+    def reload(self) -> bool:
+        """Reads the configuration again, False (previous configuration kept) when it is invalid"""
+        with self._lock:
+            try:
+                config = self._load()
+            except (ConfigError, OSError) as error:
+                self._logger.error(f"Configuration not reloaded: {error}")
+                return False
+            self._current = config
+            listeners = list(self._listeners)
+        self._logger.info(f"Configuration reloaded from {self._path}")
+        for listener in listeners:
+            listener(config)
+        return True
+
+    def subscribe(self, listener: Callable[[Config], None]):
+        """Calls ``listener`` with every reloaded configuration"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def watch(self, interval: int):
+        """Reloads when the file changes, checked every ``interval`` seconds (0 disables)"""
+        if interval > 0 and self._thread is None:
+            self.current  # loads it now, so changes are compared with the file as first read
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._watch_periodically, args=(interval,), name="config-watcher",
+                                            daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch_periodically(self, interval: int):
+        while not self._stopping.wait(interval):
+            if self._file_mtime() != self._mtime:
+                self.reload()
+
+
+config = ConfigStore()
@@ -0,0 +1,51 @@
+import hashlib
+import hmac
+
+import bcrypt
+
+LEGACY_SALT = "2432622431322467316a566377314a35386e5336472e5a507270514a2e"
+
+
+class CredentialHasher:
+    """Cache key scheme: entries are looked up by an HMAC of the username (microseconds) and hold a
+    single bcrypt verifier of the password, checked once per hit.
+
+    The legacy scheme (username and password both bcrypt-ed with the fixed ``salt``) is still computed
+    to migrate entries of caches written by previous versions."""
+
+    DEFAULT_ROUNDS = 10
+
+    def __init__(self, secret: bytes, legacy_salt: bytes = bytes.fromhex(LEGACY_SALT), rounds: int = DEFAULT_ROUNDS):
+        self._secret = secret
+        self._legacy_salt = legacy_salt
+        self._rounds = rounds
+
+    def lookup_key(self, username: str) -> str:
+        return hmac.new(self._secret, username.encode('UTF-8'), hashlib.sha256).hexdigest()
+
+    def password_digest(self, password: str) -> str:
+        """Fast keyed digest, only used for in-memory bookkeeping (negative cache, in-flight logins)"""
+        return hmac.new(self._secret, b"password:" + password.encode('UTF-8'), hashlib.sha256).hexdigest()
+
+    def verifier(self, password: str) -> bytes:
+        return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt(self._rounds))
+
+    @staticmethod
+    def verify(password: str, verifier) -> bool:
+        if not isinstance(verifier, bytes):
+            return False
+        try:
+            return bcrypt.checkpw(password.encode('UTF-8'), verifier)
+        except ValueError:
+            return False
+
+    @staticmethod
+    def is_legacy_key(key) -> bool:
+        # hex of a whole bcrypt hash (60 bytes), new keys are sha256 hex digests (32 bytes)
+        return isinstance(key, str) and len(key) == 120
+
+    def legacy_key(self, username: str) -> str:
+        return bcrypt.hashpw(username.encode('UTF-8'), self._legacy_salt).hex()
+
+    def legacy_verifier(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('UTF-8'), self._legacy_salt).hex()
@@ -0,0 +1,127 @@
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from bridge.metrics import metrics
+from ldapserver import exceptions
+
+
+class BoundedExecutor:
+    """Size-limited worker pool for CPU-bound work (credential hashing) or slow calls (portal logins).
+
+    Callers block until their task runs, at most ``max_wait`` seconds in the queue: past that budget, or
+    when ``max_queue`` tasks are already waiting, they get :class:`exceptions.LDAPBusy` instead of piling up
+    more threads on the CPU."""
+
+    DEFAULT_MAX_WAIT = 1000  # in ms
+
+    def __init__(self, name: str, workers: int = os.cpu_count(), max_wait: float = DEFAULT_MAX_WAIT / 1000,
+                 max_queue: int = 0):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._name = name
+        self._max_wait = max_wait
+        self._max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max(1, workers), thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        # futures returned by submit, not started yet: {future: (submitted, executor future)}
+        self._submitted = collections.OrderedDict()
+
+    def run(self, fn, *args):
+        self._enqueued()
+        started = threading.Event()
+        submitted = time.perf_counter()
+        context = contextvars.copy_context()  # the bind trace, see bridge.tracing
+
+        def task():
+            started.set()
+            self._dequeued(submitted)
+            return context.run(fn, *args)
+
+        future = self._executor.submit(task)
+        if not started.wait(self._max_wait) and future.cancel():
+            self._dequeued(submitted)
+            metrics.increment(f"{self._name}.timeouts")
+            raise exceptions.LDAPBusy(f"{self._name} queue wait exceeded {self._max_wait}s")
+        result = future.result()
+        metrics.increment(f"{self._name}.completed")
+        return result
+
+    def submit(self, fn, *args) -> Future:
+        """Queues ``fn`` without blocking, for callers waiting on the future (asyncio). A full queue raises
+        :class:`exceptions.LDAPBusy`, and so does the future once queued more than ``max_wait`` seconds:
+        checked whenever a task is submitted or starts, a task never runs past its budget."""
+        self._expire_submitted()
+        self._enqueued()
+        submitted = time.perf_counter()
+        context = contextvars.copy_context()
+        future = Future()
+
+        def task():
+            with self._lock:
+                self._submitted.pop(future, None)
+            self._dequeued(submitted)
+            self._expire_submitted()
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                if time.perf_counter() - submitted > self._max_wait:
+                    metrics.increment(f"{self._name}.timeouts")
+                    raise exceptions.LDAPBusy(f"{self._name} queue wait exceeded {self._max_wait}s")
+                result = context.run(fn, *args)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                metrics.increment(f"{self._name}.completed")
+                future.set_result(result)
+
+        queued = self._executor.submit(task)
+        with self._lock:
+            if not queued.running() and not queued.done():
+                self._submitted[future] = (submitted, queued)
+        return future
+
+    def _expire_submitted(self):
+        """Fails the futures of :meth:`submit` queued past ``max_wait`` (oldest first)"""
+        now = time.perf_counter()
+        expired = []
+        with self._lock:
+            while self._submitted:
+                future, (submitted, queued) = next(iter(self._submitted.items()))
+                if now - submitted <= self._max_wait:
+                    break
+                del self._submitted[future]
+                expired.append((future, submitted, queued))
+        for future, submitted, queued in expired:
+            # a task already started answers its future itself
+            if queued.cancel():
+                self._dequeued(submitted)
+                metrics.increment(f"{self._name}.timeouts")
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(exceptions.LDAPBusy(f"{self._name} queue wait exceeded {self._max_wait}s"))
+
+    def _enqueued(self):
+        with self._lock:
+            if 0 < self._max_queue <= self._queued:
+                metrics.increment(f"{self._name}.rejected")
+                raise exceptions.LDAPBusy(f"{self._name} queue is full")
+            self._queued += 1
+            metrics.gauge(f"{self._name}.queue_depth", self._queued)
+
+    def _dequeued(self, submitted):
+        with self._lock:
+            self._queued -= 1
+            metrics.gauge(f"{self._name}.queue_depth", self._queued)
+        metrics.observe(f"{self._name}.wait_seconds", time.perf_counter() - submitted)
+
+    @property
+    def queued(self):
+        with self._lock:
+            return self._queued
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,211 @@
+import contextlib
+import logging
+import xml.etree.ElementTree as ElementTree
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bridge.authenticator import Authenticator
+from bridge.config import ConfigStore, config as default_config
+
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source",
+                 "track", "wbr"}
+BUTTON_TYPES = {"submit", "button", "image", "reset"}
+
+
+class FormError(Exception):
+    pass
+
+
+class _HtmlTreeBuilder(HTMLParser):
+    """Lenient HTML to :mod:`xml.etree.ElementTree` conversion, so the .env XPaths can be evaluated
+    with :meth:`ElementTree.Element.find`."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = ElementTree.Element("document")
+        self._stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        element = ElementTree.SubElement(self._stack[-1], tag, {name: value or "" for name, value in attrs})
+        if tag not in VOID_ELEMENTS:
+            self._stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        ElementTree.SubElement(self._stack[-1], tag, {name: value or "" for name, value in attrs})
+
+    def handle_endtag(self, tag):
+        for index in range(len(self._stack) - 1, 0, -1):
+            if self._stack[index].tag == tag:
+                del self._stack[index:]
+                break
+
+    def handle_data(self, data):
+        element = self._stack[-1]
+        if len(element):
+            element[-1].tail = (element[-1].tail or "") + data
+        else:
+            element.text = (element.text or "") + data
+
+
+class Page:
+    def __init__(self, url: str, html: str):
+        self.url = url
+        builder = _HtmlTreeBuilder()
+        builder.feed(html)
+        builder.close()
+        self.root = builder.root
+        self._parents = {child: parent for parent in self.root.iter() for child in parent}
+
+    def find(self, xpath: str):
+        """Evaluates ``xpath`` (the ElementTree XPath subset, e.g. ``//*[@id="passwordInput"]``)"""
+        if xpath is None:
+            return None
+        try:
+            return self.root.find("." + xpath if xpath.startswith("/") else xpath)
+        except SyntaxError as error:
+            raise FormError(f"Unsupported XPath {xpath}: {error}")
+
+    def form_of(self, element):
+        while element is not None and element.tag != "form":
+            element = self._parents.get(element)
+        return element
+
+    def forms(self):
+        return self.root.iter("form")
+
+
+class HttpFormAuthenticator(Authenticator):
+    """Replays the portal login with plain HTTP requests instead of driving a browser.
+
+    Each login gets its own session (cookies), all sessions share one keep-alive connection pool."""
+
+    MAX_AUTO_POSTS = 5
+
+    def __init__(self, adapter: HTTPAdapter = None, config: ConfigStore = default_config):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._config = config
+        if adapter is None:
+            pool_size = config.current.http_pool_size
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._adapter = adapter
+
+    def shutdown(self):
+        self._adapter.close()
+
+    @contextlib.contextmanager
+    def _session(self, user_agent):
+        with requests.Session() as session:
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            if user_agent is not None:
+                session.headers["User-Agent"] = user_agent.strip('"')
+            try:
+                yield session
+            finally:
+                # closing a session closes its adapters, the shared one stays open
+                session.adapters.clear()
+
+    def do_web_auth(self, username, password):
+        self._logger.debug(f"starting HTTP auth request for {username}")
+        settings = self._config.current
+        with self._session(settings.ua) as session:
+            return self._login(session, username, password, settings)
+
+    def _login(self, session, username, password, settings):
+        timeout = settings.xttl
+
+        url = settings.portal_url
+        self._logger.debug(f"Loading URL {url}")
+        page = self._load(session.get(url, timeout=timeout))
+        self._logger.debug(f"Loading URL {url} DONE")
+
+        # Global ms User part
+        page = self._submit(session, page, settings.xusername, username, settings.xsubmit1, timeout)
+
+        # Custom portal
+
+        # stores original url
+        login_url = page.url
+
+        page = self._submit(session, page, settings.xpassword, password, settings.xsubmit2, timeout)
+
+        xlanded = settings.xlanded
+        page = self._follow_auto_posts(session, page, xlanded, timeout)
+        if xlanded is not None and page.find(xlanded) is None:
+            self._logger.debug(f"cannot find {xlanded} in {page.url}")
+            return False
+
+        self._logger.debug(f"Landed url: {page.url}")
+        return self.is_landed(login_url, page.url, settings.landed_url_pattern)
+
+    def _load(self, response):
+        response.raise_for_status()
+        return Page(response.url, response.text)
+
+    def _submit(self, session, page, xfield, value, xsubmit, timeout):
+        self._logger.debug(f"looking for field {xfield}")
+        field = page.find(xfield)
+        if field is None or field.get("name") is None:
+            raise FormError(f"Cannot find named field {xfield} in {page.url}")
+        form = page.form_of(field)
+        if form is None:
+            raise FormError(f"Field {xfield} is not part of a form in {page.url}")
+
+        data = self._form_data(form)
+        data[field.get("name")] = value
+        button = page.find(xsubmit)
+        action = form.get("action") or page.url
+        if button is not None:
+            if button.get("name"):
+                data[button.get("name")] = button.get("value", "")
+            action = button.get("formaction") or action
+        return self._send(session, page, form, action, data, timeout)
+
+    def _send(self, session, page, form, action, data, timeout):
+        url = urljoin(page.url, action)
+        self._logger.debug(f"submitting form to {url}")
+        if form.get("method", "get").lower() == "post":
+            return self._load(session.post(url, data=data, timeout=timeout))
+        return self._load(session.get(url, params=data, timeout=timeout))
+
+    def _follow_auto_posts(self, session, page, xlanded, timeout):
+        # federation hops (SAML/WS-Fed) answer with a hidden form a browser would submit by javascript
+        for _ in range(HttpFormAuthenticator.MAX_AUTO_POSTS):
+            if xlanded is not None and page.find(xlanded) is not None:
+                break
+            forms = [form for form in page.forms() if self._is_auto_post(form)]
+            if len(forms) != 1:
+                break
+            form = forms[0]
+            page = self._send(session, page, form, form.get("action") or page.url, self._form_data(form), timeout)
+        return page
+
+    @staticmethod
+    def _is_auto_post(form):
+        fields = [element for element in form.iter() if element.tag in ("input", "select", "textarea")]
+        return len(fields) > 0 and all(element.tag == "input" and element.get("type", "").lower() in
+                                       ("hidden", "submit") for element in fields)
+
+    @staticmethod
+    def _form_data(form):
+        data = {}
+        for element in form.iter():
+            name = element.get("name")
+            if not name:
+                continue
+            if element.tag == "input":
+                kind = element.get("type", "text").lower()
+                if kind in BUTTON_TYPES or kind in ("checkbox", "radio") and "checked" not in element.attrib:
+                    continue
+                data[name] = element.get("value", "on" if kind in ("checkbox", "radio") else "")
+            elif element.tag == "textarea":
+                data[name] = element.text or ""
+            elif element.tag == "select":
+                options = list(element.iter("option"))
+                selected = [option for option in options if "selected" in option.attrib] or options[:1]
+                if selected:
+                    data[name] = selected[0].get("value", selected[0].text or "")
+        return data
@@ -0,0 +1,104 @@
+import logging
+import os
+import pickle
+import shutil
+import struct
+from typing import Iterator, Union
+
+PUT = "put"
+DELETE = "del"
+CLEAR = "clear"
+
+_LENGTH = struct.Struct(">I")
+
+
+class CacheJournal:
+    """Append-only log of cache writes (length prefixed pickled records).
+
+    :meth:`rotate` moves the current journal aside while a snapshot is written, :meth:`replay` yields the
+    records of the rotated journal (if a compaction did not complete) then of the current one. A record
+    torn by a crash ends the replay of its file, which is truncated to its last complete record."""
+
+    def __init__(self, filename: str, fsync: bool = False):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self.filename = filename
+        self.rotated_filename = f"{filename}.old"
+        self._fsync = fsync
+        self._file = None
+        self.records = 0
+
+    def open(self):
+        self._file = open(self.filename, "ab")
+
+    def append(self, op: str, key=None, value=None, expires: float = None):
+        record = pickle.dumps((op, key, value, expires), protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(_LENGTH.pack(len(record)) + record)
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        self.records += 1
+
+    def replay(self) -> Iterator[tuple]:
+        for filename in (self.rotated_filename, self.filename):
+            if os.path.isfile(filename):
+                yield from self._read(filename)
+
+    def _read(self, filename):
+        count = 0
+        end = 0  # offset after the last complete record
+        with open(filename, "rb") as fs:
+            while True:
+                header = fs.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    break
+                record = fs.read(_LENGTH.unpack(header)[0])
+                try:
+                    op, key, value, expires = pickle.loads(record)
+                except (pickle.PickleError, EOFError, ValueError):
+                    break
+                count += 1
+                end = fs.tell()
+                self.records += 1
+                yield op, key, value, expires
+        if end < os.path.getsize(filename):
+            # records appended after the torn one would be unreadable
+            self._logger.warning(f"Truncated record in {filename} after {count} records, dropping the rest")
+            with open(filename, "r+b") as fs:
+                fs.truncate(end)
+
+    def rotate(self):
+        self.close()
+        if os.path.isfile(self.rotated_filename):
+            # the previous compaction did not complete, its records are still needed
+            with open(self.rotated_filename, "ab") as rotated, open(self.filename, "rb") as current:
+                shutil.copyfileobj(current, rotated)
+            os.remove(self.filename)
+        else:
+            os.replace(self.filename, self.rotated_filename)
+        self.open()
+        self.records = 0
+
+    def discard_rotated(self):
+        if os.path.isfile(self.rotated_filename):
+            os.remove(self.rotated_filename)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def write_atomically(filename: str, data, fsync: bool = True):
+    """Pickles ``data`` next to ``filename`` then renames it over, readers never see a partial file"""
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "wb") as fs:
+        pickle.dump(data, fs, protocol=pickle.HIGHEST_PROTOCOL)
+        if fsync:
+            fs.flush()
+            os.fsync(fs.fileno())
+    os.replace(temp_filename, filename)
+
+
+def read_snapshot(filename: str) -> Union[None, object]:
+    with open(filename, "rb") as fs:
+        return pickle.load(fs)
@@ -0,0 +1,118 @@
+import json
+import logging
+import threading
+from typing import Union
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # in seconds
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, rank: float) -> float:
+        """Upper bound of the bucket holding the given rank (0-1), max for the overflow bucket"""
+        if self.count == 0:
+            return 0.0
+        target = rank * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count > 0:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+                "p50": self.percentile(0.5), "p95": self.percentile(0.95), "p99": self.percentile(0.99)}
+
+
+class Metrics:
+    """Process wide counters, gauges and latency histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def histogram(self, name: str) -> Union[None, Histogram]:
+        with self._lock:
+            return self._histograms.get(name)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges),
+                    "histograms": {name: histogram.snapshot() for name, histogram in self._histograms.items()}}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """Logs a JSON snapshot of :data:`metrics` every ``interval`` seconds, along with ``labels`` (which
+    pre-fork worker reports it, for instance)"""
+
+    def __init__(self, interval: int, registry: Metrics = metrics, labels: dict = None):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._interval = interval
+        self._registry = registry
+        self._labels = labels or {}
+        self._stopping = threading.Event()
+        self._thread = None  # type: Union[None, threading.Thread]
+
+    def start(self):
+        if self._interval > 0:
+            self._thread = threading.Thread(target=self._report_periodically, name="metrics-reporter", daemon=True)
+            self._thread.start()
+
+    def report(self):
+        self._logger.info(json.dumps(dict(self._registry.snapshot(), **self._labels), sort_keys=True))
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _report_periodically(self):
+        while not self._stopping.wait(self._interval):
+            self.report()
@@ -0,0 +1,231 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+from typing import Callable, Union
+
+from bridge.metrics import metrics
+from bridge.tracing import span
+
+
+class _Slot:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.primed_at = None  # type: Union[None, float]
+
+
+class DriverPool:
+    """Bounded pool of pre-started web drivers.
+
+    Drivers are created by ``factory``, reset by ``reset`` after each use and retired (quit, or passed
+    to ``dispose`` along with whether they are still healthy) after ``max_uses`` uses, when
+    ``memory_probe`` reports more than ``max_memory_mb`` or when a login fails with an exception.
+
+    With ``prime``, a background thread prepares idle drivers for the next use (the portal login page
+    loaded), again after each reset and once they have been primed for ``prime_max_age`` seconds. Primed
+    drivers are handed out first, a driver failing to prime is retired."""
+
+    DEFAULT_SIZE = 2
+    DEFAULT_WARMUP = 1
+    DEFAULT_MAX_USES = 50
+    DEFAULT_PRIME_MAX_AGE = 300  # in seconds
+
+    def __init__(self, factory: Callable, size: int = DEFAULT_SIZE, warmup: int = DEFAULT_WARMUP,
+                 max_uses: int = DEFAULT_MAX_USES, reset: Callable = None,
+                 memory_probe: Callable = None, max_memory_mb: int = 0,
+                 prime: Callable = None, prime_max_age: float = DEFAULT_PRIME_MAX_AGE, dispose: Callable = None,
+                 timer=time.monotonic):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._factory = factory
+        self._size = max(1, size)
+        self._warmup = min(warmup, self._size)
+        self._max_uses = max_uses
+        self._reset = reset
+        self._memory_probe = memory_probe
+        self._max_memory_mb = max_memory_mb
+        self._prime = prime
+        self._prime_max_age = prime_max_age
+        self._dispose = dispose
+        self._timer = timer
+        self._idle = collections.deque()
+        self._live = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._warmer = None  # type: Union[None, threading.Thread]
+        self._primer = None  # type: Union[None, threading.Thread]
+
+    def start(self, wait: bool = False):
+        self._warmer = threading.Thread(target=self._warm, name="driver-warmup", daemon=True)
+        self._warmer.start()
+        if self._prime is not None:
+            self._primer = threading.Thread(target=self._prime_idle, name="driver-primer", daemon=True)
+            self._primer.start()
+        if wait:
+            self._warmer.join()
+
+    def _warm(self):
+        self._logger.debug(f"Warming up {self._warmup} drivers")
+        while True:
+            with self._cond:
+                if self._closed or self._live >= self._warmup:
+                    break
+                self._live += 1
+            try:
+                slot = self._create()
+            except Exception as error:
+                self._logger.warning(f"Cannot warm up driver, error:{error}")
+                with self._cond:
+                    self._live -= 1
+                    self._cond.notify_all()
+                break
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(slot)
+                    self._cond.notify_all()
+                    continue
+            self._retire(slot)
+            break
+        self._logger.debug("->DONE")
+
+    @contextlib.contextmanager
+    def driver(self, timeout: float = None):
+        with span("pool.acquire"):
+            slot = self._acquire(timeout)
+        healthy = False
+        try:
+            yield slot.driver
+            healthy = True
+        finally:
+            self._release(slot, healthy)
+
+    def _acquire(self, timeout):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Driver pool is shut down")
+                if self._idle:
+                    return self._pop_idle()
+                if self._live < self._size:
+                    self._live += 1
+                    break
+                if not self._cond.wait(timeout):
+                    raise TimeoutError(f"No driver available after {timeout}s")
+        try:
+            return self._create()
+        except BaseException:
+            with self._cond:
+                self._live -= 1
+                self._cond.notify_all()
+            raise
+
+    def _pop_idle(self) -> _Slot:
+        for slot in reversed(self._idle):
+            if slot.primed_at is not None:
+                self._idle.remove(slot)
+                metrics.increment("pool.primed_hits")
+                return slot
+        if self._prime is not None:
+            metrics.increment("pool.primed_misses")
+        return self._idle.pop()
+
+    def _prime_idle(self):
+        while True:
+            with self._cond:
+                slot = self._next_to_prime()
+                while slot is None and not self._closed:
+                    self._cond.wait(self._next_prime_delay())
+                    slot = self._next_to_prime()
+                if self._closed:
+                    return
+                self._idle.remove(slot)
+            try:
+                with span("pool.prime"):
+                    self._prime(slot.driver)
+                slot.primed_at = self._timer()
+            except Exception as error:
+                self._logger.warning(f"Cannot prime driver, retiring it, error:{error}")
+                self._retire(slot, healthy=False)
+                continue
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(slot)
+                    self._cond.notify_all()
+                    continue
+            self._retire(slot)
+
+    def _next_to_prime(self) -> Union[None, _Slot]:
+        now = self._timer()
+        for slot in self._idle:
+            if slot.primed_at is None or now - slot.primed_at >= self._prime_max_age:
+                return slot
+        return None
+
+    def _next_prime_delay(self) -> Union[None, float]:
+        """Seconds until the first idle driver goes stale, None (wait for a release) without primed drivers"""
+        primed = [slot.primed_at for slot in self._idle if slot.primed_at is not None]
+        return max(0.0, min(primed) + self._prime_max_age - self._timer()) if primed else None
+
+    def _create(self):
+        with span("pool.create"):
+            driver = self._factory()
+        self._logger.debug(f"WebDriver started {driver}")
+        return _Slot(driver)
+
+    def _release(self, slot, healthy):
+        slot.uses += 1
+        slot.primed_at = None
+        keep = healthy and not self._closed and slot.uses < self._max_uses
+        if keep and self._max_memory_mb > 0 and self._memory_probe is not None:
+            try:
+                memory = self._memory_probe(slot.driver)
+                if memory is not None and memory > self._max_memory_mb:
+                    self._logger.debug(f"Driver uses {memory}MB, retiring it")
+                    keep = False
+            except Exception as error:
+                self._logger.debug(f"Cannot probe driver memory, error:{error}")
+        if keep and self._reset is not None:
+            try:
+                with span("pool.reset"):
+                    self._reset(slot.driver)
+            except Exception as error:
+                self._logger.warning(f"Cannot reset driver, retiring it, error:{error}")
+                keep = healthy = False
+        if keep:
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(slot)
+                    self._cond.notify_all()
+                    return
+        self._retire(slot, healthy)
+
+    def _retire(self, slot, healthy: bool = True):
+        try:
+            if self._dispose is not None:
+                self._dispose(slot.driver, healthy)
+            else:
+                slot.driver.quit()
+        except Exception as error:
+            self._logger.debug(f"Cannot quit driver, error:{error}")
+        with self._cond:
+            self._live -= 1
+            self._cond.notify_all()
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for slot in idle:
+            self._retire(slot)
+
+    def __len__(self):
+        with self._cond:
+            return self._live
+
+    @property
+    def idle(self):
+        with self._cond:
+            return len(self._idle)
@@ -0,0 +1,140 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict, Tuple, Union
+
+RESTART_BACKOFF = 1  # in seconds, doubled with every consecutive quick exit of a worker
+MAX_RESTART_BACKOFF = 60  # in seconds
+QUICK_EXIT = 10  # in seconds, a worker exiting sooner after its start failed to start
+MAX_QUICK_EXITS = 5  # consecutive quick exits of a worker before giving up
+
+
+def bound_socket(address: Tuple[str, int], reuse_port: bool = False) -> socket.socket:
+    """TCP socket bound to ``address``, sharing the port with other processes when ``reuse_port``"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def listening_socket(address: Tuple[str, int], reuse_port: bool = False, backlog: int = 1024) -> socket.socket:
+    """TCP socket bound to ``address`` and listening, sharing the port with other processes when ``reuse_port``"""
+    sock = bound_socket(address, reuse_port)
+    sock.listen(backlog)
+    return sock
+
+
+class PreforkSupervisor:
+    """Forks ``processes`` workers running ``serve(index, sock)`` and restarts the ones that exit.
+
+    With SO_REUSEPORT (Linux, BSD) each worker binds ``address`` itself and the kernel spreads connections
+    between them (``sock`` is None), otherwise they all accept on one socket bound before forking.
+    Workers must start their threads themselves, after the fork. SIGTERM and SIGINT stop the workers,
+    SIGHUP is forwarded to them. Whatever a worker builds in memory is its own: pools, rate limits and
+    coalescing of concurrent calls apply per worker, not to the server as a whole.
+
+    A worker exiting within ``QUICK_EXIT`` seconds of its start is restarted after ``backoff`` seconds,
+    doubled with every consecutive quick exit, and after ``max_quick_exits`` of them all workers are
+    stopped: :meth:`run` then returns 1 (0 when stopped by a signal). The address is bound once before
+    forking, so that a port conflict fails at once rather than in every worker."""
+
+    def __init__(self, serve: Callable[[int, Union[None, socket.socket]], None], processes: int,
+                 address: Tuple[str, int], backoff: float = RESTART_BACKOFF, max_quick_exits: int = MAX_QUICK_EXITS):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._serve = serve
+        self._processes = processes
+        self._address = address
+        self._backoff = backoff
+        self._max_quick_exits = max_quick_exits
+        self._sock = None  # type: Union[None, socket.socket]
+        self._workers = {}  # type: Dict[int, Tuple[int, float]]  # pid: (index, start time)
+        self.restarts = [0] * processes
+        self._quick_exits = [0] * processes
+
+    def run(self) -> int:
+        if hasattr(socket, "SO_REUSEPORT"):
+            # raises now when the port is taken, the workers bind it again each
+            bound_socket(self._address, reuse_port=True).close()
+        else:
+            self._sock = listening_socket(self._address)
+        for index in range(self._processes):
+            self._spawn(index)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGHUP, lambda signum, frame: self._signal_workers(signal.SIGHUP))
+        try:
+            while True:
+                pid, status = os.wait()
+                if pid in self._workers and not self._restart(pid, status):
+                    return 1
+        except (KeyboardInterrupt, SystemExit):
+            return 0
+        finally:
+            self._stop()
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+                self._serve(index, self._sock)
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except BaseException:
+                self._logger.exception(f"Worker {index} failed")
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self._workers[pid] = (index, time.monotonic())
+        self._logger.info(f"Worker {index} started, pid {pid}")
+
+    def _restart(self, pid: int, status: int) -> bool:
+        """Restarts the worker that exited, False when giving up on it"""
+        index, started = self._workers.pop(pid)
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started >= QUICK_EXIT:
+            self._quick_exits[index] = 0
+        else:
+            self._quick_exits[index] += 1
+            if self._quick_exits[index] >= self._max_quick_exits:
+                self._logger.error(f"Worker {index} (pid {pid}) exited with status {code}, "
+                                   f"{self._quick_exits[index]} times in a row right after start: giving up")
+                return False
+        self.restarts[index] += 1
+        self._logger.warning(f"Worker {index} (pid {pid}) exited with status {code}, "
+                             f"restart #{self.restarts[index]}")
+        if self._quick_exits[index] > 0:
+            time.sleep(min(MAX_RESTART_BACKOFF, self._backoff * 2 ** (self._quick_exits[index] - 1)))
+        self._spawn(index)
+        return True
+
+    def _signal_workers(self, signum: int):
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _stop(self):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self._signal_workers(signal.SIGTERM)
+        for pid in list(self._workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self._workers.clear()
+        if self._sock is not None:
+            self._sock.close()
+        self._logger.info(f"Workers stopped, restarts per worker: {self.restarts}")
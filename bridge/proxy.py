@@ -1,57 +1,285 @@
+import asyncio
+import contextvars
 import logging
+import random
+import threading
+import time
 import traceback
-import os
+from concurrent.futures import Executor
+from typing import Union
 
-import bcrypt
-from dotenv import load_dotenv
-
-from bridge.cache import PersistentConcurrentCache
-from bridge.web import WebAuthenticator
+from bridge.admission import AdmissionControl
+from bridge.authenticator import Authenticator, create_authenticator
+from bridge.breaker import CircuitBreaker
+from bridge.cache import CacheSweeper, PersistentConcurrentCache
+from bridge.config import ConfigStore, config as default_config
+from bridge.credentials import CredentialHasher
+from bridge.executor import BoundedExecutor
+from bridge.metrics import metrics
+from bridge.refresh import BackgroundRefresher
+from bridge.singleflight import SingleFlight
+from bridge.sqlite_cache import SqliteCache
 from ldapserver import exceptions
 
+NEEDS_PORTAL = object()  # a bind the caches cannot answer
+
 
 class LdapProxy:
-    def __init__(self, delegate_authenticator: WebAuthenticator = WebAuthenticator()):
-        self._authenticator = delegate_authenticator
+    def __init__(self, delegate_authenticator: Authenticator = None, cache: PersistentConcurrentCache = None,
+                 config: ConfigStore = default_config):
         self._logger = logging.getLogger()
-        load_dotenv()
+        self._config = config
+        settings = config.current
+        self._authenticator = delegate_authenticator if delegate_authenticator is not None \
+            else create_authenticator(config)
+
+        # expired entries still answer while the portal is unavailable
+        self._stale_grace = settings.cache_stale_grace
+        if cache is None:
+            if settings.cache_backend == "sqlite":
+                cache = SqliteCache("bridge", ttl=settings.cache_ttl, maxsize=settings.cache_max_size,
+                                    ttl_jitter=settings.cache_ttl_jitter, grace=self._stale_grace)
+            else:
+                cache = PersistentConcurrentCache(
+                    "bridge", ttl=settings.cache_ttl, ttl_jitter=settings.cache_ttl_jitter, grace=self._stale_grace,
+                    maxsize=settings.cache_max_size, max_bytes=settings.cache_max_bytes,
+                    compact_threshold=settings.cache_compact_threshold, fsync=settings.cache_fsync,
+                    shards=settings.cache_shards)
+        self.cache = cache
+        # wrong passwords, per hashed username: {hashed password}
+        self.negative_cache = PersistentConcurrentCache(
+            "bridge-negative", persist=False, ttl=settings.negative_cache_ttl, maxsize=settings.negative_cache_size)
+        self._sweeper = CacheSweeper([self.cache, self.negative_cache], settings.cache_sweep_interval,
+                                     after_sweep=self._after_sweep)
+        self._admission = AdmissionControl(
+            settings.admission_ip_rate, settings.admission_ip_burst, settings.admission_user_rate,
+            settings.admission_user_burst, settings.admission_backoff_after, settings.admission_backoff_base,
+            settings.admission_backoff_max, settings.admission_max_keys)
+        self._inflight = SingleFlight()
+        self._breaker = None  # type: Union[None, CircuitBreaker]
+        if settings.breaker_failures > 0:
+            self._breaker = CircuitBreaker("portal", settings.breaker_failures, settings.breaker_slow_call,
+                                           settings.breaker_open)
+        self._refresher = None  # type: Union[None, BackgroundRefresher]
+        if settings.cache_refresh_ahead:
+            self._refresher = BackgroundRefresher(self._refresh_entry, settings.cache_refresh_rate,
+                                                  settings.cache_refresh_queue, busy=lambda: len(self._inflight) > 0)
+
+        self._hasher = CredentialHasher(settings.cache_key, settings.salt, settings.cache_bcrypt_rounds)
+        # bcrypt runs on a bounded pool instead of every connection thread
+        self._hashing = BoundedExecutor("hashing", settings.hash_workers, settings.hash_max_wait,
+                                        settings.hash_max_queue)
+        # binds missing the cache wait for the portal on their own lane, so that hits never queue behind them
+        self.slow_lane = BoundedExecutor("slow_lane", settings.slow_lane_workers, settings.slow_lane_max_wait,
+                                         settings.slow_lane_max_queue)
+        self._legacy_lock = threading.Lock()
+        self._legacy_entries = 0
+        self._count_legacy_entries()
+        if self._legacy_entries > 0:
+            self._logger.info(f"{self._legacy_entries} cache entries in legacy format, migrating them on next bind")
+
+        self._flush_interval = settings.cache_flush_interval
+        self._stopping = threading.Event()
+        self._flusher = None  # type: Union[None, threading.Thread]
+
+    def start(self):
+        if self._flusher is not None:
+            return
+        self._stopping.clear()
+        self._authenticator.start()
+        self._sweeper.start()
+        if self._refresher is not None:
+            self._refresher.start()
+        if self._flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_periodically, name="cache-flusher", daemon=True)
+            self._flusher.start()
+        self._logger.debug("Proxy started")
+
+    def flush(self):
+        self.cache.flush()
 
-        ttl = PersistentConcurrentCache.DEFAULT_CACHE_TTL * 60 * 60
-        env_ttl = os.getenv("cache_ttl")
-        if env_ttl is not None:
-            try:
-                ttl = int(env_ttl)*60*60
-            except ValueError:
-                self._logger.warning(f"Bad value for cache_ttl{env_ttl}, "
-                                     f"using defaults {PersistentConcurrentCache.DEFAULT_CACHE_TTL}")
-        self.cache = PersistentConcurrentCache("bridge", ttl)
+    def shutdown(self):
+        self._stopping.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if self._refresher is not None:
+            self._refresher.shutdown()
+        self._authenticator.shutdown()
+        self._sweeper.shutdown()
+        self._hashing.shutdown()
+        self.slow_lane.shutdown()
+        self.flush()
+        self._logger.debug("Proxy stopped")
 
-    def do_auth(self, username: str, password: str):
+    def _flush_periodically(self):
+        while not self._stopping.wait(self._flush_interval):
+            self.flush()
 
+    def do_auth(self, username: str, password: str, client_ip: str = None):
+        started = time.perf_counter()
+        if self._authenticate_from_cache(username, password, client_ip):
+            metrics.observe("bind.fast_lane_seconds", time.perf_counter() - started)
+        else:
+            self.slow_lane.run(self._authenticate, username, password)
+            metrics.observe("bind.slow_lane_seconds", time.perf_counter() - started)
+
+    async def do_auth_async(self, username: str, password: str, client_ip: str = None, fast_lane: Executor = None):
+        """:meth:`do_auth` for event loops: binds answered by the caches run on ``fast_lane``, portal logins on
+        :attr:`slow_lane`, neither waits for the other"""
+        started = time.perf_counter()
+        # the caches are read from disk with the sqlite backend, and verified with bcrypt: never on the event loop
+        if await asyncio.get_running_loop().run_in_executor(fast_lane, contextvars.copy_context().run,
+                                                            self._authenticate_from_cache, username, password,
+                                                            client_ip):
+            metrics.observe("bind.fast_lane_seconds", time.perf_counter() - started)
+        else:
+            await asyncio.wrap_future(self.slow_lane.submit(self._authenticate, username, password))
+            metrics.observe("bind.slow_lane_seconds", time.perf_counter() - started)
+
+    def _authenticate_from_cache(self, username: str, password: str, client_ip: Union[None, str]) -> bool:
+        """Admits the bind and answers it from the caches, False when it needs a portal login (slow lane)"""
+        self._admit(username, client_ip)
+        return self._authenticate(username, password, cache_only=True)
+
+    def _admit(self, username: str, client_ip: Union[None, str]):
         if not username.endswith("@eduvaud.ch"):
             self._logger.warning(f"bad username:{username}")
             raise exceptions.LDAPInvalidCredentials
 
-        try:
-            salt = bytes.fromhex(os.getenv("salt", "2432622431322467316a566377314a35386e5336472e5a507270514a2e"))
+        # throttled binds get LDAP busy before any hashing or portal work
+        self._admission.admit(client_ip)
 
-            hashed_username = bcrypt.hashpw(bytes(username, 'UTF-8'), salt).hex()
-            hashed_password = bcrypt.hashpw(bytes(password, 'UTF-8'), salt).hex()
+    def _authenticate(self, username: str, password: str, cache_only: bool = False) -> bool:
+        if self._check_credentials(username, password, cache_only) is NEEDS_PORTAL:
+            return False
+        self._admission.succeeded(username)
+        return True
 
-            if self.cache.exists(hashed_username) and self.cache[hashed_username] == hashed_password:
-                self._logger.debug(f"Found valid entry in self.__cache -> GRANTED")
-                return
+    def _check_credentials(self, username: str, password: str, cache_only: bool = False):
+        """Raises :class:`exceptions.LDAPInvalidCredentials` unless the credentials are valid, returns
+        ``NEEDS_PORTAL`` instead of logging in on the portal when ``cache_only``"""
+        try:
+            lookup_key = self._hasher.lookup_key(username)
+            password_digest = self._hasher.password_digest(password)
+
+            if password_digest in self.negative_cache.get(lookup_key, ()):
+                self._logger.debug(f"Found entry in negative cache -> INVALID")
+                granted = False
             else:
-                granted = self._authenticator.do_web_auth(password, username)
+                expires = self._cached_expiry(lookup_key, password)
+                if expires is not None and not self._expires_early(expires) \
+                        or expires is None \
+                        and self._hashing.run(self._migrate_legacy_entry, username, password, lookup_key):
+                    self._logger.debug(f"Found valid entry in self.__cache -> GRANTED")
+                    return
+                if expires is not None and self._refresher is not None:
+                    self._logger.debug(f"Found entry close to expiry in self.__cache -> GRANTED, refreshing it")
+                    self._refresher.submit(lookup_key, username, password)
+                    return
+                if cache_only:
+                    return NEEDS_PORTAL
+                # the per user limits only apply to binds reaching the portal, never to cache hits
+                self._admission.admit_login(username)
+                granted = self._web_auth(username, password, lookup_key, password_digest, stale=expires is not None)
                 if granted:
-                    self._logger.debug("Caching entry")
-                    self.cache[hashed_username] = hashed_password
-                    self._logger.debug("->DONE")
                     return
+                self._admission.failed(username)
 
+        except exceptions.LDAPError:
+            raise
         except Exception:
             traceback.print_exc()
-            raise exceptions.LDAPError
+            raise exceptions.LDAPOther
 
         if not granted:
             raise exceptions.LDAPInvalidCredentials
+
+    def _cached_expiry(self, lookup_key: str, password: str) -> Union[None, float]:
+        entry = self.cache.get_with_expiry(lookup_key)
+        if entry is None or not self._hashing.run(self._hasher.verify, password, entry[0]):
+            return None
+        return entry[1]
+
+    def _expires_early(self, expires: float) -> bool:
+        # hits in the last cache_early_expiry of the ttl are increasingly likely to be revalidated, either before
+        # answering or, with cache_refresh_ahead, in background after answering GRANTED: entries cached
+        # together are not revalidated together
+        settings = self._config.current
+        window = settings.cache_ttl * settings.cache_early_expiry
+        remaining = expires - time.time()
+        return remaining < window and random.random() * window > remaining
+
+    def _web_auth(self, username: str, password: str, lookup_key: str, password_digest: str,
+                  stale: bool = False) -> bool:
+        """Logs in on the portal and updates the caches, ``stale`` when revalidating a valid cache entry"""
+        try:
+            # parallel binds with the same credentials share a single web login
+            granted = self._inflight.do((lookup_key, password_digest), self._portal_auth, username, password)
+        except Exception:
+            # a valid entry, or one expired less than cache_stale_grace ago, answers while the portal is unavailable
+            if not stale and not self._has_stale_entry(lookup_key, password):
+                raise
+            self._logger.warning("Portal unavailable, still GRANTED from cache")
+            metrics.increment("cache.stale_served")
+            return True
+        if granted:
+            self.negative_cache.pop(lookup_key)
+            self._cache_entry(lookup_key, password)
+            return True
+        if stale:
+            # the portal no longer accepts the cached password
+            self.cache.pop(lookup_key)
+        self.negative_cache[lookup_key] = self.negative_cache.get(lookup_key, frozenset()) | {password_digest}
+        return False
+
+    def _portal_auth(self, username: str, password: str) -> bool:
+        if self._breaker is None:
+            return self._authenticator.do_web_auth(username, password)
+        return self._breaker.call(self._authenticator.do_web_auth, username, password)
+
+    def _has_stale_entry(self, lookup_key: str, password: str) -> bool:
+        if self._stale_grace <= 0:
+            return False
+        entry = self.cache.get_stale(lookup_key)
+        return entry is not None and self._hashing.run(self._hasher.verify, password, entry[0])
+
+    def _refresh_entry(self, lookup_key: str, username: str, password: str):
+        self._web_auth(username, password, lookup_key, self._hasher.password_digest(password), stale=True)
+
+    def _cache_entry(self, lookup_key: str, password: str):
+        self._logger.debug("Caching entry")
+        try:
+            self.cache[lookup_key] = self._hashing.run(self._hasher.verifier, password)
+            self._logger.debug("->DONE")
+        except exceptions.LDAPBusy:
+            # the web login already granted access, next bind will try caching again
+            self._logger.warning("Hashing is overloaded, entry not cached")
+
+    def _migrate_legacy_entry(self, username: str, password: str, lookup_key: str) -> bool:
+        # only pays the legacy double bcrypt while the cache still holds entries of the old format
+        if self._legacy_entries <= 0:
+            return False
+        legacy_key = self._hasher.legacy_key(username)
+        legacy_verifier = self.cache.get_if_valid(legacy_key)
+        if legacy_verifier is None or legacy_verifier != self._hasher.legacy_verifier(password):
+            return False
+        self._logger.debug("Migrating legacy cache entry")
+        self.cache[lookup_key] = self._hasher.verifier(password)
+        # a concurrent bind of the same user may have migrated it already
+        if self.cache.pop(legacy_key) is not None:
+            with self._legacy_lock:
+                self._legacy_entries -= 1
+        return True
+
+    def _after_sweep(self):
+        # legacy entries also leave the cache by expiry or eviction
+        self._count_legacy_entries()
+        if self._breaker is not None:
+            # the breaker state gauge moves even without calls
+            self._breaker.publish()
+
+    def _count_legacy_entries(self):
+        legacy_entries = sum(1 for key in self.cache.keys() if CredentialHasher.is_legacy_key(key))
+        with self._legacy_lock:
+            self._legacy_entries = legacy_entries
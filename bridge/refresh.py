@@ -0,0 +1,88 @@
+import collections
+import logging
+import threading
+import traceback
+from typing import Union
+
+from bridge.metrics import metrics
+
+
+class BackgroundRefresher:
+    """Runs ``refresh(key, *args)`` for the submitted keys on a single low priority thread.
+
+    At most ``rate`` refreshes run per minute, and none while ``busy()`` is true (foreground work in
+    flight). A key already pending is not queued twice, and submissions beyond ``max_queue`` pending
+    keys are dropped: their entries then simply expire. Pending arguments are kept in memory only."""
+
+    DEFAULT_RATE = 30  # per minute
+    DEFAULT_MAX_QUEUE = 100
+    BUSY_POLL = 0.1  # in seconds
+
+    def __init__(self, refresh, rate: int = DEFAULT_RATE, max_queue: int = DEFAULT_MAX_QUEUE, busy=None):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._refresh = refresh
+        self._interval = 60 / max(1, rate)
+        self._max_queue = max_queue
+        self._busy = busy if busy is not None else (lambda: False)
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = threading.Event()
+        self._thread = None  # type: Union[None, threading.Thread]
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._refresh_continuously, name="cache-refresher", daemon=True)
+            self._thread.start()
+
+    def submit(self, key, *args) -> bool:
+        """Queues a refresh of ``key``, False when it was dropped"""
+        with self._lock:
+            if key in self._pending:
+                return True
+            if len(self._pending) >= self._max_queue:
+                metrics.increment("refresh.dropped")
+                return False
+            self._pending[key] = args
+            metrics.increment("refresh.scheduled")
+            self._wakeup.notify()
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self):
+        self._stopping.set()
+        with self._lock:
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _next(self):
+        with self._lock:
+            while not self._pending and not self._stopping.is_set():
+                self._wakeup.wait()
+            if self._stopping.is_set():
+                return None
+            return self._pending.popitem(last=False)
+
+    def _refresh_continuously(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            while self._busy():
+                if self._stopping.wait(BackgroundRefresher.BUSY_POLL):
+                    return
+            key, args = item
+            try:
+                self._refresh(key, *args)
+                metrics.increment("refresh.completed")
+            except Exception:
+                metrics.increment("refresh.failed")
+                traceback.print_exc()
+            if self._stopping.wait(self._interval):
+                return
@@ -0,0 +1,50 @@
+import logging
+import threading
+from typing import Union
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None  # type: Union[None, BaseException]
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing the same key: the first caller runs the function,
+    the others block until it finishes and get its result (or its exception)."""
+
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            self._logger.debug("Joining in-flight call")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
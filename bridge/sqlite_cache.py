@@ -0,0 +1,175 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+from typing import List
+
+from bridge.cache import expiry_time
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL) "
+    "WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)",
+)
+
+
+class _LocalConnection:
+    """Holds the connection of a thread, collected (and the connection closed) when the thread exits"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+
+class SqliteCache:
+    """:class:`bridge.cache.PersistentConcurrentCache` compatible cache stored in ``cache-<name>.sqlite``.
+
+    The database runs in WAL mode, so several server processes on the host can share it. Each lookup,
+    insert and expiry sweep is a single statement on the key or the expiry index, and the size is only
+    bounded by ``maxsize`` (0 means unbounded, enforced on :meth:`expire`) instead of memory. Expiry times
+    are shortened at random by up to ``ttl_jitter`` (0-1) of the ttl, and expired entries stay available to
+    :meth:`get_stale` for ``grace`` seconds.
+    Keys must be strings."""
+
+    DEFAULT_CACHE_TTL = 12  # in hours
+    BUSY_TIMEOUT = 5  # in seconds
+
+    def __init__(self, name: str = None, ttl: int = 60 * 60 * DEFAULT_CACHE_TTL, maxsize: int = 0,
+                 ttl_jitter: float = 0, grace: int = 0):
+        self._logger = logging.getLogger(self.__class__.__qualname__)
+        if name is None:
+            self._logger.warning("No name given for persistent logger, generating a random one")
+            name = os.urandom(10).hex()
+        self.name = name
+        self.filename = f'cache-{name}.sqlite'
+        self._ttl = ttl
+        self._ttl_jitter = ttl_jitter
+        self._grace = grace
+        self._maxsize = maxsize
+        self._local = threading.local()
+        self._finalizers = []  # type: List[weakref.finalize]
+        self._connections_lock = threading.Lock()
+        self._evictions = 0
+        self._expirations = 0
+
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+        self._logger.debug(f"Cache opened from {self.filename}")
+
+    def _connection(self) -> sqlite3.Connection:
+        local = getattr(self._local, "connection", None)
+        if local is None:
+            connection = sqlite3.connect(self.filename, timeout=SqliteCache.BUSY_TIMEOUT, check_same_thread=False)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            local = _LocalConnection(connection)
+            self._local.connection = local
+            with self._connections_lock:
+                self._finalizers = [finalizer for finalizer in self._finalizers if finalizer.alive]
+                self._finalizers.append(weakref.finalize(local, connection.close))
+        return local.connection
+
+    @property
+    def connections(self) -> int:
+        """Connections still open, one per thread that used the cache and is still running"""
+        with self._connections_lock:
+            return sum(1 for finalizer in self._finalizers if finalizer.alive)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        with self._connections_lock:
+            for finalizer in self._finalizers:
+                finalizer()
+            self._finalizers.clear()
+        self._local = threading.local()
+
+    def flush(self):
+        self.expire()
+
+    def save_to_disk(self):
+        self.flush()
+
+    def expire(self) -> int:
+        with self._connection() as connection:
+            expired = connection.execute("DELETE FROM cache WHERE expires <= ?",
+                                         (time.time() - self._grace,)).rowcount
+            evicted = 0
+            if self._maxsize > 0:
+                # beyond maxsize, drops the entries closest to expiry
+                evicted = connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                                             "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self._maxsize,)).rowcount
+        self._expirations += expired
+        self._evictions += evicted
+        return expired + evicted
+
+    def stats(self) -> dict:
+        return {"entries": len(self), "evictions": self._evictions, "expirations": self._expirations}
+
+    def exists(self, key):
+        return self.get(key) is not None
+
+    def get_if_valid(self, key, default=None):
+        entry = self.get_with_expiry(key)
+        return default if entry is None else entry[0]
+
+    def get_with_expiry(self, key):
+        row = self._connection().execute("SELECT value, expires FROM cache WHERE key = ? AND expires > ?",
+                                         (key, time.time())).fetchone()
+        return None if row is None else (pickle.loads(row[0]), row[1])
+
+    def peek(self, key, default=None):
+        return self.get_if_valid(key, default)
+
+    def get_stale(self, key):
+        row = self._connection().execute("SELECT value, expires FROM cache WHERE key = ? AND expires > ?",
+                                         (key, time.time() - self._grace)).fetchone()
+        return None if row is None else (pickle.loads(row[0]), row[1])
+
+    def get(self, key, default=None):
+        return self.get_if_valid(key, default)
+
+    def pop(self, key, default=None):
+        with self._connection() as connection:
+            row = connection.execute("DELETE FROM cache WHERE key = ? RETURNING value, expires", (key,)).fetchall()
+        row = row[0] if row else None
+        if row is None or row[1] <= time.time():
+            return default
+        return pickle.loads(row[0])
+
+    def keys(self):
+        return [row[0] for row in self._connection().execute("SELECT key FROM cache WHERE expires > ?",
+                                                              (time.time(),))]
+
+    def put_if_absent(self, key, value):
+        now = time.time()
+        with self._connection() as connection:
+            inserted = connection.execute(
+                "INSERT INTO cache VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                "WHERE cache.expires <= ?",
+                (key, pickle.dumps(value), expiry_time(self._ttl, self._ttl_jitter, now), now)).rowcount
+        return value if inserted else None
+
+    def __setitem__(self, key, value):
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                               (key, pickle.dumps(value), expiry_time(self._ttl, self._ttl_jitter)))
+
+    def __getitem__(self, item):
+        row = self._connection().execute("SELECT value FROM cache WHERE key = ? AND expires > ?",
+                                         (item, time.time())).fetchone()
+        if row is None:
+            raise KeyError(item)
+        return pickle.loads(row[0])
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM cache WHERE expires > ?", (time.time(),)).fetchone()[0]
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM cache")
@@ -0,0 +1,79 @@
+import unittest
+
+from bridge.admission import AdmissionControl, FailureBackoff, RateLimiter
+from ldapserver import exceptions
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        limiter = RateLimiter("test", rate=60, burst=2, timer=clock)
+        self.assertTrue(limiter.allow("a"))
+        self.assertTrue(limiter.allow("a"))
+        self.assertFalse(limiter.allow("a"))
+        self.assertTrue(limiter.allow("b"))
+        clock.now = 1
+        self.assertTrue(limiter.allow("a"))
+        self.assertFalse(limiter.allow("a"))
+
+
+class TestFailureBackoff(unittest.TestCase):
+    def test_exponential_backoff(self):
+        clock = FakeClock()
+        backoff = FailureBackoff(after=2, base=1, maximum=3, timer=clock)
+        backoff.failed("bob")
+        self.assertTrue(backoff.allow("bob"))
+        backoff.failed("bob")
+        self.assertFalse(backoff.allow("bob"))
+        clock.now = 1
+        self.assertTrue(backoff.allow("bob"))
+        backoff.failed("bob")
+        clock.now = 2.5
+        self.assertFalse(backoff.allow("bob"))
+        clock.now = 3
+        self.assertTrue(backoff.allow("bob"))
+        for _ in range(5):
+            backoff.failed("bob")
+        clock.now = 5.5
+        self.assertFalse(backoff.allow("bob"))
+        clock.now = 6  # capped at maximum
+        self.assertTrue(backoff.allow("bob"))
+
+    def test_success_resets(self):
+        backoff = FailureBackoff(after=1, base=60, maximum=60)
+        backoff.failed("bob")
+        backoff.succeeded("bob")
+        self.assertTrue(backoff.allow("bob"))
+
+
+class TestAdmissionControl(unittest.TestCase):
+    def test_throttled_binds_are_busy(self):
+        admission = AdmissionControl(ip_rate=1, ip_burst=1, user_rate=1, user_burst=1, timer=FakeClock())
+        admission.admit("10.0.0.1")
+        with self.assertRaises(exceptions.LDAPBusy):
+            admission.admit("10.0.0.1")
+        # the per user limit only counts portal logins
+        admission.admit("10.0.0.2")
+        admission.admit_login("bob@eduvaud.ch")
+        with self.assertRaises(exceptions.LDAPBusy):
+            admission.admit_login("BOB@eduvaud.ch")
+        admission.admit(None)
+
+    def test_disabled(self):
+        admission = AdmissionControl(ip_rate=0, user_rate=0, backoff_after=0)
+        for _ in range(100):
+            admission.admit("10.0.0.1")
+            admission.admit_login("bob@eduvaud.ch")
+            admission.failed("bob@eduvaud.ch")
+
+
+if __name__ == '__main__':
+    unittest.main()
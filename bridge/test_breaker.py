@@ -0,0 +1,80 @@
+import unittest
+
+from bridge import breaker
+from bridge.breaker import CircuitBreaker
+from bridge.metrics import metrics
+from ldapserver import exceptions
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail():
+    raise TimeoutError
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker("test", failure_threshold=2, slow_call=5, open_seconds=30, timer=self.clock)
+
+    def trip(self):
+        for _ in range(2):
+            with self.assertRaises(TimeoutError):
+                self.breaker.call(fail)
+
+    def test_opens_after_consecutive_failures(self):
+        self.assertTrue(self.breaker.call(lambda: True))
+        self.trip()
+        self.assertEqual(breaker.OPEN, self.breaker.state)
+        with self.assertRaises(exceptions.LDAPUnavailable):
+            self.breaker.call(lambda: True)
+
+    def test_success_resets_failures(self):
+        with self.assertRaises(TimeoutError):
+            self.breaker.call(fail)
+        self.assertFalse(self.breaker.call(lambda: False))
+        with self.assertRaises(TimeoutError):
+            self.breaker.call(fail)
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+    def test_slow_calls_are_failures(self):
+        def slow():
+            self.clock.now += 10
+            return True
+
+        self.assertTrue(self.breaker.call(slow))
+        self.assertTrue(self.breaker.call(slow))
+        self.assertEqual(breaker.OPEN, self.breaker.state)
+
+    def test_local_refusals_are_not_failures(self):
+        def busy():
+            raise exceptions.LDAPBusy
+
+        for _ in range(3):
+            with self.assertRaises(exceptions.LDAPBusy):
+                self.breaker.call(busy)
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+    def test_half_open_trial(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertEqual(breaker.HALF_OPEN, self.breaker.state)
+        self.assertEqual(2, metrics.snapshot()["gauges"]["breaker.test.state"])
+        self.breaker.publish()
+        self.assertEqual(1, metrics.snapshot()["gauges"]["breaker.test.state"])
+        with self.assertRaises(TimeoutError):
+            self.breaker.call(fail)
+        self.assertEqual(breaker.OPEN, self.breaker.state)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.call(lambda: True))
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+
+if __name__ == '__main__':
+    unittest.main()
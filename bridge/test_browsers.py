@@ -0,0 +1,104 @@
+import itertools
+import unittest
+from unittest import mock
+
+from bridge.browsers import BrowserFleet
+
+
+class FakeChrome:
+    """Browsers and attached drivers: every lane is a mock answering the Target CDP commands"""
+
+    def __init__(self):
+        self.hosts = []
+        self.lanes = []
+        self.disposed = []
+        self.attach_error = None
+        self._ids = itertools.count()
+
+    def launch(self):
+        host = mock.MagicMock()
+        host.capabilities = {"goog:chromeOptions": {"debuggerAddress": f"localhost:{9000 + len(self.hosts)}"}}
+        self.hosts.append(host)
+        return host
+
+    def attach(self, debugger_address):
+        if self.attach_error is not None:
+            raise self.attach_error
+        lane = mock.MagicMock()
+        lane.debugger_address = debugger_address
+        lane.execute_cdp_cmd.side_effect = self._cdp
+        self.lanes.append(lane)
+        return lane
+
+    def _cdp(self, command, params):
+        if command == "Target.createBrowserContext":
+            return {"browserContextId": f"context-{next(self._ids)}"}
+        if command == "Target.createTarget":
+            return {"targetId": f"tab-of-{params['browserContextId']}"}
+        if command == "Target.disposeBrowserContext":
+            self.disposed.append(params["browserContextId"])
+        return {}
+
+
+class TestBrowserFleet(unittest.TestCase):
+    def setUp(self):
+        self.chrome = FakeChrome()
+        self.setup = mock.Mock()
+        self.fleet = BrowserFleet(self.chrome.launch, self.chrome.attach, contexts=2, setup=self.setup)
+
+    def test_contexts_per_browser(self):
+        drivers = [self.fleet.open() for _ in range(3)]
+        self.assertEqual(2, len(self.fleet))
+        self.assertEqual(["localhost:9000", "localhost:9000", "localhost:9001"],
+                         [driver.debugger_address for driver in drivers])
+        drivers[0].switch_to.window.assert_called_once_with("tab-of-context-0")
+        self.setup.assert_called_with(drivers[2])
+
+    def test_recycle_switches_to_new_context(self):
+        driver = self.fleet.open()
+        self.fleet.recycle(driver)
+        driver.switch_to.window.assert_called_with("tab-of-context-1")
+        self.assertEqual(["context-0"], self.chrome.disposed)
+        self.assertEqual(1, len(self.chrome.lanes))
+
+    def test_close_frees_room(self):
+        first, second = self.fleet.open(), self.fleet.open()
+        self.fleet.close(first)
+        self.assertEqual(["context-0"], self.chrome.disposed)
+        first.quit.assert_called_once()
+        self.fleet.open()
+        self.assertEqual(1, len(self.fleet))
+        self.chrome.hosts[0].quit.assert_not_called()
+
+    def test_broken_browser_retired_when_empty(self):
+        driver = self.fleet.open()
+        self.chrome.attach_error = ConnectionError("chrome crashed")
+        with self.assertRaises(ConnectionError):
+            self.fleet.open()
+        self.chrome.hosts[0].quit.assert_not_called()
+        self.fleet.close(driver)
+        self.chrome.hosts[0].quit.assert_called_once()
+        self.assertEqual(0, len(self.fleet))
+        # the next lane gets a new browser
+        self.chrome.attach_error = None
+        self.assertEqual("localhost:9001", self.fleet.open().debugger_address)
+
+    def test_crashed_browser_found_on_failed_login(self):
+        first, second = self.fleet.open(), self.fleet.open()
+        self.fleet.close(first, healthy=False)
+        self.chrome.hosts[0].quit.assert_not_called()
+        # the next failure finds it no longer answering
+        self.chrome.hosts[0].execute_cdp_cmd.side_effect = ConnectionError("chrome crashed")
+        self.fleet.close(second, healthy=False)
+        self.chrome.hosts[0].quit.assert_called_once()
+        self.assertEqual("localhost:9001", self.fleet.open().debugger_address)
+
+    def test_shutdown(self):
+        self.fleet.open()
+        self.fleet.shutdown()
+        self.chrome.hosts[0].quit.assert_called_once()
+        self.assertEqual(0, len(self.fleet))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,46 @@
 import gc
+import glob
 import os
+import pickle
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
-from bridge.cache import PersistentConcurrentCache
+import cachetools
+
+from bridge.cache import CacheSweeper, PersistentConcurrentCache
+from bridge.metrics import metrics
+from bridge.sqlite_cache import SqliteCache
 
 CACHE_NAME = "test"
 CACHE_FILE = f'cache-{CACHE_NAME}.pickle'
+JOURNAL_FILE = f'cache-{CACHE_NAME}.journal'
+
 
+def clean_cache_file(pattern=f'cache-{CACHE_NAME}.*'):
+    for filename in glob.glob(pattern):
+        os.remove(filename)
 
-def clean_cache_file():
-    if os.path.isfile(CACHE_FILE):
-        os.remove(CACHE_FILE)
 
+class CacheTestCases:
+    """Cases every cache backend must pass"""
+    cache_class = None
 
-class TestPersistentConcurrentCache(TestCase):
+    def setUp(self):
+        # cache files are written relative to the working directory
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        # caches flush on deletion, collected before leaving the directory
+        self.addCleanup(gc.collect)
+        os.chdir(workdir.name)
+
+    def make_cache(self, name=CACHE_NAME, **kwargs):
+        cache = self.cache_class(name, **kwargs)
+        if name is None:
+            self.addCleanup(clean_cache_file, f'cache-{cache.name}.*')
+        return cache
 
     def __int__(self):
         clean_cache_file()
@@ -22,23 +49,217 @@ class TestPersistentConcurrentCache(TestCase):
         clean_cache_file()
 
     def test_instance(self):
-        cache = PersistentConcurrentCache(CACHE_NAME)
-        self.assertIsInstance(cache, PersistentConcurrentCache)
+        cache = self.make_cache()
+        self.assertIsInstance(cache, self.cache_class)
 
     def test_put_get(self):
-        cache = PersistentConcurrentCache(CACHE_NAME)
+        cache = self.make_cache()
         cache["x"] = "y"
         self.assertEqual("y", cache["x"])
 
     def test_put_if_absent(self):
-        cache = PersistentConcurrentCache()
+        cache = self.make_cache(None)
         cache.put_if_absent("x", "y")
         self.assertEqual("y", cache["x"])
 
     def test_fs_backup(self):
-        cache = PersistentConcurrentCache(CACHE_NAME)
+        cache = self.make_cache()
         cache["x"] = "y"
+        filename = cache.filename
         del cache
-        self.assertTrue(os.path.isfile(CACHE_FILE))
-        cache = PersistentConcurrentCache(CACHE_NAME)
+        self.assertTrue(os.path.isfile(filename))
+        cache = self.make_cache()
         self.assertEqual("y", cache["x"])
+
+    def test_get_pop_keys(self):
+        clean_cache_file()
+        cache = self.make_cache()
+        cache["x"] = b"y"
+        self.assertEqual(["x"], cache.keys())
+        self.assertEqual(b"y", cache.get("x"))
+        self.assertEqual(b"y", cache.pop("x"))
+        self.assertIsNone(cache.pop("x"))
+        self.assertEqual("default", cache.get("x", "default"))
+        self.assertEqual(0, len(cache))
+
+    def test_expiry(self):
+        clean_cache_file()
+        cache = self.make_cache(ttl=1)
+        cache["x"] = "y"
+        time.sleep(1.1)
+        self.assertFalse(cache.exists("x"))
+        with self.assertRaises(KeyError):
+            cache["x"]
+
+    def test_get_if_valid(self):
+        cache = self.make_cache()
+        cache["x"] = "y"
+        self.assertEqual("y", cache.get_if_valid("x"))
+        self.assertIsNone(cache.get_if_valid("missing"))
+
+    def test_ttl_jitter(self):
+        clean_cache_file()
+        cache = self.make_cache(ttl=1000, ttl_jitter=0.5)
+        before = time.time()
+        for i in range(20):
+            cache[str(i)] = i
+        expiries = {cache.get_with_expiry(str(i))[1] for i in range(20)}
+        self.assertTrue(all(before + 500 <= expires <= time.time() + 1000 for expires in expiries))
+        self.assertGreater(len(expiries), 1)
+        self.assertIsNone(cache.get_with_expiry("missing"))
+
+    def test_peek(self):
+        cache = self.make_cache(ttl=1)
+        cache["x"] = "y"
+        self.assertEqual("y", cache.peek("x"))
+        self.assertEqual("default", cache.peek("missing", "default"))
+        time.sleep(1.1)
+        self.assertIsNone(cache.peek("x"))
+
+    def test_get_stale(self):
+        clean_cache_file()
+        cache = self.make_cache(ttl=1, grace=60)
+        cache["x"] = "y"
+        time.sleep(1.1)
+        self.assertIsNone(cache.get_if_valid("x"))
+        self.assertEqual("y", cache.get_stale("x")[0])
+        self.assertIsNone(cache.get_stale("missing"))
+
+    def test_sweep(self):
+        clean_cache_file()
+        cache = self.make_cache(ttl=1)
+        cache["x"] = "y"
+        time.sleep(1.1)
+        CacheSweeper([cache]).sweep()
+        self.assertEqual(0, cache.stats()["entries"])
+        self.assertEqual(1, cache.stats()["expirations"])
+        self.assertEqual(0, metrics.snapshot()["gauges"][f"cache.{cache.name}.entries"])
+
+    def test_clear(self):
+        cache = self.make_cache()
+        cache["x"] = "y"
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+
+class TestSqliteCache(CacheTestCases, TestCase):
+    cache_class = SqliteCache
+
+    def test_shared_between_instances(self):
+        clean_cache_file()
+        first = self.make_cache()
+        second = self.make_cache()
+        first["x"] = "y"
+        self.assertEqual("y", second["x"])
+
+    def test_expire(self):
+        clean_cache_file()
+        cache = self.make_cache(ttl=1, maxsize=1)
+        cache["x"] = "y"
+        cache["z"] = "y"
+        self.assertEqual(1, cache.expire())
+        time.sleep(1.1)
+        self.assertEqual(1, cache.expire())
+
+    def test_connections_closed_with_their_thread(self):
+        # Given
+        clean_cache_file()
+        cache = self.make_cache()
+        cache["x"] = "y"
+
+        # When
+        for _ in range(50):
+            thread = threading.Thread(target=cache.get, args=("x",))
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        # Then
+        self.assertEqual(1, cache.connections)
+        self.assertEqual("y", cache["x"])
+        cache.close()
+        self.assertEqual(0, cache.connections)
+
+
+class TestPersistentConcurrentCache(CacheTestCases, TestCase):
+    cache_class = PersistentConcurrentCache
+
+    def test_shards(self):
+        cache = self.make_cache(persist=False, shards=4, maxsize=100)
+        for i in range(8):
+            cache[str(i)] = i
+        self.assertEqual(sorted(str(i) for i in range(8)), sorted(cache.keys()))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_evictions(self):
+        cache = self.make_cache(persist=False, shards=1, maxsize=2)
+        for key in "abc":
+            cache[key] = key
+        cache.get_if_valid("c")
+        cache.get_if_valid("a")
+        self.assertEqual({"entries": 2, "hits": 1, "misses": 1, "evictions": 1, "expirations": 0}, cache.stats())
+
+    def test_peek_is_not_counted(self):
+        cache = self.make_cache(persist=False)
+        cache["x"] = "y"
+        cache.peek("x")
+        cache.peek("missing")
+        self.assertEqual((0, 0), (cache.stats()["hits"], cache.stats()["misses"]))
+
+    def test_byte_budget(self):
+        cache = self.make_cache(persist=False, shards=1, max_bytes=10000)
+        for i in range(100):
+            cache[str(i)] = os.urandom(60)
+        self.assertLess(len(cache), 100)
+        self.assertLessEqual(cache.stats()["bytes"], 10000)
+        self.assertEqual(100 - len(cache), cache.stats()["evictions"])
+
+    def test_concurrent_writers(self):
+        cache = self.make_cache(persist=False, maxsize=10000)
+
+        def writer(prefix):
+            for i in range(1000):
+                cache[f"{prefix}{i}"] = i
+
+        threads = [threading.Thread(target=writer, args=(prefix,)) for prefix in "abcd"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, len(cache))
+
+    def test_journal_replay_without_flush(self):
+        clean_cache_file()
+        cache = PersistentConcurrentCache(CACHE_NAME)
+        cache["x"] = "y"
+        cache["z"] = "y"
+        cache.pop("z")
+        # a second instance sees the journal as left by a killed process
+        self.assertEqual("y", PersistentConcurrentCache(CACHE_NAME, persist=True).get("x"))
+        self.assertIsNone(PersistentConcurrentCache(CACHE_NAME).get("z"))
+
+    def test_compaction(self):
+        clean_cache_file()
+        cache = PersistentConcurrentCache(CACHE_NAME, compact_threshold=2)
+        cache["x"] = "y"
+        self.assertFalse(os.path.isfile(CACHE_FILE))
+        cache["z"] = "y"
+        self.assertTrue(os.path.isfile(CACHE_FILE))
+        self.assertEqual(0, os.path.getsize(JOURNAL_FILE))
+
+    def test_expiry_survives_restart(self):
+        clean_cache_file()
+        cache = PersistentConcurrentCache(CACHE_NAME, ttl=1)
+        cache["x"] = "y"
+        cache.flush()
+        time.sleep(1.1)
+        self.assertEqual(0, len(PersistentConcurrentCache(CACHE_NAME)))
+
+    def test_legacy_snapshot(self):
+        clean_cache_file()
+        legacy = cachetools.TTLCache(maxsize=10, ttl=60)
+        legacy["x"] = "y"
+        with open(CACHE_FILE, "wb") as fs:
+            pickle.dump(legacy, fs)
+        self.assertEqual("y", PersistentConcurrentCache(CACHE_NAME)["x"])
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+import unittest
+
+from bridge.config import ENV_PATH, Config, ConfigError, ConfigStore
+
+
+class TestConfig(unittest.TestCase):
+    def test_defaults(self):
+        config = Config({})
+        self.assertEqual("memory", config.cache_backend)
+        self.assertEqual(12 * 60 * 60, config.cache_ttl)
+        self.assertEqual(2345, config.cache_max_size)
+        self.assertEqual(config.salt, config.cache_key)
+        self.assertTrue(config.headless)
+        self.assertEqual(["images", "fonts", "media"], config.block_resources)
+        self.assertEqual([], config.block_urls)
+        self.assertEqual(0, config.pool_contexts_per_browser)
+        self.assertEqual(0, config.cache_early_expiry)
+        self.assertEqual(0.1, Config({"cache_refresh_ahead": "true"}).cache_early_expiry)
+
+    def test_parsing(self):
+        config = Config({"cache_backend": "SQLite", "cache_ttl": "1", "salt": "00ff", "cache_fsync": "true"})
+        self.assertEqual("sqlite", config.cache_backend)
+        self.assertEqual(0, config.cache_max_size)
+        self.assertEqual(60 * 60, config.cache_ttl)
+        self.assertEqual(b"\x00\xff", config.salt)
+        self.assertTrue(config.cache_fsync)
+
+    def test_validation(self):
+        for values in ({"port": "ldap"}, {"salt": "nothex"}, {"auth_engine": "curl"}, {"headless": "yes"},
+                       {"block_resources": "images,scripts"}, {"page_load_strategy": "fast"},
+                       {"pool_contexts_per_browser": "-1"}, {"cache_max_size": "0"}, {"negative_cache_size": "0"}):
+            with self.assertRaises(ConfigError):
+                Config(values)
+
+    def test_unbounded_cache_size(self):
+        self.assertEqual(0, Config({"cache_backend": "sqlite", "cache_max_size": "0"}).cache_max_size)
+        self.assertEqual(0, Config({"cache_max_size": "0", "cache_max_bytes": "1000000"}).cache_max_size)
+
+    def test_prefork_shares_sqlite_cache(self):
+        self.assertEqual("sqlite", Config({"server_processes": "4"}).cache_backend)
+        with self.assertRaises(ConfigError):
+            Config({"server_processes": "0", "cache_backend": "memory"})
+
+
+class TestConfigStore(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".env")
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        self.write("xttl=5\n")
+
+    def write(self, content):
+        with open(self.path, "w") as file:
+            file.write(content)
+
+    def test_default_path_is_project_root(self):
+        self.assertTrue(os.path.isabs(ENV_PATH))
+        self.assertTrue(os.path.isfile(os.path.join(os.path.dirname(ENV_PATH), "server.py")))
+
+    def test_environment_overrides_file(self):
+        self.write("xttl=5\nport=1234\n")
+        config = ConfigStore(self.path, {"xttl": "7"}).current
+        self.assertEqual(7, config.xttl)
+        self.assertEqual(1234, config.port)
+
+    def test_reload(self):
+        # Given
+        store = ConfigStore(self.path, {})
+        before = store.current
+        reloaded = []
+        store.subscribe(reloaded.append)
+
+        # When
+        self.write("xttl=9\n")
+        self.assertTrue(store.reload())
+
+        # Then
+        self.assertEqual(5, before.xttl)
+        self.assertEqual(9, store.current.xttl)
+        self.assertEqual([store.current], reloaded)
+
+    def test_invalid_reload_keeps_current(self):
+        store = ConfigStore(self.path, {})
+        self.assertEqual(5, store.current.xttl)
+        self.write("xttl=slow\n")
+        self.assertFalse(store.reload())
+        self.assertEqual(5, store.current.xttl)
+
+    def test_watch(self):
+        # Given
+        store = ConfigStore(self.path, {})
+        store.watch(1)
+        self.addCleanup(store.shutdown)
+
+        # When
+        self.write("xttl=9\n")
+        os.utime(self.path, (time.time() + 10, time.time() + 10))
+
+        # Then
+        deadline = time.time() + 5
+        while store.current.xttl != 9 and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(9, store.current.xttl)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from bridge.credentials import CredentialHasher
+
+
+class TestCredentialHasher(unittest.TestCase):
+    def setUp(self):
+        self.hasher = CredentialHasher(b"secret", rounds=4)
+
+    def test_lookup_key(self):
+        self.assertEqual(self.hasher.lookup_key("bob"), self.hasher.lookup_key("bob"))
+        self.assertNotEqual(self.hasher.lookup_key("bob"), self.hasher.lookup_key("alice"))
+        self.assertNotEqual(self.hasher.lookup_key("bob"), CredentialHasher(b"other").lookup_key("bob"))
+        self.assertFalse(CredentialHasher.is_legacy_key(self.hasher.lookup_key("bob")))
+
+    def test_verify(self):
+        verifier = self.hasher.verifier("password")
+        self.assertTrue(self.hasher.verify("password", verifier))
+        self.assertFalse(self.hasher.verify("wrong", verifier))
+        self.assertFalse(self.hasher.verify("password", None))
+        self.assertFalse(self.hasher.verify("password", "not a verifier"))
+
+    def test_legacy(self):
+        self.assertTrue(CredentialHasher.is_legacy_key(self.hasher.legacy_key("bob")))
+        self.assertEqual(self.hasher.legacy_verifier("password"), self.hasher.legacy_verifier("password"))
+
+
+if __name__ == '__main__':
+    unittest.main()
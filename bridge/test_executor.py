@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+
+from bridge.executor import BoundedExecutor
+from bridge.metrics import metrics
+from ldapserver import exceptions
+
+
+class TestBoundedExecutor(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_run(self):
+        executor = BoundedExecutor("test", workers=2)
+        self.assertEqual(3, executor.run(lambda x, y: x + y, 1, 2))
+        self.assertEqual(1, metrics.counter("test.completed"))
+        self.assertEqual(0, executor.queued)
+        executor.shutdown()
+
+    def test_error_propagates(self):
+        executor = BoundedExecutor("test", workers=1)
+
+        def failing():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            executor.run(failing)
+        executor.shutdown()
+
+    def test_busy_past_wait_budget(self):
+        # Given
+        executor = BoundedExecutor("test", workers=1, max_wait=0.1)
+        release = threading.Event()
+        blocker = threading.Thread(target=executor.run, args=(release.wait, 5))
+        blocker.start()
+
+        # When
+        with self.assertRaises(exceptions.LDAPBusy):
+            executor.run(lambda: None)
+        release.set()
+        blocker.join()
+
+        # Then
+        self.assertEqual(1, metrics.counter("test.timeouts"))
+        self.assertEqual(0, executor.queued)
+        executor.shutdown()
+
+    def test_busy_when_queue_full(self):
+        executor = BoundedExecutor("test", workers=1, max_wait=5, max_queue=1)
+        running = threading.Event()
+        release = threading.Event()
+        blocker = threading.Thread(target=executor.run, args=(lambda: running.set() or release.wait(5),))
+        blocker.start()
+        running.wait(5)
+        waiter = threading.Thread(target=executor.run, args=(lambda: None,))
+        waiter.start()
+        while executor.queued == 0:
+            pass
+
+        with self.assertRaises(exceptions.LDAPBusy):
+            executor.run(lambda: None)
+        release.set()
+        blocker.join()
+        waiter.join()
+        self.assertEqual(1, metrics.counter("test.rejected"))
+        executor.shutdown()
+
+    def test_submit(self):
+        executor = BoundedExecutor("test", workers=1, max_queue=1)
+        release = threading.Event()
+        running = executor.submit(release.wait, 5)
+        queued = executor.submit(lambda: 42)
+        with self.assertRaises(exceptions.LDAPBusy):
+            executor.submit(lambda: None)
+        release.set()
+        self.assertEqual(42, queued.result(5))
+        self.assertTrue(running.result(5))
+        executor.shutdown()
+        self.assertEqual(2, metrics.counter("test.completed"))
+
+    def test_submit_past_wait_budget(self):
+        # Given
+        executor = BoundedExecutor("test", workers=1, max_wait=0.1)
+        release = threading.Event()
+        running = executor.submit(release.wait, 5)
+        queued = executor.submit(lambda: 42)
+        time.sleep(0.2)
+
+        # When
+        fresh = executor.submit(lambda: 43)
+
+        # Then
+        with self.assertRaises(exceptions.LDAPBusy):
+            queued.result(1)
+        release.set()
+        self.assertTrue(running.result(5))
+        self.assertEqual(43, fresh.result(5))
+        self.assertEqual(1, metrics.counter("test.timeouts"))
+        self.assertEqual(0, executor.queued)
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
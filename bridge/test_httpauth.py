@@ -0,0 +1,130 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from bridge.config import ConfigStore
+from bridge.httpauth import FormError, HttpFormAuthenticator, Page
+
+USERNAME_PAGE = """<html><body>
+<form method="post" action="/login">
+  <input type="hidden" name="ctx" value="abc">
+  <input type="email" name="loginfmt">
+  <input type="submit" value="Next">
+</form></body></html>"""
+
+PASSWORD_PAGE = """<html><body>
+<div class="error">{error}</div>
+<form method="post" action="/sts?wa=signin">
+  <input type="hidden" name="UserName" value="{username}">
+  <input id="passwordInput" type="password" name="Password">
+  <span id="submitButton" class="submit">Sign in</span>
+</form></body></html>"""
+
+AUTO_POST_PAGE = """<html><body onload="document.forms[0].submit()">
+<form method="post" name="hiddenform" action="/landed">
+  <input type="hidden" name="wresult" value="token-for-{username}">
+  <noscript><input type="submit" value="Submit"></noscript>
+</form></body></html>"""
+
+LANDED_PAGE = """<html><body><div id="m365AppsData">{username}</div></body></html>"""
+
+PORTAL_ENV = {
+    "xusername": "//*[@type='email']",
+    "xsubmit1": "//*[@type='submit']",
+    "xpassword": '//*[@id="passwordInput"]',
+    "xsubmit2": '//*[@id="submitButton"]',
+    "xlanded": '//*[@id="m365AppsData"]',
+    "landed_url_pattern": "/landed",
+}
+
+
+class StandInPortal(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return {name: values[0] for name, values in parse_qs(self.rfile.read(length).decode()).items()}
+
+    def _html(self, html):
+        body = html.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect(self, location):
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/":
+            self._html(USERNAME_PAGE)
+        elif self.path.startswith("/sts"):
+            self._html(PASSWORD_PAGE.format(error="", username=parse_qs(self.path.split("?")[1])["user"][0]))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        form = self._form()
+        if self.path == "/login" and form.get("ctx") == "abc":
+            self._redirect(f"/sts?user={form['loginfmt']}")
+        elif self.path.startswith("/sts"):
+            if form.get("Password") == "secret":
+                self._html(AUTO_POST_PAGE.format(username=form["UserName"]))
+            else:
+                self._html(PASSWORD_PAGE.format(error="Incorrect user ID or password", username=form["UserName"]))
+        elif self.path == "/landed" and form.get("wresult", "").startswith("token-for-"):
+            self._html(LANDED_PAGE.format(username=form["wresult"][len("token-for-"):]))
+        else:
+            self.send_error(400)
+
+
+class TestHttpFormAuthenticator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.portal = ThreadingHTTPServer(("127.0.0.1", 0), StandInPortal)
+        threading.Thread(target=cls.portal.serve_forever, daemon=True).start()
+        cls.env = dict(PORTAL_ENV, portal_url=f"http://127.0.0.1:{cls.portal.server_port}/")
+        cls.authenticator = HttpFormAuthenticator(config=ConfigStore(None, cls.env))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.authenticator.shutdown()
+        cls.portal.shutdown()
+        cls.portal.server_close()
+
+    def test_granted(self):
+        self.assertTrue(self.authenticator.do_web_auth("bob@eduvaud.ch", "secret"))
+
+    def test_denied(self):
+        self.assertFalse(self.authenticator.do_web_auth("bob@eduvaud.ch", "marely"))
+
+    def test_missing_field(self):
+        authenticator = HttpFormAuthenticator(config=ConfigStore(None, dict(self.env, xusername="//*[@id='nope']")))
+        with self.assertRaises(FormError):
+            authenticator.do_web_auth("bob@eduvaud.ch", "secret")
+
+
+class TestPage(unittest.TestCase):
+    def test_find_and_form_of(self):
+        page = Page("http://portal/", PASSWORD_PAGE.format(error="", username="bob"))
+        field = page.find('//*[@id="passwordInput"]')
+        self.assertEqual("Password", field.get("name"))
+        self.assertEqual("/sts?wa=signin", page.form_of(field).get("action"))
+
+    def test_form_data(self):
+        page = Page("http://portal/", """<form><input name="a" value="1"><input type="checkbox" name="b">
+            <input type="checkbox" name="c" checked><select name="d"><option value="x">
+            <option value="y" selected></select><textarea name="e">text</textarea>
+            <input type="submit" name="go"></form>""")
+        self.assertEqual({"a": "1", "c": "on", "d": "y", "e": "text"},
+                         HttpFormAuthenticator._form_data(next(page.forms())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from bridge import journal
+from bridge.journal import CacheJournal
+
+
+class TestCacheJournal(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.workdir.name, "cache-test.journal")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_append_replay(self):
+        log = CacheJournal(self.filename)
+        log.open()
+        log.append(journal.PUT, "x", "y", 42.0)
+        log.append(journal.DELETE, "x")
+        log.close()
+        self.assertEqual([(journal.PUT, "x", "y", 42.0), (journal.DELETE, "x", None, None)],
+                         list(CacheJournal(self.filename).replay()))
+
+    def test_torn_record_is_ignored(self):
+        log = CacheJournal(self.filename)
+        log.open()
+        log.append(journal.PUT, "x", "y", 42.0)
+        log.append(journal.PUT, "z", "y", 42.0)
+        log.close()
+        with open(self.filename, "r+b") as fs:
+            fs.truncate(os.path.getsize(self.filename) - 3)
+        self.assertEqual([(journal.PUT, "x", "y", 42.0)], list(CacheJournal(self.filename).replay()))
+
+        # records appended after a restart are replayed on the next one
+        log = CacheJournal(self.filename)
+        list(log.replay())
+        log.open()
+        log.append(journal.PUT, "w", "y", 42.0)
+        log.close()
+        self.assertEqual(["x", "w"], [key for _, key, _, _ in CacheJournal(self.filename).replay()])
+
+    def test_rotate_keeps_unfinished_compaction(self):
+        log = CacheJournal(self.filename)
+        log.open()
+        log.append(journal.PUT, "a", 1, 42.0)
+        log.rotate()
+        log.append(journal.PUT, "b", 2, 42.0)
+        log.rotate()
+        log.append(journal.PUT, "c", 3, 42.0)
+        log.close()
+        self.assertEqual(["a", "b", "c"], [key for _, key, _, _ in CacheJournal(self.filename).replay()])
+        log.discard_rotated()
+        self.assertEqual(["c"], [key for _, key, _, _ in CacheJournal(self.filename).replay()])
+
+    def test_write_atomically(self):
+        snapshot = os.path.join(self.workdir.name, "cache-test.pickle")
+        journal.write_atomically(snapshot, {"version": 2})
+        self.assertEqual({"version": 2}, journal.read_snapshot(snapshot))
+        self.assertFalse(os.path.isfile(f"{snapshot}.tmp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
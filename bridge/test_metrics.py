@@ -0,0 +1,42 @@
+import json
+import unittest
+
+from bridge.metrics import Histogram, Metrics, MetricsReporter
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counters_and_gauges(self):
+        registry = Metrics()
+        registry.increment("binds")
+        registry.increment("binds", 2)
+        registry.gauge("depth", 4)
+        snapshot = registry.snapshot()
+        self.assertEqual(3, snapshot["counters"]["binds"])
+        self.assertEqual(4, snapshot["gauges"]["depth"])
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in (0.002, 0.003, 0.004, 0.2, 40):
+            histogram.observe(value)
+        self.assertEqual(5, histogram.count)
+        self.assertEqual(0.005, histogram.percentile(0.5))
+        self.assertEqual(40, histogram.percentile(0.99))
+
+    def test_reset(self):
+        registry = Metrics()
+        registry.observe("latency", 0.1)
+        registry.reset()
+        self.assertIsNone(registry.histogram("latency"))
+
+    def test_report_labels(self):
+        registry = Metrics()
+        registry.increment("binds")
+        with self.assertLogs("MetricsReporter") as logs:
+            MetricsReporter(0, registry, {"worker": 1}).report()
+        report = json.loads(logs.records[0].getMessage())
+        self.assertEqual(1, report["worker"])
+        self.assertEqual(1, report["counters"]["binds"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import threading
+import time
+import unittest
+
+from bridge.pool import DriverPool
+
+
+class FakeDriver:
+    def __init__(self, memory=1):
+        self.memory = memory
+        self.resets = 0
+        self.quitted = False
+
+    def quit(self):
+        self.quitted = True
+
+
+class FakeFactory:
+    def __init__(self, memory=1):
+        self.memory = memory
+        self.drivers = []
+
+    def __call__(self):
+        driver = FakeDriver(self.memory)
+        self.drivers.append(driver)
+        return driver
+
+
+def reset(driver):
+    driver.resets += 1
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("condition not met")
+        time.sleep(0.01)
+
+
+class TestDriverPool(unittest.TestCase):
+    def test_warmup(self):
+        factory = FakeFactory()
+        pool = DriverPool(factory, size=3, warmup=2)
+        pool.start(wait=True)
+        self.assertEqual(2, len(factory.drivers))
+        self.assertEqual(2, pool.idle)
+
+    def test_reuse_and_reset(self):
+        factory = FakeFactory()
+        pool = DriverPool(factory, size=1, warmup=0, reset=reset)
+        with pool.driver() as first:
+            pass
+        with pool.driver() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(2, first.resets)
+        self.assertEqual(1, len(factory.drivers))
+
+    def test_retired_after_max_uses(self):
+        factory = FakeFactory()
+        pool = DriverPool(factory, size=1, warmup=0, max_uses=2)
+        for _ in range(3):
+            with pool.driver():
+                pass
+        self.assertEqual(2, len(factory.drivers))
+        self.assertTrue(factory.drivers[0].quitted)
+        self.assertFalse(factory.drivers[1].quitted)
+
+    def test_retired_above_memory_threshold(self):
+        factory = FakeFactory(memory=600)
+        pool = DriverPool(factory, size=1, warmup=0, memory_probe=lambda driver: driver.memory, max_memory_mb=500)
+        with pool.driver() as driver:
+            pass
+        self.assertTrue(driver.quitted)
+        self.assertEqual(0, len(pool))
+
+    def test_retired_on_error(self):
+        factory = FakeFactory()
+        pool = DriverPool(factory, size=1, warmup=0)
+        with self.assertRaises(ValueError):
+            with pool.driver():
+                raise ValueError()
+        self.assertTrue(factory.drivers[0].quitted)
+        self.assertEqual(0, len(pool))
+
+    def test_bounded(self):
+        factory = FakeFactory()
+        pool = DriverPool(factory, size=1, warmup=0)
+        with pool.driver():
+            with self.assertRaises(TimeoutError):
+                with pool.driver(timeout=0.1):
+                    pass
+
+    def test_waiter_gets_released_driver(self):
+        factory = FakeFactory()
+        pool = DriverPool(factory, size=1, warmup=0)
+        got = []
+        with pool.driver() as driver:
+            thread = threading.Thread(target=lambda: got.append(pool.driver(timeout=5).__enter__()))
+            thread.start()
+        thread.join()
+        self.assertEqual([driver], got)
+
+    def test_shutdown(self):
+        factory = FakeFactory()
+        pool = DriverPool(factory, size=2, warmup=2)
+        pool.start(wait=True)
+        pool.shutdown()
+        self.assertTrue(all(driver.quitted for driver in factory.drivers))
+        with self.assertRaises(RuntimeError):
+            with pool.driver():
+                pass
+
+    def test_retired_through_dispose(self):
+        factory = FakeFactory()
+        disposed = []
+        pool = DriverPool(factory, size=1, warmup=0, max_uses=1,
+                          dispose=lambda driver, healthy: disposed.append((driver, healthy)))
+        with pool.driver() as driver:
+            pass
+        with self.assertRaises(RuntimeError):
+            with pool.driver() as failed:
+                raise RuntimeError("browser crashed")
+        self.assertEqual([(driver, True), (failed, False)], disposed)
+        self.assertFalse(driver.quitted)
+
+    def test_idle_drivers_are_primed(self):
+        # Given
+        primes = []
+        pool = DriverPool(FakeFactory(), size=1, warmup=1, reset=reset, prime=primes.append)
+        pool.start(wait=True)
+        wait_for(lambda: len(primes) == 1 and pool.idle == 1)
+
+        # When
+        with pool.driver() as driver:
+            self.assertIs(primes[0], driver)
+
+        # Then
+        wait_for(lambda: len(primes) == 2 and pool.idle == 1)
+        self.assertEqual(1, driver.resets)
+        pool.shutdown()
+
+    def test_stale_primed_drivers_are_refreshed(self):
+        primes = []
+        pool = DriverPool(FakeFactory(), size=1, warmup=1, prime=primes.append, prime_max_age=0.1)
+        pool.start(wait=True)
+        wait_for(lambda: len(primes) >= 2)
+        self.assertEqual(1, len(set(map(id, primes))))
+        pool.shutdown()
+
+    def test_failing_prime_retires_driver(self):
+        factory = FakeFactory()
+
+        def prime(driver):
+            raise TimeoutError
+
+        pool = DriverPool(factory, size=1, warmup=1, prime=prime)
+        pool.start(wait=True)
+        wait_for(lambda: len(pool) == 0)
+        self.assertTrue(factory.drivers[0].quitted)
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import signal
+import socket
+import time
+import unittest
+
+from bridge.prefork import PreforkSupervisor, listening_socket
+
+
+def worker_pid(address):
+    deadline = time.time() + 5
+    while True:
+        try:
+            with socket.create_connection(address, timeout=1) as connection:
+                return int(connection.recv(16))
+        except (OSError, ValueError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def serve_pid(address):
+    def serve(index, sock):
+        if sock is None:
+            sock = listening_socket(address, reuse_port=True)
+        while True:
+            connection, _ = sock.accept()
+            connection.sendall(str(os.getpid()).encode())
+            connection.close()
+    return serve
+
+
+class TestPrefork(unittest.TestCase):
+    def test_reuse_port(self):
+        first = listening_socket(("127.0.0.1", 0), reuse_port=True)
+        second = listening_socket(first.getsockname(), reuse_port=True)
+        self.assertEqual(first.getsockname(), second.getsockname())
+        first.close()
+        second.close()
+
+    def test_workers_are_restarted(self):
+        # Given
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            address = probe.getsockname()
+        supervisor = os.fork()
+        if supervisor == 0:
+            try:
+                PreforkSupervisor(serve_pid(address), 2, address).run()
+            finally:
+                os._exit(0)
+        self.addCleanup(os.waitpid, supervisor, 0)
+        self.addCleanup(os.kill, supervisor, signal.SIGTERM)
+        pid = worker_pid(address)
+
+        # When
+        os.kill(pid, signal.SIGKILL)
+
+        # Then
+        deadline = time.time() + 5
+        pids = set()
+        while len(pids - {pid}) < 2 and time.time() < deadline:
+            pids.add(worker_pid(address))
+        self.assertEqual(2, len(pids - {pid}))
+
+    def test_gives_up_on_workers_failing_at_start(self):
+        # Given
+        def serve(index, sock):
+            raise OSError("cannot start")
+        supervisor = os.fork()
+        if supervisor == 0:
+            try:
+                os._exit(PreforkSupervisor(serve, 2, ("127.0.0.1", 0), backoff=0.01, max_quick_exits=3).run())
+            finally:
+                os._exit(2)
+
+        # When
+        _, status = os.waitpid(supervisor, 0)
+
+        # Then
+        self.assertEqual(1, os.waitstatus_to_exitcode(status))
+
+    def test_port_conflict_fails_before_forking(self):
+        with listening_socket(("127.0.0.1", 0)) as taken:
+            with self.assertRaises(OSError):
+                PreforkSupervisor(serve_pid(taken.getsockname()), 2, taken.getsockname()).run()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,13 @@
+import asyncio
+import threading
+import time
 import unittest
 
+import bcrypt
+
+from bridge.cache import PersistentConcurrentCache
+from bridge.config import ConfigStore
+from bridge.credentials import LEGACY_SALT, CredentialHasher
 from bridge.proxy import LdapProxy
 from bridge.web import WebAuthenticator
 from ldapserver import exceptions
@@ -13,8 +21,7 @@ class MyTestCase(unittest.TestCase):
         mock_authenticator = mock.Mock()
         authenticator.do_web_auth = mock_authenticator
         mock_authenticator.return_value = True
-        proxy = LdapProxy(authenticator)
-        proxy.cache.clear()
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False))
         self.assertEqual(0, len(proxy.cache))
 
         # When
@@ -23,9 +30,311 @@ class MyTestCase(unittest.TestCase):
         # Then
         self.assertEqual(1, len(proxy.cache))
 
+    def test_concurrent_binds_share_one_web_auth(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = lambda username, password: time.sleep(1) or True
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False))
+        threads = [threading.Thread(target=proxy.do_auth, args=("bob@eduvaud.ch", "password")) for _ in range(5)]
+
+        # When
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Then
+        authenticator.do_web_auth.assert_called_once_with("bob@eduvaud.ch", "password")
+
+    def test_negative_cache(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.return_value = False
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False))
+
+        # When
+        for _ in range(2):
+            with self.assertRaises(exceptions.LDAPInvalidCredentials):
+                proxy.do_auth("bob@eduvaud.ch", "wrong")
+
+        # Then
+        authenticator.do_web_auth.assert_called_once()
+        self.assertEqual(1, len(proxy.negative_cache))
+
+    def test_negative_cache_invalidated_on_success(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = lambda username, password: password == "right"
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False))
+        with self.assertRaises(exceptions.LDAPInvalidCredentials):
+            proxy.do_auth("bob@eduvaud.ch", "wrong")
+
+        # When
+        proxy.do_auth("bob@eduvaud.ch", "right")
+
+        # Then
+        self.assertEqual(0, len(proxy.negative_cache))
+
+    def test_refresh_ahead(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.return_value = True
+        config = ConfigStore(None, {"cache_early_expiry": "100", "cache_refresh_ahead": "true"})
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False, ttl=60), config)
+        proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # When
+        proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # Then
+        authenticator.do_web_auth.assert_called_once()
+        proxy.start()
+        deadline = time.time() + 5
+        while authenticator.do_web_auth.call_count < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        proxy.shutdown()
+        self.assertEqual(2, authenticator.do_web_auth.call_count)
+        self.assertEqual(1, len(proxy.cache))
+
+    def test_early_expiry_drops_entry_no_longer_accepted(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = [True, False]
+        config = ConfigStore(None, {"cache_early_expiry": "100"})
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False, ttl=60), config)
+        proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # When
+        with self.assertRaises(exceptions.LDAPInvalidCredentials):
+            proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # Then
+        self.assertEqual(0, len(proxy.cache))
+
+    def test_breaker_fails_fast(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = TimeoutError
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False),
+                          ConfigStore(None, {"breaker_failures": "2"}))
+        for _ in range(2):
+            with self.assertRaises(exceptions.LDAPOther):
+                proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # When
+        with self.assertRaises(exceptions.LDAPUnavailable):
+            proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # Then
+        self.assertEqual(2, authenticator.do_web_auth.call_count)
+
+    def test_wrong_passwords_back_off(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.return_value = False
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False),
+                          ConfigStore(None, {"admission_backoff_after": "2", "admission_backoff_base": "60"}))
+        for password in ("wrong1", "wrong2"):
+            with self.assertRaises(exceptions.LDAPInvalidCredentials):
+                proxy.do_auth("bob@eduvaud.ch", password, client_ip="10.0.0.1")
+
+        # When
+        with self.assertRaises(exceptions.LDAPBusy):
+            proxy.do_auth("bob@eduvaud.ch", "wrong3", client_ip="10.0.0.1")
+
+        # Then
+        self.assertEqual(2, authenticator.do_web_auth.call_count)
+
+    def test_backoff_spares_cache_hits(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = lambda username, password: password == "right"
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False),
+                          ConfigStore(None, {"admission_backoff_after": "2", "admission_backoff_base": "60"}))
+        proxy.do_auth("bob@eduvaud.ch", "right", client_ip="10.0.0.1")
+        for password in ("wrong1", "wrong2"):
+            with self.assertRaises(exceptions.LDAPInvalidCredentials):
+                proxy.do_auth("bob@eduvaud.ch", password, client_ip="10.0.0.2")
+        with self.assertRaises(exceptions.LDAPBusy):
+            proxy.do_auth("bob@eduvaud.ch", "wrong3", client_ip="10.0.0.2")
+
+        # When
+        proxy.do_auth("bob@eduvaud.ch", "right", client_ip="10.0.0.1")
+        # negative cache hits are answered, and not counted as failures
+        with self.assertRaises(exceptions.LDAPInvalidCredentials):
+            proxy.do_auth("bob@eduvaud.ch", "wrong1", client_ip="10.0.0.2")
+
+        # Then
+        self.assertEqual(3, authenticator.do_web_auth.call_count)
+
+    def test_user_rate_limit_spares_cache_hits(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.return_value = True
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False),
+                          ConfigStore(None, {"admission_user_rate": "1", "admission_user_burst": "1"}))
+
+        # When
+        for _ in range(5):
+            proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # Then
+        authenticator.do_web_auth.assert_called_once()
+        with self.assertRaises(exceptions.LDAPBusy):
+            proxy.do_auth("bob@eduvaud.ch", "new password")
+
+    def test_hits_do_not_wait_behind_misses(self):
+        # Given
+        release = threading.Event()
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = lambda username, password: username == "bob@eduvaud.ch" \
+            or release.wait(5)
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False),
+                          ConfigStore(None, {"slow_lane_workers": "1", "cache_early_expiry": "0"}))
+        proxy.do_auth("bob@eduvaud.ch", "password")
+        miss = threading.Thread(target=proxy.do_auth, args=("alice@eduvaud.ch", "password"))
+        miss.start()
+        while proxy.slow_lane.queued == 0 and authenticator.do_web_auth.call_count < 2:
+            time.sleep(0.01)
+
+        # When
+        proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # Then
+        self.assertTrue(miss.is_alive())
+        release.set()
+        miss.join()
+
+    def test_wrong_password_of_cached_user_waits_on_slow_lane(self):
+        # Given
+        release = threading.Event()
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = lambda username, password: password == "password" \
+            and (username == "bob@eduvaud.ch" or release.wait(5))
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False),
+                          ConfigStore(None, {"slow_lane_workers": "1", "slow_lane_max_wait": "200",
+                                             "cache_early_expiry": "0"}))
+        proxy.do_auth("bob@eduvaud.ch", "password")
+        miss = threading.Thread(target=proxy.do_auth, args=("alice@eduvaud.ch", "password"))
+        miss.start()
+        while authenticator.do_web_auth.call_count < 2:
+            time.sleep(0.01)
+
+        # When
+        with self.assertRaises(exceptions.LDAPBusy):
+            proxy.do_auth("bob@eduvaud.ch", "wrong")
+
+        # Then
+        release.set()
+        miss.join()
+        self.assertEqual(2, authenticator.do_web_auth.call_count)
+        with self.assertRaises(exceptions.LDAPInvalidCredentials):
+            proxy.do_auth("bob@eduvaud.ch", "wrong")
+
+    def test_do_auth_async(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = lambda username, password: password == "right"
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False),
+                          ConfigStore(None, {"cache_early_expiry": "0"}))
+
+        # When
+        asyncio.run(proxy.do_auth_async("bob@eduvaud.ch", "right"))
+        asyncio.run(proxy.do_auth_async("bob@eduvaud.ch", "right"))
+
+        # Then
+        authenticator.do_web_auth.assert_called_once()
+        with self.assertRaises(exceptions.LDAPInvalidCredentials):
+            asyncio.run(proxy.do_auth_async("bob@eduvaud.ch", "wrong"))
+
+    def test_do_auth_async_keeps_cache_lookups_off_the_loop(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.return_value = True
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False))
+        threads = []
+        get_with_expiry = proxy.cache.get_with_expiry
+        proxy.cache.get_with_expiry = lambda *args: threads.append(threading.current_thread()) \
+            or get_with_expiry(*args)
+
+        # When
+        asyncio.run(proxy.do_auth_async("bob@eduvaud.ch", "password"))
+
+        # Then
+        self.assertTrue(threads)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    def test_stale_entry_served_while_portal_unavailable(self):
+        # Given
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.side_effect = [True, TimeoutError, TimeoutError]
+        config = ConfigStore(None, {"cache_stale_grace": "1", "cache_early_expiry": "0"})
+        proxy = LdapProxy(authenticator, PersistentConcurrentCache(persist=False, ttl=1, grace=60), config)
+        proxy.do_auth("bob@eduvaud.ch", "password")
+        time.sleep(1.1)
+
+        # When
+        proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # Then
+        self.assertEqual(2, authenticator.do_web_auth.call_count)
+        # a wrong password has no stale entry to fall back on
+        with self.assertRaises(exceptions.LDAPOther):
+            proxy.do_auth("bob@eduvaud.ch", "wrong")
+        self.assertEqual(3, authenticator.do_web_auth.call_count)
+
+    def test_legacy_entry_is_migrated(self):
+        # Given
+        salt = bytes.fromhex(LEGACY_SALT)
+        cache = PersistentConcurrentCache(persist=False)
+        cache[bcrypt.hashpw(b"bob@eduvaud.ch", salt).hex()] = bcrypt.hashpw(b"password", salt).hex()
+        authenticator = mock.Mock()
+        proxy = LdapProxy(authenticator, cache, ConfigStore(None, {"salt": LEGACY_SALT}))
+
+        # When
+        proxy.do_auth("bob@eduvaud.ch", "password")
+        proxy.do_auth("bob@eduvaud.ch", "password")
+
+        # Then
+        authenticator.do_web_auth.assert_not_called()
+        self.assertEqual(1, len(cache))
+        self.assertIsInstance(cache.get(cache.keys()[0]), bytes)
+
+    def test_expired_legacy_entries_stop_migration(self):
+        # Given
+        salt = bytes.fromhex(LEGACY_SALT)
+        cache = PersistentConcurrentCache(persist=False, ttl=1)
+        cache[bcrypt.hashpw(b"bob@eduvaud.ch", salt).hex()] = bcrypt.hashpw(b"password", salt).hex()
+        authenticator = mock.Mock()
+        authenticator.do_web_auth.return_value = True
+        proxy = LdapProxy(authenticator, cache, ConfigStore(None, {"salt": LEGACY_SALT}))
+        time.sleep(1.1)
+
+        # When
+        proxy._sweeper.sweep()
+        with mock.patch.object(CredentialHasher, "legacy_key") as legacy_key:
+            proxy.do_auth("alice@eduvaud.ch", "password")
+
+        # Then
+        legacy_key.assert_not_called()
+        authenticator.do_web_auth.assert_called_once()
+
+    def test_lifecycle_flushes_cache(self):
+        # Given
+        cache = mock.MagicMock()
+        proxy = LdapProxy(mock.Mock(), cache)
+
+        # When
+        proxy.start()
+        proxy.flush()
+        proxy.shutdown()
+
+        # Then
+        self.assertEqual(2, cache.flush.call_count)
+
     def test_no_eduvaud(self):
         try:
-            LdapProxy().do_auth("bob@gmail.ch", "password")
+            LdapProxy(cache=PersistentConcurrentCache(persist=False)).do_auth("bob@gmail.ch", "password")
             self.fail()
         except exceptions.LDAPInvalidCredentials:
             pass
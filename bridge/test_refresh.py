@@ -0,0 +1,55 @@
+import threading
+import time
+import unittest
+
+from bridge.refresh import BackgroundRefresher
+
+
+class TestBackgroundRefresher(unittest.TestCase):
+    def test_refresh(self):
+        # Given
+        refreshed = []
+        done = threading.Event()
+        refresher = BackgroundRefresher(lambda key, value: refreshed.append((key, value)) or done.set())
+        refresher.start()
+
+        # When
+        refresher.submit("key", "value")
+
+        # Then
+        self.assertTrue(done.wait(5))
+        refresher.shutdown()
+        self.assertEqual([("key", "value")], refreshed)
+
+    def test_pending_keys_are_deduplicated_and_bounded(self):
+        refresher = BackgroundRefresher(lambda key: None, max_queue=2)
+        self.assertTrue(refresher.submit("a"))
+        self.assertTrue(refresher.submit("a"))
+        self.assertTrue(refresher.submit("b"))
+        self.assertFalse(refresher.submit("c"))
+        self.assertEqual(2, len(refresher))
+
+    def test_rate_limit_and_busy(self):
+        # Given
+        refreshed = []
+        busy = threading.Event()
+        busy.set()
+        refresher = BackgroundRefresher(lambda key: refreshed.append(key), rate=60, busy=busy.is_set)
+        refresher.submit("a")
+        refresher.submit("b")
+
+        # When
+        refresher.start()
+        time.sleep(0.3)
+        waited_while_busy = list(refreshed)
+        busy.clear()
+        time.sleep(0.3)
+        refresher.shutdown()
+
+        # Then
+        self.assertEqual([], waited_while_busy)
+        self.assertEqual(["a"], refreshed)
+
+
+if __name__ == '__main__':
+    unittest.main()
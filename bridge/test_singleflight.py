@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+
+from bridge.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_do(self):
+        self.assertEqual(3, SingleFlight().do("key", lambda x, y: x + y, 1, 2))
+
+    def test_concurrent_calls_are_coalesced(self):
+        # Given
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return True
+
+        def worker():
+            results.append(flight.do("key", slow))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+
+        # When
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # Then
+        self.assertEqual(1, len(calls))
+        self.assertEqual([True] * 5, results)
+        self.assertEqual(0, len(flight))
+
+    def test_error_is_shared(self):
+        # Given
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        errors = []
+        barrier = threading.Barrier(5)
+
+        def failing():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            raise ValueError()
+
+        def worker():
+            barrier.wait(5)
+            try:
+                flight.do("key", failing)
+            except ValueError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+
+        # When
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # Then
+        self.assertEqual(1, len(calls))
+        self.assertEqual(5, len(errors))
+        self.assertEqual(1, len(set(map(id, errors))))
+        self.assertEqual(0, len(flight))
+
+    def test_distinct_keys(self):
+        flight = SingleFlight()
+        self.assertEqual(1, flight.do("a", lambda: 1))
+        self.assertEqual(2, flight.do("b", lambda: 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
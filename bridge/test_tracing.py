@@ -0,0 +1,35 @@
+import unittest
+
+from bridge.executor import BoundedExecutor
+from bridge.metrics import metrics
+from bridge.tracing import current_trace, span, traced
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_span_without_trace(self):
+        with span("phase"):
+            pass
+        self.assertEqual(1, metrics.histogram("phase_seconds").count)
+
+    def test_trace_follows_executors(self):
+        executor = BoundedExecutor("test", workers=1)
+
+        def phase():
+            with span("phase"):
+                pass
+
+        with self.assertLogs("trace") as logs, traced("abc") as trace:
+            executor.run(phase)
+            executor.submit(phase).result(5)
+        executor.shutdown()
+
+        self.assertEqual(["phase", "phase"], [name for name, _ in trace.spans])
+        self.assertIn('"trace_id": "abc"', logs.output[0])
+        self.assertIsNone(current_trace.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import contextlib
+import json
+import time
+import unittest
+from unittest import mock
+
+from bridge.config import ConfigStore
+from bridge.metrics import metrics
+from bridge.tracing import traced
+from bridge.web import WebAuthenticator, blocked_url_patterns, transferred_bytes
+
+SETTINGS = {"portal_url": "https://portal", "xusername": "//user", "xsubmit1": "//next", "xpassword": "//password",
+            "xsubmit2": "//submit", "xlanded": "//apps", "xfailed": "//error", "landed_url_pattern": "office",
+            "xttl": "5"}
+
+
+class FakePool:
+    def __init__(self, driver):
+        self._driver = driver
+
+    @contextlib.contextmanager
+    def driver(self):
+        yield self._driver
+
+
+def fake_driver(markers):
+    """Selenium driver stub: every element is found at once, markers appear after the submit"""
+    driver = mock.MagicMock()
+    driver.current_url = "https://login"
+    driver.find_elements.side_effect = lambda by, xpath: [mock.Mock()] if xpath in markers else []
+    return driver
+
+
+class TestWebLogin(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def login(self, markers, settings=SETTINGS):
+        driver = fake_driver(markers)
+        authenticator = WebAuthenticator(FakePool(driver), ConfigStore(None, settings))
+        started = time.perf_counter()
+        return authenticator.do_web_auth("bob@eduvaud.ch", "password"), time.perf_counter() - started
+
+    def test_failure_marker_ends_wait(self):
+        granted, elapsed = self.login({"//error"})
+        self.assertFalse(granted)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(1, metrics.counter("web.outcome.failed"))
+        self.assertGreater(metrics.counter("web.failed_saved_ms"), 4000)
+
+    def test_landed(self):
+        driver = fake_driver({"//apps"})
+        authenticator = WebAuthenticator(FakePool(driver), ConfigStore(None, SETTINGS))
+        clicks = []
+
+        def click():
+            clicks.append(1)
+            if len(clicks) == 2:  # the password submit lands on the apps page
+                driver.current_url = "https://office"
+
+        driver.find_element.return_value.click.side_effect = click
+        self.assertTrue(authenticator.do_web_auth("bob@eduvaud.ch", "password"))
+        self.assertEqual(1, metrics.counter("web.outcome.granted"))
+
+    def test_primed_driver_skips_portal_load(self):
+        driver = fake_driver({"//user", "//error"})
+        authenticator = WebAuthenticator(FakePool(driver), ConfigStore(None, SETTINGS))
+        self.assertFalse(authenticator.do_web_auth("bob@eduvaud.ch", "password"))
+        driver.get.assert_not_called()
+
+    def test_phases_are_traced(self):
+        with traced("abc") as trace:
+            self.login({"//error"})
+        self.assertEqual(["web.portal_load", "web.home_realm", "web.password", "web.landing"],
+                         [name for name, _ in trace.spans])
+        self.assertEqual(1, metrics.histogram("web.home_realm_seconds").count)
+
+    def test_timeout_without_marker(self):
+        granted, elapsed = self.login(set(), dict(SETTINGS, xttl="1"))
+        self.assertFalse(granted)
+        self.assertGreaterEqual(elapsed, 1)
+        self.assertEqual(1, metrics.counter("web.outcome.timeout"))
+
+    def test_transfer_stats(self):
+        driver = fake_driver({"//error"})
+        finished = {"message": json.dumps({"message": {"method": "Network.loadingFinished",
+                                                       "params": {"encodedDataLength": 1500.0}}})}
+        received = {"message": json.dumps({"message": {"method": "Network.responseReceived", "params": {}}})}
+        driver.get_log.side_effect = [[finished], [finished, received, finished]]
+        authenticator = WebAuthenticator(FakePool(driver), ConfigStore(None, dict(SETTINGS, web_transfer_stats="true")))
+        authenticator.do_web_auth("bob@eduvaud.ch", "password")
+        # the traffic before the login is not counted
+        self.assertEqual(3000, metrics.counter("web.transferred_bytes"))
+        self.assertEqual(1, metrics.counter("web.transfer_logins"))
+
+    def test_blocked_url_patterns(self):
+        patterns = blocked_url_patterns(["fonts"], ["*telemetry*"])
+        self.assertIn("*.woff*", patterns)
+        self.assertNotIn("*.png*", patterns)
+        self.assertEqual("*telemetry*", patterns[-1])
+        self.assertEqual([], blocked_url_patterns([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import contextlib
+import contextvars
+import json
+import logging
+import time
+from typing import List, Tuple
+
+from bridge.metrics import metrics
+
+logger = logging.getLogger("trace")
+
+
+class Trace:
+    """Timing spans of one bind, tied to the ``trace_id`` of its LDAP connection"""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans = []  # type: List[Tuple[str, float]]
+
+    def record(self) -> dict:
+        return {"trace_id": self.trace_id, "spans": [[name, round(seconds, 6)] for name, seconds in self.spans]}
+
+
+#: Trace of the bind being served, propagated to the executors by :class:`bridge.executor.BoundedExecutor`
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Times a phase: observed as the ``<name>_seconds`` histogram, and added to the current trace if any"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe(f"{name}_seconds", elapsed)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, elapsed))
+
+
+@contextlib.contextmanager
+def traced(trace_id: str):
+    """Collects the spans of a bind, logged as one JSON record when it ends: at INFO level when it reached
+    the portal (had spans), DEBUG otherwise"""
+    trace = Trace(trace_id)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        level = logging.INFO if trace.spans else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps(trace.record()))
@@ -1,7 +1,8 @@
+import json
 import logging
-import os
+import time
+from typing import Union
 
-from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.common import TimeoutException
 from selenium.webdriver.chrome.options import Options
@@ -9,103 +10,271 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 
+from bridge.authenticator import Authenticator
+from bridge.browsers import BrowserFleet
+from bridge.config import ConfigStore, config as default_config
+from bridge.metrics import metrics
+from bridge.pool import DriverPool
+from bridge.tracing import span
 
-class WebAuthenticator:
-    def __init__(self):
+LANDED = "landed"
+FAILED = "failed"
+
+# URL patterns (Network.setBlockedURLs wildcards) of the block_resources types
+RESOURCE_PATTERNS = {
+    "images": ("*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.svg*", "*.ico*", "*.webp*"),
+    "fonts": ("*.woff*", "*.ttf*", "*.otf*", "*.eot*"),
+    "media": ("*.mp4*", "*.webm*", "*.mp3*", "*.ogg*"),
+    "stylesheets": ("*.css*",),
+}
+
+
+class WebAuthenticator(Authenticator):
+    def __init__(self, pool: DriverPool = None, config: ConfigStore = default_config):
         self._logger = logging.getLogger(self.__class__.__qualname__)
+        self._config = config
+        self._fleet = None  # type: Union[None, BrowserFleet]
+        if pool is None:
+            settings = config.current
+            factory, reset, dispose = self._start_driver, reset_driver, None
+            if settings.pool_contexts_per_browser > 0:
+                # pooled drivers share a few Chrome processes, one incognito browser context per login
+                self._fleet = BrowserFleet(self._launch_browser, self._attach_driver,
+                                           settings.pool_contexts_per_browser, setup=self._setup_tab)
+                factory, reset, dispose = self._fleet.open, self._fleet.recycle, self._fleet.close
+            pool = DriverPool(factory,
+                              size=settings.pool_size,
+                              warmup=settings.pool_warmup,
+                              max_uses=settings.pool_max_uses,
+                              reset=reset,
+                              memory_probe=heap_size_mb,
+                              max_memory_mb=settings.pool_max_heap_mb,
+                              prime=self._prime_driver if settings.pool_prime else None,
+                              prime_max_age=settings.pool_prime_max_age,
+                              dispose=dispose)
+        self._pool = pool
 
-    def do_web_auth(self, username, password):
-        load_dotenv()
+    def start(self):
+        self._pool.start()
 
-        self._logger.debug(f"starting WEB auth request for {username}")
+    def shutdown(self):
+        self._pool.shutdown()
+        if self._fleet is not None:
+            self._fleet.shutdown()
+
+    def _start_driver(self):
+        driver = self._launch_browser()
+        self._setup_tab(driver)
+        return driver
 
+    def _launch_browser(self):
+        settings = self._config.current
         options = Options()
         options.add_argument("--incognito")
 
         # Not needed as using xvfb...
         # from https://intoli.com/blog/making-chrome-headless-undetectable/
-        user_agent = os.getenv("ua", None)
+        user_agent = settings.ua
         if user_agent is not None:
             options.add_argument(f'user-agent={user_agent}')
 
-        if os.getenv("detach", 'false').lower() == 'true':
+        if settings.detach:
             options.add_experimental_option("detach", True)
 
-        if os.getenv("headless", 'true').lower() == 'true':
+        if settings.headless:
             options.add_argument('--headless')
 
-        driver = webdriver.Chrome(options=options)
-        self._logger.debug(f"WebDriver started {driver}")
-        # driver.implicitly_wait(int(os.getenv("wait", 5)))
+        # the XPaths only need the DOM: no waiting for, nor downloading, images, fonts, telemetry...
+        options.page_load_strategy = settings.page_load_strategy
+        if "images" in settings.block_resources:
+            options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        if settings.web_transfer_stats:
+            options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
 
-        url = os.getenv("portal_url")
-        self._logger.debug(f"Loading URL {url}")
-        driver.get(url)
-        self._logger.debug(f"Loading URL {url} DONE")
-        # html = driver.page_source
+        return webdriver.Chrome(options=options)
 
-        xttl = int(os.getenv("xttl", 10))
+    def _attach_driver(self, debugger_address):
+        """Driver of an already running browser, the launch options (headless, prefs...) are the browser's"""
+        settings = self._config.current
+        options = Options()
+        options.debugger_address = debugger_address
+        options.page_load_strategy = settings.page_load_strategy
+        if settings.web_transfer_stats:
+            options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        return webdriver.Chrome(options=options)
 
-        # Global ms User part
-        xusername = os.getenv("xusername")
-        self._logger.debug(f"waiting for username field {xusername}")
-        field_username = WebDriverWait(driver, xttl).until(
-            EC.presence_of_element_located((By.XPATH, xusername)))
-        self._logger.debug("->DONE")
+    def _setup_tab(self, driver):
+        """URL blocking is set per tab"""
+        settings = self._config.current
+        blocked = blocked_url_patterns(settings.block_resources, settings.block_urls)
+        if blocked:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
 
-        self._logger.debug(f"filling {field_username}")
-        field_username.send_keys(username)
-        self._logger.debug("->DONE")
+    def do_web_auth(self, username, password):
+        self._logger.debug(f"starting WEB auth request for {username}")
 
-        xsubmit1 = os.getenv("xsubmit1")
-        self._logger.debug(f"waiting for submit {xsubmit1}")
-        button_submit = driver.find_element(By.XPATH, xsubmit1)
-        self._logger.debug("->DONE")
+        started = time.perf_counter()
+        settings = self._config.current
+        try:
+            with self._pool.driver() as driver:
+                if settings.web_transfer_stats:
+                    transferred_bytes(driver)  # drops the traffic before this login (priming)
+                granted, outcome = self._login(driver, username, password, settings)
+                if settings.web_transfer_stats:
+                    metrics.increment("web.transferred_bytes", transferred_bytes(driver))
+                    metrics.increment("web.transfer_logins")
+        except Exception:
+            self._record("error", started)
+            raise
+        self._record(outcome, started)
+        return granted
 
-        self._logger.debug(f"clicking on {button_submit}")
-        button_submit.click()
-        self._logger.debug("->DONE")
+    @staticmethod
+    def _record(outcome: str, started: float):
+        """Outcomes: granted, denied (landed elsewhere), failed (failure marker), timeout (no marker), error"""
+        metrics.increment(f"web.outcome.{outcome}")
+        metrics.observe(f"web.{outcome}_seconds", time.perf_counter() - started)
 
-        # Custom portal
+    def _login(self, driver, username, password, settings):
+        xttl = settings.xttl
 
-        # stores original url
-        login_url = driver.current_url
+        with span("web.portal_load"):
+            # Global ms User part
+            xusername = settings.xusername
+            # primed drivers wait on the login page already
+            primed = driver.find_elements(By.XPATH, xusername)
+            if primed:
+                self._logger.debug("Login page already loaded")
+                field_username = primed[0]
+            else:
+                field_username = self._load_login_page(driver, settings)
 
-        xpassword = os.getenv("xpassword")
-        self._logger.debug(f"waiting for password field {xpassword}")
-        field_password = WebDriverWait(driver, xttl).until(
-            EC.presence_of_element_located((By.XPATH, xpassword)))
-        self._logger.debug(f"filling {xpassword}")
-        field_password.send_keys(password)
-        self._logger.debug("->DONE")
+        # home realm discovery, up to the federated password page
+        with span("web.home_realm"):
+            self._logger.debug(f"filling {field_username}")
+            field_username.send_keys(username)
+            self._logger.debug("->DONE")
 
-        xsubmit2 = os.getenv("xsubmit2")
-        self._logger.debug(f"waiting for {xsubmit2}")
-        button_submit = WebDriverWait(driver, xttl).until(
-            EC.presence_of_element_located((By.XPATH, xsubmit2)))
-        self._logger.debug("->DONE")
+            xsubmit1 = settings.xsubmit1
+            self._logger.debug(f"waiting for submit {xsubmit1}")
+            button_submit = driver.find_element(By.XPATH, xsubmit1)
+            self._logger.debug("->DONE")
+
+            self._logger.debug(f"clicking on {button_submit}")
+            button_submit.click()
+            self._logger.debug("->DONE")
+
+            # Custom portal
+
+            # stores original url
+            login_url = driver.current_url
 
-        self._logger.debug(f"clicking on {button_submit}")
-        button_submit.click()
+            xpassword = settings.xpassword
+            self._logger.debug(f"waiting for password field {xpassword}")
+            field_password = WebDriverWait(driver, xttl).until(
+                EC.presence_of_element_located((By.XPATH, xpassword)))
+
+        with span("web.password"):
+            self._logger.debug(f"filling {xpassword}")
+            field_password.send_keys(password)
+            self._logger.debug("->DONE")
+
+            xsubmit2 = settings.xsubmit2
+            self._logger.debug(f"waiting for {xsubmit2}")
+            button_submit = WebDriverWait(driver, xttl).until(
+                EC.presence_of_element_located((By.XPATH, xsubmit2)))
+            self._logger.debug("->DONE")
+
+            self._logger.debug(f"clicking on {button_submit}")
+            button_submit.click()
+            self._logger.debug("->DONE")
+
+        with span("web.landing"):
+            return self._landing(driver, login_url, settings)
+
+    def _load_login_page(self, driver, settings):
+        url = settings.portal_url
+        self._logger.debug(f"Loading URL {url}")
+        driver.get(url)
+        self._logger.debug(f"Loading URL {url} DONE")
+        # html = driver.page_source
+
+        xusername = settings.xusername
+        self._logger.debug(f"waiting for username field {xusername}")
+        field_username = WebDriverWait(driver, settings.xttl).until(
+            EC.presence_of_element_located((By.XPATH, xusername)))
         self._logger.debug("->DONE")
+        return field_username
 
-        xlanded = os.getenv("xlanded", None)
+    def _prime_driver(self, driver):
+        self._load_login_page(driver, self._config.current)
+
+    def _landing(self, driver, login_url, settings):
+        xttl = settings.xttl
+        xlanded = settings.xlanded
         if xlanded is not None:
+            # a wrong password shows a failure marker long before xttl runs out
+            xfailed = settings.xfailed
+            submitted = time.perf_counter()
             try:
-                self._logger.debug(f"waiting for {xlanded}")
-                WebDriverWait(driver, xttl).until(EC.presence_of_element_located((By.XPATH, xlanded)))
-                self._logger.debug("->DONE")
+                self._logger.debug(f"waiting for {xlanded} or {xfailed}")
+                marker = WebDriverWait(driver, xttl).until(landed_or_failed(xlanded, xfailed))
             except TimeoutException:
                 self._logger.debug("->TIMEOUT")
                 self._logger.debug(f"cannot find {xlanded} in {driver.page_source}")
-                return False
+                return False, "timeout"
+            if marker == FAILED:
+                self._logger.debug("->FAILED")
+                metrics.increment("web.failed_saved_ms", int((xttl - (time.perf_counter() - submitted)) * 1000))
+                return False, "failed"
+            self._logger.debug("->DONE")
 
-        landed_url = driver.current_url.lower()
-        # if login success => go to microsoft portal o365, otherwise stays on eduvaud sts
+        landed_url = driver.current_url
         self._logger.debug(f"Landed url: {landed_url}")
 
-        granted = landed_url != login_url and os.getenv("landed_url_pattern") in landed_url.lower()
+        granted = self.is_landed(login_url, landed_url, settings.landed_url_pattern)
 
         self._logger.debug("user granted")
 
-        return granted
+        return granted, "granted" if granted else "denied"
+
+
+def landed_or_failed(xlanded, xfailed):
+    """Wait condition: FAILED as soon as the ``xfailed`` marker (if any) shows up, LANDED on the ``xlanded`` one"""
+    def condition(driver):
+        if xfailed is not None and driver.find_elements(By.XPATH, xfailed):
+            return FAILED
+        if driver.find_elements(By.XPATH, xlanded):
+            return LANDED
+        return False
+    return condition
+
+
+def blocked_url_patterns(resources, urls):
+    return [pattern for resource in resources for pattern in RESOURCE_PATTERNS[resource]] + list(urls)
+
+
+def transferred_bytes(driver):
+    """Bytes received over the network since the previous call, from the performance log"""
+    total = 0
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        if message["method"] == "Network.loadingFinished":
+            total += message["params"].get("encodedDataLength", 0)
+    return int(total)
+
+
+def reset_driver(driver):
+    """Drops every trace of the previous login (cookies of all domains, storage of the current origin)."""
+    try:
+        driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+    except Exception:
+        pass  # about:blank and some error pages have no storage
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    driver.get("about:blank")
+
+
+def heap_size_mb(driver):
+    heap = driver.execute_script("return window.performance.memory && window.performance.memory.usedJSHeapSize")
+    return None if heap is None else heap / 1024 / 1024
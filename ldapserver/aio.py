@@ -0,0 +1,128 @@
+import asyncio
+import concurrent.futures
+import time
+import typing
+
+from . import asn1, ldap
+from .server import LDAPRequestHandler, reject_critical_controls
+
+__all__ = ['AsyncLDAPServer', 'AsyncLDAPRequestHandler']
+
+class AsyncLDAPServer:
+	'''asyncio alternative to :any:`socketserver.ThreadingTCPServer` for request handler classes
+
+	Connections cost a coroutine instead of a thread while idle. Each one gets
+	its own handler instance, set up as socketserver does but without calling
+	`handle`. Messages are framed with :any:`ldap.ShallowLDAPMessage` and
+	dispatched through the handler's `handle_message` on a bounded executor of
+	`workers` threads, so blocking `do_*` hooks do not stall the event loop.
+	:any:`AsyncLDAPRequestHandler` subclasses may answer some messages on the
+	event loop instead. Messages of a connection are processed one at a time,
+	in order. StartTLS is not supported. `sock` is an already listening socket
+	to serve on instead of `host` and `port`.'''
+
+	DEFAULT_WORKERS = 64
+
+	def __init__(self, handler_class, host='127.0.0.1', port=389, workers=DEFAULT_WORKERS, sock=None):
+		self.handler_class = handler_class
+		self.server_address = (host, port)
+		self.socket = sock
+		self.executor = concurrent.futures.ThreadPoolExecutor(max(1, workers), thread_name_prefix='ldap')
+		self.connections = 0
+		self._server = None
+
+	async def start(self):
+		if self.socket is not None:
+			self._server = await asyncio.start_server(self._handle_connection, sock=self.socket)
+		else:
+			self._server = await asyncio.start_server(self._handle_connection, *self.server_address)
+		self.server_address = self._server.sockets[0].getsockname()[:2]
+		return self._server
+
+	async def serve_forever(self):
+		if self._server is None:
+			await self.start()
+		async with self._server:
+			await self._server.serve_forever()
+
+	def close(self):
+		if self._server is not None:
+			self._server.close()
+		self.executor.shutdown(wait=False)
+
+	async def _handle_connection(self, reader, writer):
+		handler = self.handler_class.__new__(self.handler_class)
+		handler.request = None
+		handler.client_address = writer.get_extra_info('peername')
+		handler.server = self
+		handler.setup()
+		self.connections += 1
+		time_connect = time.perf_counter()
+		handler.logger.info('Connection from %r', handler.client_address)
+		buf = b''
+		try:
+			while handler.keep_running:
+				try:
+					shallowmsg, buf = ldap.ShallowLDAPMessage.from_ber(buf)
+				except asn1.IncompleteBERError:
+					chunk = await reader.read(4096)
+					if not chunk:
+						break
+					buf += chunk
+					continue
+				for respmsg in await self._dispatch(handler, shallowmsg):
+					writer.write(ldap.LDAPMessage.to_ber(respmsg))
+				await writer.drain()
+		except ValueError:
+			handler.logger.exception('Unrecoverable invalid message, closing connection')
+		except ConnectionError:
+			pass
+		finally:
+			self.connections -= 1
+			writer.close()
+			handler.logger.info('Disconnected duration_seconds=%.3f', time.perf_counter() - time_connect)
+
+	async def _dispatch(self, handler, shallowmsg) -> typing.List[ldap.LDAPMessage]:
+		if isinstance(handler, AsyncLDAPRequestHandler):
+			responses = await handler.handle_message_async(shallowmsg)
+			if responses is not None:
+				return responses
+		return await asyncio.get_running_loop().run_in_executor(
+			self.executor, lambda: list(handler.handle_message(shallowmsg)))
+
+class AsyncLDAPRequestHandler(LDAPRequestHandler):
+	''':any:`LDAPRequestHandler` with async variants of its hooks, for :any:`AsyncLDAPServer`
+
+	Authenticated simple binds go through :any:`do_bind_simple_authenticated_async`
+	on the event loop, every other message through the blocking handlers on the
+	server executor.'''
+
+	async def do_bind_simple_authenticated_async(self, dn, password):
+		'''Async variant of :any:`do_bind_simple_authenticated`
+
+		The default implementation runs :any:`do_bind_simple_authenticated` on
+		the server executor.'''
+		return await asyncio.get_running_loop().run_in_executor(
+			self.server.executor, self.do_bind_simple_authenticated, dn, password)
+
+	async def handle_message_async(self, shallowmsg: ldap.ShallowLDAPMessage) -> typing.Optional[typing.List[ldap.LDAPMessage]]:
+		'''Responses to a message handled on the event loop, None to dispatch it through `handle_message`'''
+		if shallowmsg.protocolOpType is not ldap.BindRequest:
+			return None
+		try:
+			msg = shallowmsg.decode()[0]
+		except ValueError:
+			return None
+		op = msg.protocolOp
+		if op.version != 3 or not isinstance(op.authentication, ldap.SimpleAuthentication) \
+				or not op.name or not op.authentication.password:
+			return None
+		self.logger.info('BIND dn=%r', op.name)
+		# As handle_bind does, a simple bind aborts an ongoing SASL dialog
+		self._abort_sasl_bind()
+		try:
+			reject_critical_controls(msg.controls)
+			self.bind_object = await self.do_bind_simple_authenticated_async(op.name, op.authentication.password)
+		except Exception as e: # pylint: disable=broad-except
+			return [self._error_message(shallowmsg.messageID, ldap.BindResponse, e)]
+		return [ldap.LDAPMessage(shallowmsg.messageID, ldap.BindResponse(ldap.LDAPResultCode.success))]
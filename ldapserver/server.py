@@ -108,18 +108,23 @@ class BaseLDAPRequestHandler(socketserver.BaseRequestHandler):
 			for args in handler(msg.protocolOp, msg.controls):
 				response, controls = args if isinstance(args, tuple) else (args, None)
 				yield ldap.LDAPMessage(shallowmsg.messageID, response, controls)
-		except exceptions.LDAPError as e:
-			if response_type is not None:
-				respmsg = ldap.LDAPMessage(shallowmsg.messageID, response_type(e.code, diagnosticMessage=e.message))
-				yield respmsg
-				self.logger.info('Operation aborted, responded with result code "%s" msg="%s"', e.code.name, e.message)
 		except Exception as e: # pylint: disable=broad-except
-			if response_type is not None:
-				respmsg = ldap.LDAPMessage(shallowmsg.messageID, response_type(ldap.LDAPResultCode.other))
+			respmsg = self._error_message(shallowmsg.messageID, response_type, e)
+			if respmsg is not None:
 				yield respmsg
-				self.logger.exception('Uncaught exception, responded with result code "other"')
-			else:
-				self.logger.exception('Uncaught exception, ignored request')
+
+	def _error_message(self, message_id, response_type, error: Exception) -> typing.Optional[ldap.LDAPMessage]:
+		'''Response to an operation that raised `error`, None for operations without response'''
+		if isinstance(error, exceptions.LDAPError):
+			if response_type is None:
+				return None
+			self.logger.info('Operation aborted, responded with result code "%s" msg="%s"', error.code.name, error.message)
+			return ldap.LDAPMessage(message_id, response_type(error.code, diagnosticMessage=error.message))
+		if response_type is None:
+			self.logger.error('Uncaught exception, ignored request', exc_info=error)
+			return None
+		self.logger.error('Uncaught exception, responded with result code "other"', exc_info=error)
+		return ldap.LDAPMessage(message_id, response_type(ldap.LDAPResultCode.other))
 
 	def handle_bind(self, op: ldap.BindRequest, controls=None) -> typing.Iterable[ldap.ProtocolOp]:
 		self.logger.info('BIND %s', op)
@@ -232,7 +237,7 @@ class LDAPRequestHandler(BaseLDAPRequestHandler):
 			yield ldap.BindResponse(resp_code, serverSaslCreds=resp)
 			return
 		# If auth type or SASL method changed, abort SASL dialog
-		self.__bind_sasl_state = None
+		self._abort_sasl_bind()
 		if isinstance(auth, ldap.SimpleAuthentication):
 			self.logger.info('BIND dn=%r', op.name)
 			self.bind_object = self.do_bind_simple(op.name, auth.password)
@@ -255,6 +260,10 @@ class LDAPRequestHandler(BaseLDAPRequestHandler):
 		else:
 			yield from super().handle_bind(op, controls) # pylint: disable=not-an-iterable
 
+	def _abort_sasl_bind(self):
+		'''Drop an ongoing SASL dialog, as any bind other than its next step does'''
+		self.__bind_sasl_state = None
+
 	def do_bind_simple(self, dn='', password=b''):
 		'''Do LDAP BIND with simple authentication
 
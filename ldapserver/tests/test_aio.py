@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from ldapserver import LDAPRequestHandler, ldap, exceptions
+from ldapserver.aio import AsyncLDAPServer, AsyncLDAPRequestHandler
+
+def bind_request(message_id, dn, password):
+	return bytes(ldap.LDAPMessage(message_id, ldap.BindRequest(name=dn, authentication=ldap.SimpleAuthentication(password))))
+
+async def read_message(reader, buf=b''):
+	while True:
+		try:
+			return ldap.LDAPMessage.from_ber(buf)
+		except ldap.asn1.IncompleteBERError:
+			chunk = await reader.read(4096)
+			if not chunk:
+				raise ConnectionError()
+			buf += chunk
+
+class BlockingHandler(LDAPRequestHandler):
+	def do_bind_simple_authenticated(self, dn, password):
+		if password != b'secret':
+			raise exceptions.LDAPInvalidCredentials()
+		return dn
+
+class AsyncHandler(AsyncLDAPRequestHandler):
+	async def do_bind_simple_authenticated_async(self, dn, password):
+		await asyncio.sleep(0)
+		if password != b'secret':
+			raise exceptions.LDAPInvalidCredentials()
+		return dn
+
+class TestAsyncLDAPServer(unittest.IsolatedAsyncioTestCase):
+	async def session(self, handler_class):
+		server = AsyncLDAPServer(handler_class, port=0, workers=2)
+		await server.start()
+		self.addCleanup(server.close)
+		reader, writer = await asyncio.open_connection(*server.server_address)
+		requests = bind_request(1, 'cn=bob', b'secret') + bind_request(2, 'cn=bob', b'wrong')
+		requests += bytes(ldap.LDAPMessage(3, ldap.SearchRequest()))
+		writer.write(requests)
+		await writer.drain()
+		responses = []
+		buf = b''
+		while len(responses) < 3:
+			response, buf = await read_message(reader, buf)
+			responses.append(response)
+		self.assertEqual(1, server.connections)
+		writer.write(bytes(ldap.LDAPMessage(4, ldap.UnbindRequest())))
+		await writer.drain()
+		self.assertEqual(b'', await reader.read())
+		writer.close()
+		return responses
+
+	async def check(self, handler_class):
+		responses = await self.session(handler_class)
+		self.assertEqual([1, 2, 3], [response.messageID for response in responses])
+		self.assertEqual(ldap.LDAPResultCode.success, responses[0].protocolOp.resultCode)
+		self.assertEqual(ldap.LDAPResultCode.invalidCredentials, responses[1].protocolOp.resultCode)
+		self.assertIsInstance(responses[2].protocolOp, ldap.SearchResultDone)
+
+	async def test_blocking_handler(self):
+		await self.check(BlockingHandler)
+
+	async def test_async_handler(self):
+		await self.check(AsyncHandler)
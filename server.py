@@ -1,27 +1,92 @@
+import asyncio
 import logging
 import os
+import signal
 import socketserver
+import sys
+import threading
 
-from dotenv import load_dotenv
-
-import ldapserver
+from ldapserver.aio import AsyncLDAPRequestHandler, AsyncLDAPServer
+from bridge.config import ConfigError, config
+from bridge.metrics import MetricsReporter
+from bridge.prefork import PreforkSupervisor, listening_socket
 from bridge.proxy import LdapProxy
+from bridge.tracing import traced
 
 logger = logging.getLogger(__name__)
 
 
-class RequestHandler(ldapserver.LDAPRequestHandler):
+class RequestHandler(AsyncLDAPRequestHandler):
+    #: Shared :class:`LdapProxy`, created once at server start and injected
+    #: before serving (see ``__main__``)
+    proxy = None  # type: LdapProxy
 
     def do_bind_simple_authenticated(self, dn, password):
         logger.info(f"BIND AUTH for dn: {dn}, passing to proxy")
-        LdapProxy().do_auth(dn, password.decode())
+        with traced(self.trace_id):
+            self.proxy.do_auth(dn, password.decode(), client_ip=self.client_address[0])
+
+    async def do_bind_simple_authenticated_async(self, dn, password):
+        # asyncio server: cache hits run on the server executor, misses on the proxy slow lane
+        logger.info(f"BIND AUTH for dn: {dn}, passing to proxy")
+        with traced(self.trace_id):
+            await self.proxy.do_auth_async(dn, password.decode(), client_ip=self.client_address[0],
+                                           fast_lane=self.server.executor)
+
+
+def serve(settings, sock=None, labels=None):
+    """Serves LDAP until SIGTERM or Ctrl-C, on ``sock`` when given (pre-fork workers)"""
+    RequestHandler.proxy = LdapProxy()
+    RequestHandler.proxy.start()
+    reporter = MetricsReporter(settings.metrics_interval, labels=labels)
+    reporter.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # reloads off the signal handler, which interrupts the main thread
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=config.reload, daemon=True).start())
+    config.watch(settings.config_watch_interval)
+
+    if sock is None:
+        sock = listening_socket((settings.listen, settings.port))
+    if settings.server_mode == "asyncio":
+        # idle connections cost a coroutine, binds run on server_workers threads
+        server = AsyncLDAPServer(RequestHandler, workers=settings.server_workers, sock=sock)
+        serve_forever, server_close = lambda: asyncio.run(server.serve_forever()), server.close
+    else:
+        server = socketserver.ThreadingTCPServer(sock.getsockname(), RequestHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = sock
+        serve_forever, server_close = server.serve_forever, server.server_close
+    try:
+        serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server_close()
+        reporter.shutdown()
+        config.shutdown()
+        RequestHandler.proxy.shutdown()
+
+
+def serve_worker(index, sock):
+    settings = config.current
+    if sock is None:
+        sock = listening_socket((settings.listen, settings.port), reuse_port=True)
+    serve(settings, sock, labels={"worker": index, "pid": os.getpid()})
 
 
 if __name__ == '__main__':
-    load_dotenv()
-    loglevel = os.getenv("log", "INFO")
-    logging.basicConfig(level=loglevel)
-    logging.getLogger().setLevel(loglevel)
+    try:
+        settings = config.current
+    except ConfigError as error:
+        sys.exit(f"Invalid configuration: {error}")
+    processes = settings.server_processes or os.cpu_count()
+    log_format = "%(process)d " + logging.BASIC_FORMAT if processes > 1 else logging.BASIC_FORMAT
+    logging.basicConfig(level=settings.log, format=log_format)
+    logging.getLogger().setLevel(settings.log)
+    config.subscribe(lambda reloaded: logging.getLogger().setLevel(reloaded.log))
 
-    socketserver.ThreadingTCPServer((os.getenv("listen", '127.0.0.1'), int(os.getenv("port", 3890))),
-                                    RequestHandler).serve_forever()
+    if processes > 1:
+        # the credential cache is shared through sqlite, each worker starts its own threads after the fork
+        sys.exit(PreforkSupervisor(serve_worker, processes, (settings.listen, settings.port)).run())
+    else:
+        serve(settings)